@@ -0,0 +1,254 @@
+import os
+import json
+import time
+from collections import OrderedDict
+
+from app.core.logging_config import logger
+
+# Cache configuration (all optional, can be overridden from .env)
+# CACHE_BACKEND: "memory" (in-process LRU with TTL), "redis" (needs redis package and REDIS_URL) or "none"
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_MAX_FIELDS_PER_ENTRY = int(os.getenv("CACHE_MAX_FIELDS_PER_ENTRY", "32"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Every backend stores entries as key -> {field: value}, like Redis hash.
+# One key holds every variant of the same data (e.g. every page of followers of one user),
+# so all of them are invalidated at once by deleting the key.
+# None is never cached, it means miss.
+#
+# Read-through callers take generation(key) after a miss, before reading MongoDB, and pass it to set().
+# delete() bumps the generation, so a value read before an invalidation is not written back afterwards.
+# generation_many(keys) reads many of them at once, e.g. to stamp a value depending on many keys and compare upon read.
+
+class MemoryCache:
+    """In-process LRU cache with TTL. Values are returned as is, callers must not mutate them."""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl_seconds: float = CACHE_TTL_SECONDS,
+                 max_fields_per_entry: int = CACHE_MAX_FIELDS_PER_ENTRY):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_fields_per_entry = max_fields_per_entry
+        # key -> (expires_at, {field: value}), ordered from least to most recently used
+        self.entries = OrderedDict()
+        # key -> generation of its last delete, at most max_entries. Evicted keys get the highest evicted generation,
+        # so a generation seen before a delete never matches again
+        self.generations = OrderedDict()
+        self.generation_counter = 0
+        self.generation_floor = 0
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0, "stale_sets": 0}
+
+    async def get(self, key: str, field: str = ""):
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            del self.entries[key]
+            self.counters["expirations"] += 1
+            entry = None
+        if entry is None or field not in entry[1]:
+            self.counters["misses"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return entry[1][field]
+
+    async def generation(self, key: str) -> int:
+        return self.generations.get(key, self.generation_floor)
+
+    async def generation_many(self, keys: list) -> list:
+        return [self.generations.get(key, self.generation_floor) for key in keys]
+
+    async def set(self, key: str, value, field: str = "", generation: int | None = None):
+        if value is None:
+            return
+        if generation is not None and self.generations.get(key, self.generation_floor) != generation:
+            # Invalidated while the value was read
+            self.counters["stale_sets"] += 1
+            return
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            entry = (time.monotonic() + self.ttl_seconds, {})
+            self.entries[key] = entry
+        fields = entry[1]
+        if field not in fields and len(fields) >= self.max_fields_per_entry:
+            fields.pop(next(iter(fields)))
+        fields[field] = value
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            if self.entries.pop(key, None) is not None:
+                self.counters["invalidations"] += 1
+            self.generation_counter += 1
+            self.generations[key] = self.generation_counter
+            self.generations.move_to_end(key)
+        while len(self.generations) > self.max_entries:
+            _, evicted = self.generations.popitem(last=False)
+            self.generation_floor = max(self.generation_floor, evicted)
+
+    async def clear(self):
+        self.entries.clear()
+        self.generations.clear()
+        self.generation_counter += 1
+        self.generation_floor = self.generation_counter
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "entries": len(self.entries), **self.counters}
+
+# Write the field only if the generation counter (KEYS[2]) is still the one read before
+redis_set_if_generation = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then return 0 end
+redis.call('HSET', KEYS[1], ARGV[2], ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+class RedisCache:
+    """
+    Redis backed cache, entries are Redis hash with TTL and values are stored as JSON.
+    client is redis.asyncio client, or anything with the same async hget / hset / expire / delete / get / mget / eval /
+    pipeline / scan_iter (e.g. local stand-in for tests). Redis error is logged and handled as miss.
+    Generation of each key is a counter next to it, kept for generation_ttl_seconds after its last delete.
+    """
+
+    def __init__(self, client=None, ttl_seconds: float = CACHE_TTL_SECONDS, prefix: str = "ryde:",
+                 generation_ttl_seconds: int = 86400):
+        self._client = client
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.generation_ttl_seconds = generation_ttl_seconds
+        self.counters = {"hits": 0, "misses": 0, "errors": 0, "invalidations": 0, "stale_sets": 0}
+
+    @property
+    def client(self):
+        if self._client is None:
+            # Optional dependency, only needed when CACHE_BACKEND=redis
+            import redis.asyncio as redis
+            self._client = redis.from_url(REDIS_URL)
+        return self._client
+
+    async def get(self, key: str, field: str = ""):
+        try:
+            raw = await self.client.hget(self.prefix + key, field)
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.warning(f"Cache get failed ({key}): {e}")
+            return None
+        if raw is None:
+            self.counters["misses"] += 1
+            return None
+        self.counters["hits"] += 1
+        return json.loads(raw)
+
+    def generation_key(self, key: str) -> str:
+        return self.prefix + "generation:" + key
+
+    async def generation(self, key: str) -> int:
+        try:
+            raw = await self.client.get(self.generation_key(key))
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.warning(f"Cache generation failed ({key}): {e}")
+            # Never matches, the value is not cached
+            return -1
+        return int(raw or 0)
+
+    async def generation_many(self, keys: list) -> list:
+        if not keys:
+            return []
+        try:
+            raws = await self.client.mget([self.generation_key(key) for key in keys])
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.warning(f"Cache generations failed ({len(keys)} keys): {e}")
+            return [-1] * len(keys)
+        return [int(raw or 0) for raw in raws]
+
+    async def set(self, key: str, value, field: str = "", generation: int | None = None):
+        if value is None:
+            return
+        try:
+            raw = json.dumps(value, default=str)
+            if generation is None:
+                await self.client.hset(self.prefix + key, field, raw)
+                await self.client.expire(self.prefix + key, int(self.ttl_seconds))
+            elif not await self.client.eval(redis_set_if_generation, 2, self.prefix + key, self.generation_key(key),
+                                            str(generation), field, raw, int(self.ttl_seconds)):
+                self.counters["stale_sets"] += 1
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.warning(f"Cache set failed ({key}): {e}")
+
+    async def delete(self, *keys: str):
+        if not keys:
+            return
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.delete(*(self.prefix + key for key in keys))
+                for key in keys:
+                    pipe.incr(self.generation_key(key))
+                    pipe.expire(self.generation_key(key), self.generation_ttl_seconds)
+                await pipe.execute()
+            self.counters["invalidations"] += len(keys)
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.warning(f"Cache delete failed ({len(keys)} keys): {e}")
+
+    async def clear(self):
+        """Delete every entry under prefix (found with SCAN), generations are bumped like any delete."""
+        generation_prefix = self.generation_key("")
+        keys = []
+        try:
+            async for raw in self.client.scan_iter(match=self.prefix + "*", count=1000):
+                name = raw.decode() if isinstance(raw, bytes) else raw
+                if not name.startswith(generation_prefix):
+                    keys.append(name[len(self.prefix):])
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.warning(f"Cache clear failed: {e}")
+            return
+        for start in range(0, len(keys), 1000):
+            await self.delete(*keys[start:start + 1000])
+
+    def stats(self) -> dict:
+        return {"backend": "redis", **self.counters}
+
+class NoCache:
+    """Cache disabled, every get is a miss."""
+
+    async def get(self, key: str, field: str = ""):
+        return None
+
+    async def generation(self, key: str) -> int:
+        return 0
+
+    async def generation_many(self, keys: list) -> list:
+        return [0] * len(keys)
+
+    async def set(self, key: str, value, field: str = "", generation: int | None = None):
+        pass
+
+    async def delete(self, *keys: str):
+        pass
+
+    async def clear(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": "none"}
+
+def create_cache():
+    if CACHE_BACKEND == "memory":
+        return MemoryCache()
+    elif CACHE_BACKEND == "redis":
+        return RedisCache()
+    elif CACHE_BACKEND == "none":
+        return NoCache()
+    raise Exception("CACHE_BACKEND must be 'memory', 'redis' or 'none'")
+
+# Cache in front of the user model
+user_cache = create_cache()
@@ -0,0 +1,56 @@
+import os
+import asyncio
+import weakref
+
+# Maximum number of distinct keys in flight at once per event loop.
+# Once full, new keys are executed directly without coalescing (the table never grows unbounded).
+SINGLE_FLIGHT_MAX_KEYS = int(os.getenv("SINGLE_FLIGHT_MAX_KEYS", "10000"))
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent calls: while a call for a key is in flight, every other call with the same
+    key awaits the same result instead of running it again. Exception is propagated to every caller.
+    The call runs in its own task, so one cancelled caller doesn't cancel the call shared with the others.
+    """
+
+    def __init__(self, name: str, max_keys: int = SINGLE_FLIGHT_MAX_KEYS):
+        self.name = name
+        self.max_keys = max_keys
+        # event loop -> {key: task in flight}
+        self.calls = weakref.WeakKeyDictionary()
+        self.counters = {"calls": 0, "executions": 0, "coalesced": 0, "errors": 0, "overflow": 0}
+
+    async def do(self, key: str, fn):
+        """Run fn() (coroutine function) for key, or join the call for key already in flight."""
+        loop = asyncio.get_running_loop()
+        calls = self.calls.get(loop)
+        if calls is None:
+            calls = {}
+            self.calls[loop] = calls
+        self.counters["calls"] += 1
+
+        task = calls.get(key)
+        if task is not None:
+            self.counters["coalesced"] += 1
+        elif len(calls) >= self.max_keys:
+            self.counters["overflow"] += 1
+            self.counters["executions"] += 1
+            return await fn()
+        else:
+            self.counters["executions"] += 1
+            task = loop.create_task(fn())
+            calls[key] = task
+            task.add_done_callback(lambda done: self.finish(calls, key, done))
+
+        return await asyncio.shield(task)
+
+    def finish(self, calls: dict, key: str, task: asyncio.Task):
+        if calls.get(key) is task:
+            del calls[key]
+        # Retrieve exception, so it is not reported as never retrieved when every caller was cancelled
+        if not task.cancelled() and task.exception() is not None:
+            self.counters["errors"] += 1
+
+    def stats(self) -> dict:
+        in_flight = sum(len(calls) for calls in self.calls.values())
+        return {**self.counters, "in_flight": in_flight}
@@ -0,0 +1,134 @@
+import os
+import asyncio
+import weakref
+
+from app.db.mongo import get_database_session
+from app.core.logging_config import logger
+
+# Batching window configuration (all optional, can be overridden from .env)
+# Lookups by _id issued within LOADER_WINDOW_MS (or until LOADER_MAX_BATCH keys) are sent as one $in query
+LOADER_WINDOW_MS = float(os.getenv("LOADER_WINDOW_MS", "1"))
+LOADER_MAX_BATCH = int(os.getenv("LOADER_MAX_BATCH", "100"))
+
+# Batch size histogram buckets (upper bound inclusive)
+batch_size_buckets = (1, 2, 5, 10, 20, 50, 100)
+
+def new_loader_stats() -> dict:
+    return {
+        "requests": 0,
+        "batches": 0,
+        "keys": 0,
+        "errors": 0,
+        "max_batch_size": 0,
+        "batch_size_histogram": {f"<={bucket}": 0 for bucket in batch_size_buckets} | {f">{batch_size_buckets[-1]}": 0}
+    }
+
+# Stats are shared by every loader with the same name (one loader per event loop)
+_stats = {}
+
+class BatchLoader:
+    """
+    DataLoader-style batching of find by _id. Concurrent load() calls within the window are resolved with
+    one find({"_id": {"$in": [...]}}) and the result is fanned out to every waiting coroutine.
+    Each caller gets its own shallow copy of the document (None if not found).
+    """
+
+    def __init__(self, name: str, collection: str, projection: dict | None = None,
+                 window_ms: float = LOADER_WINDOW_MS, max_batch: int = LOADER_MAX_BATCH):
+        self.name = name
+        self.collection = collection
+        self.projection = projection
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self.pending = {}
+        self.flush_handle = None
+        self.tasks = set()
+        self.stats = _stats.setdefault(name, new_loader_stats())
+
+    async def load(self, key):
+        loop = asyncio.get_running_loop()
+        self.stats["requests"] += 1
+        future = self.pending.get(key)
+        if future is None:
+            future = loop.create_future()
+            self.pending[key] = future
+            if len(self.pending) >= self.max_batch:
+                self.dispatch()
+            elif self.flush_handle is None:
+                if self.window_ms > 0:
+                    self.flush_handle = loop.call_later(self.window_ms / 1000, self.dispatch)
+                else:
+                    self.flush_handle = loop.call_soon(self.dispatch)
+
+        # Shield, so one cancelled caller doesn't cancel the lookup shared with the other callers
+        doc = await asyncio.shield(future)
+        return dict(doc) if doc is not None else None
+
+    async def load_many(self, keys: list) -> list:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def dispatch(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending:
+            return
+        batch = self.pending
+        self.pending = {}
+        task = asyncio.get_running_loop().create_task(self.fetch(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def fetch(self, batch: dict):
+        keys = list(batch.keys())
+        self.record_batch(len(keys))
+        try:
+            found = {}
+            cursor = get_database_session()[self.collection].find({"_id": {"$in": keys}}, self.projection)
+            async for doc in cursor:
+                found[doc["_id"]] = doc
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Loader {self.name} failed to load {len(keys)} keys: {e}")
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(found.get(key))
+
+    def record_batch(self, size: int):
+        self.stats["batches"] += 1
+        self.stats["keys"] += size
+        self.stats["max_batch_size"] = max(self.stats["max_batch_size"], size)
+        histogram = self.stats["batch_size_histogram"]
+        for bucket in batch_size_buckets:
+            if size <= bucket:
+                histogram[f"<={bucket}"] += 1
+                break
+        else:
+            histogram[f">{batch_size_buckets[-1]}"] += 1
+
+# One set of loaders per event loop, like the Mongo client (see app/db/mongo.py)
+_loaders = weakref.WeakKeyDictionary()
+
+def get_loader(name: str, collection: str, projection: dict | None = None) -> BatchLoader:
+    loop = asyncio.get_running_loop()
+    loaders = _loaders.get(loop)
+    if loaders is None:
+        loaders = {}
+        _loaders[loop] = loaders
+    loader = loaders.get(name)
+    if loader is None:
+        loader = BatchLoader(name, collection, projection)
+        loaders[name] = loader
+    return loader
+
+def loader_stats() -> dict:
+    stats = {}
+    for name, counters in _stats.items():
+        average = counters["keys"] / counters["batches"] if counters["batches"] else 0
+        stats[name] = {**counters, "average_batch_size": round(average, 2)}
+    return stats
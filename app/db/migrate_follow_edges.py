@@ -0,0 +1,27 @@
+# Migration tool: move the follow graph from embedded followers / following arrays into "follows" collection.
+#
+# Usage:
+#   python -m app.db.migrate_follow_edges                 # copy edges, keep the arrays
+#   python -m app.db.migrate_follow_edges --unset-arrays  # copy edges, then remove the arrays
+#
+# Run it before switching FOLLOW_STORAGE=edges. Running it again is safe.
+import argparse
+import asyncio
+
+from app.db.mongo import init_db_indexes, close_database_client
+from app.models.follow import backfill_follow_edges
+
+async def main(batch_size: int, unset_arrays: bool):
+    await init_db_indexes()
+    try:
+        result = await backfill_follow_edges(batch_size=batch_size, unset_arrays=unset_arrays)
+    finally:
+        close_database_client()
+    print(result)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill follows collection from embedded follow arrays")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--unset-arrays", action="store_true", help="Remove followers / following arrays from user documents afterwards")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.unset_arrays))
@@ -1,6 +1,12 @@
 import os
+import asyncio
+import weakref
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, GEOSPHERE, IndexModel
+from pymongo.errors import OperationFailure
+
+from app.core.logging_config import logger
 
 # Load environment variables from .env file
 load_dotenv()
@@ -11,16 +17,115 @@ MONGO_URI = os.getenv("MONGO_URI")
 if not MONGO_URI:
     raise Exception("MONGO_URI not found in environment variables")
 
-# For create new session of database everytime called. 
-# This is due to Async Motor Client bug in Windows which make the variable cannot be reused
+DATABASE_NAME = os.getenv("MONGO_DB_NAME", "ryde_users_db")
+
+# Connection pool configuration (all optional, can be overridden from .env)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0")) or None
+
+# One pooled client per event loop.
+# Motor client is bound to the loop it first runs on (the Windows bug mentioned before),
+# so instead of creating new client everytime, the client is shared by every call on the same loop.
+# The entry is dropped automatically once the loop itself is garbage collected.
+_clients = weakref.WeakKeyDictionary()
+
+def _create_client() -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(
+        MONGO_URI,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+    )
+
+def get_client() -> AsyncIOMotorClient:
+    """Return the shared client of the running event loop, creating it on first use."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Called outside of event loop (e.g. scripts), nothing to share with
+        return _create_client()
+
+    client = _clients.get(loop)
+    if client is None:
+        client = _create_client()
+        _clients[loop] = client
+    return client
+
+# Return database handle from the shared client.
+# Cheap to call, no new connection is made per call.
 def get_database_session():
-    client = AsyncIOMotorClient(MONGO_URI)
-    db = client["ryde_users_db"]
-    db["users"].create_index([("location", "2dsphere")])
-    return db
+    return get_client()[DATABASE_NAME]
+
+# Close the shared client of the running event loop (called upon app shutdown)
+def close_database_client():
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    client = _clients.pop(loop, None)
+    if client is not None:
+        client.close()
+
+# Index registry. Every index needed by the models is declared here (or registered by the
+# module which needs it) together with the queries it serves, then created upon app startup.
+# Format: {collection name: [(IndexModel, description of served queries), ...]}
+INDEX_REGISTRY = {}
+
+def register_index(collection: str, keys: list, serves: str, **options):
+    """Declare an index on collection. Options are passed as is to IndexModel (unique, name, ...)."""
+    index = IndexModel(keys, **options)
+    INDEX_REGISTRY.setdefault(collection, []).append((index, serves))
+    return index
+
+register_index("users", [("location", GEOSPHERE)],
+               serves="find_nearby_friends ($near on location)")
+register_index("users", [("username", ASCENDING)], unique=True,
+               serves="create_user / update_user username duplicate check, find_nearby_friends lookup by username")
+register_index("users", [("followers", ASCENDING)],
+               serves="lookup of users followed by an ID (followers array)")
+register_index("users", [("following", ASCENDING)],
+               serves="lookup of users following an ID (following array)")
+register_index("users", [("createdAt", ASCENDING), ("_id", ASCENDING)],
+               serves="list_users keyset pagination (sort and after cursor on createdAt, _id)")
+
+# Diff declared indexes of one collection against the existing ones, then build the missing one.
+async def ensure_collection_indexes(db, collection: str, indexes: list) -> list:
+    existing = {}
+    async for index in db[collection].list_indexes():
+        existing[index["name"]] = index
+
+    missing = []
+    for index, serves in indexes:
+        name = index.document["name"]
+        if name in existing:
+            logger.info(f"Index {collection}.{name} exists. Serves: {serves}")
+        else:
+            logger.info(f"Index {collection}.{name} missing, building in background. Serves: {serves}")
+            missing.append(index)
+
+    created = []
+    # Build one by one so one failing index (e.g. duplicate username data) doesn't block the others
+    for index in missing:
+        name = index.document["name"]
+        try:
+            created += await db[collection].create_indexes([index], background=True)
+            logger.info(f"Index {collection}.{name} created")
+        except OperationFailure as e:
+            logger.error(f"Failed to create index {collection}.{name}: {e}")
+    return created
 
 # Initialization for Index Creation upon app startup
-# Currently the index only 2dspehere for location search 
-async def init_db_indexes():
+# Creates every index in INDEX_REGISTRY which doesn't exist yet
+async def init_db_indexes() -> list:
     db = get_database_session()
-    await db["users"].create_index([("location", "2dsphere")])
\ No newline at end of file
+    created = []
+    for collection, indexes in INDEX_REGISTRY.items():
+        created += await ensure_collection_indexes(db, collection, indexes)
+    return created
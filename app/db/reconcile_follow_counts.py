@@ -0,0 +1,26 @@
+# Maintenance tool: repair follower_count / following_count of user documents from the actual follow lists.
+#
+# Usage:
+#   python -m app.db.reconcile_follow_counts
+#
+# Run it once after upgrading (documents created before the counters existed get them), then from time to
+# time (e.g. cron) to repair drift. Running it while the API is serving is safe.
+import argparse
+import asyncio
+
+from app.db.mongo import init_db_indexes, close_database_client
+from app.models.follow import reconcile_follow_counts
+
+async def main(batch_size: int):
+    await init_db_indexes()
+    try:
+        result = await reconcile_follow_counts(batch_size=batch_size)
+    finally:
+        close_database_client()
+    print(result)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Repair follower / following counters of user documents")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size))
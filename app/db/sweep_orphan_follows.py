@@ -0,0 +1,35 @@
+# Maintenance tool: remove IDs of deleted users still referenced by the follow graph (orphans).
+#
+# Usage:
+#   python -m app.db.sweep_orphan_follows            # find and remove orphans
+#   python -m app.db.sweep_orphan_follows --dry-run  # only report them
+#
+# Deletion normally removes the references in the background (see app/models/cascade.py). This repairs users deleted
+# before it existed, and the cascades lost upon shutdown or failed after every retry. Running it again is safe.
+import argparse
+import asyncio
+
+from app.db.mongo import init_db_indexes, close_database_client
+from app.models.follow import find_orphan_ids
+from app.models.user import delete_cascade
+
+async def main(batch_size: int, dry_run: bool):
+    await init_db_indexes()
+    try:
+        orphan_ids = await find_orphan_ids(batch_size=batch_size)
+        print(f"{len(orphan_ids)} deleted users still referenced")
+        references_removed = 0
+        if not dry_run:
+            delete_cascade.batch_size = batch_size
+            for user_id in orphan_ids:
+                references_removed += await delete_cascade.clean(user_id)
+    finally:
+        close_database_client()
+    print({"orphan_ids": len(orphan_ids), "references_removed": references_removed})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove IDs of deleted users from the follow graph")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true", help="Only count the orphan IDs")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.dry_run))
@@ -1,15 +1,73 @@
+import asyncio
 from fastapi import FastAPI, Request
 from contextlib import asynccontextmanager
 
 from app.routes import user_routes
 from app.core.logging_config import logger
-from app.db.mongo import init_db_indexes
+from app.db.mongo import init_db_indexes, get_client, close_database_client
+from app.core.cache import user_cache
+from app.db.loader import loader_stats
+from app.models.location import location_buffer
+from app.models.live import location_feed
+from app.models.grid import nearby_grid
+from app.models.graph import follow_graph
+from app.models.user import delete_cascade
+from app.models import follow as follow_store
+
+def _log_index_build(task: asyncio.Task):
+    if task.cancelled():
+        logger.warning("MongoDB index build cancelled")
+    elif task.exception():
+        logger.error(f"MongoDB index build failed: {task.exception()}")
+    else:
+        logger.info(f"MongoDB indexes initialized ({len(task.result())} created)")
+
+def _log_grid_load(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error(f"Nearby grid load failed, nearby friends are answered by MongoDB: {task.exception()}")
+
+def _log_graph_build(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error(f"Follow graph snapshot build failed: {task.exception()}")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await init_db_indexes()
-    logger.info("MongoDB indexes initialized")
+    # Open the shared MongoDB client once for the whole app lifetime
+    get_client()
+    # Index build runs in the background, so startup isn't blocked on large collections
+    index_task = asyncio.create_task(init_db_indexes())
+    index_task.add_done_callback(_log_index_build)
+    # Transaction support of follow writes is decided once, so the fallback warning is logged here and not per write
+    try:
+        await follow_store.check_write_transaction()
+    except Exception as e:
+        logger.error(f"MongoDB topology check failed, done again by the first follow write: {e}")
+    # Location pings are written by a periodic flusher
+    location_buffer.ensure_flusher()
+    # References to deleted users are removed by a background worker
+    delete_cascade.ensure_worker()
+    # Nearby grid is filled in the background, nearby friends are answered by MongoDB until it is ready
+    grid_task = None
+    if nearby_grid.enabled:
+        grid_task = asyncio.create_task(nearby_grid.load())
+        grid_task.add_done_callback(_log_grid_load)
+    # Follow graph snapshot (analytics) is built in the background as well
+    graph_task = None
+    if follow_graph.enabled:
+        graph_task = asyncio.create_task(follow_graph.build())
+        graph_task.add_done_callback(_log_graph_build)
     yield
+    if not index_task.done():
+        index_task.cancel()
+    if grid_task is not None and not grid_task.done():
+        grid_task.cancel()
+    if graph_task is not None and not graph_task.done():
+        graph_task.cancel()
+    # Write the pending location pings before closing the client
+    await location_buffer.stop()
+    await delete_cascade.stop()
+    close_database_client()
+    logger.info("MongoDB client closed")
 
 app = FastAPI(
     title="Ryde Interview API",
@@ -39,3 +97,17 @@ app.include_router(user_routes.router, prefix="/users", tags=["Users"])
 def read_root():
     logger.info("Root endpoint called")
     return {"message": "Welcome to the Ryde Interview Test API"}
+
+# Runtime metrics of the API (cache hit / miss, lookup batch size, coalesced reads, ...)
+@app.get("/metrics")
+def read_metrics():
+    return {
+        "user_cache": user_cache.stats(),
+        "loaders": loader_stats(),
+        "single_flight": user_routes.read_flight.stats(),
+        "location_buffer": location_buffer.stats(),
+        "live_nearby": location_feed.stats(),
+        "nearby_grid": nearby_grid.stats(),
+        "follow_graph": follow_graph.stats(),
+        "delete_cascade": delete_cascade.stats()
+    }
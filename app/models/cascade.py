@@ -0,0 +1,139 @@
+import os
+import asyncio
+import time
+from collections import deque
+from app.models import follow as follow_store
+
+from app.core.logging_config import logger
+
+# Delete cascade configuration (all optional, can be overridden from .env)
+DELETE_CASCADE_BATCH_SIZE = int(os.getenv("DELETE_CASCADE_BATCH_SIZE", "1000"))
+DELETE_CASCADE_MAX_ATTEMPTS = int(os.getenv("DELETE_CASCADE_MAX_ATTEMPTS", "5"))
+# Wait before the first retry, doubled on each following retry
+DELETE_CASCADE_RETRY_SECONDS = float(os.getenv("DELETE_CASCADE_RETRY_SECONDS", "1"))
+
+class DeleteCascade:
+    """
+    Queue of deleted users whose ID is still referenced by the follow lists of other users.
+    A background worker removes the references in batches of batch_size users per update_many,
+    then calls invalidate with the updated user IDs (cached profile / follow lists are outdated).
+    A failed job is retried with exponential backoff, after max_attempts it is left to the orphan sweeper
+    (python -m app.db.sweep_orphan_follows). Jobs still queued upon shutdown are left to it as well.
+    """
+
+    def __init__(self, invalidate=None, batch_size: int = DELETE_CASCADE_BATCH_SIZE,
+                 max_attempts: int = DELETE_CASCADE_MAX_ATTEMPTS, retry_seconds: float = DELETE_CASCADE_RETRY_SECONDS):
+        self.invalidate = invalidate
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        # (user ID, attempts so far) of the jobs waiting
+        self.pending = deque()
+        self.worker = None
+        self.wake = None
+        self.run_lock = None
+        # Progress of the job being run
+        self.active = None
+        self.active_removed = 0
+        self.counters = {
+            "enqueued": 0, "completed": 0, "retries": 0, "failed": 0,
+            "batches": 0, "references_removed": 0, "last_job_ms": 0.0, "max_job_ms": 0.0
+        }
+
+    def enqueue(self, user_id: str):
+        """Queue the cascade of a deleted user, it runs in the background."""
+        self.ensure_worker()
+        self.counters["enqueued"] += 1
+        self.pending.append((user_id, 0))
+        self.wake.set()
+
+    # Worker task runs on the event loop of the caller (started lazily, or upon app startup)
+    def ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self.worker is not None and not self.worker.done() and self.worker.get_loop() is loop:
+            return
+        self.wake = asyncio.Event()
+        self.run_lock = asyncio.Lock()
+        self.worker = loop.create_task(self.run())
+
+    async def run(self):
+        while True:
+            await self.wake.wait()
+            self.wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Delete cascade failed: {e}")
+
+    async def flush(self) -> int:
+        """Run every queued job now (waits for the job in progress). Return the number of completed jobs."""
+        self.ensure_worker()
+        async with self.run_lock:
+            return await self.drain()
+
+    async def drain(self) -> int:
+        completed = 0
+        while self.pending:
+            user_id, attempts = self.pending.popleft()
+            try:
+                await self.clean(user_id)
+                completed += 1
+            except Exception as e:
+                attempts += 1
+                if attempts >= self.max_attempts:
+                    self.counters["failed"] += 1
+                    logger.error(f"Delete cascade of user with ID {user_id} failed {attempts} times, left to orphan sweeper: {e}")
+                    continue
+                self.counters["retries"] += 1
+                delay = self.retry_seconds * 2 ** (attempts - 1)
+                logger.warning(f"Delete cascade of user with ID {user_id} failed, retrying in {delay} s: {e}")
+                # MongoDB is likely unavailable for every job, so the whole queue waits
+                self.pending.appendleft((user_id, attempts))
+                await asyncio.sleep(delay)
+        return completed
+
+    async def clean(self, user_id: str) -> int:
+        """Remove every reference to user_id from other users follow lists. Return the number removed."""
+        started = time.perf_counter()
+        self.active = user_id
+        self.active_removed = 0
+        try:
+            for direction in follow_store.count_fields:
+                while True:
+                    updated = await follow_store.pull_deleted_user(user_id, direction, self.batch_size)
+                    if not updated:
+                        break
+                    self.counters["batches"] += 1
+                    self.counters["references_removed"] += len(updated)
+                    self.active_removed += len(updated)
+                    if self.invalidate is not None:
+                        await self.invalidate(updated)
+        finally:
+            self.active = None
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.counters["completed"] += 1
+        self.counters["last_job_ms"] = round(elapsed_ms, 2)
+        self.counters["max_job_ms"] = round(max(self.counters["max_job_ms"], elapsed_ms), 2)
+        logger.info(f"Delete cascade of user with ID {user_id} done ({self.active_removed} references removed)")
+        return self.active_removed
+
+    async def stop(self):
+        """Stop the worker (called upon app shutdown). Queued jobs are left to the orphan sweeper."""
+        if self.worker is not None and not self.worker.done():
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+        self.worker = None
+        if self.pending:
+            logger.warning(f"Delete cascade stopped with {len(self.pending)} jobs queued, run the orphan sweeper to finish them")
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "pending": len(self.pending),
+            "active": self.active,
+            "active_removed": self.active_removed
+        }
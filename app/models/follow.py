@@ -0,0 +1,615 @@
+import os
+from datetime import datetime, timezone
+from pymongo import ASCENDING, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from app.db.mongo import get_client, get_database_session, register_index
+
+from app.core.logging_config import logger
+
+# Storage layout of the follow graph
+# "embedded" : followers / following arrays inside every user document (original layout)
+# "edges"    : one document per follow in "follows" collection (follower_id, target_id, created_at)
+follow_storage_embedded = "embedded"
+follow_storage_edges = "edges"
+follow_storage = os.getenv("FOLLOW_STORAGE", follow_storage_embedded)
+
+if follow_storage not in (follow_storage_embedded, follow_storage_edges):
+    raise Exception(f"FOLLOW_STORAGE must be '{follow_storage_embedded}' or '{follow_storage_edges}'")
+
+# Write both side of embedded follow inside one transaction (needs replica set or sharded cluster).
+# Without it both side are still sent in one bulk_write round-trip, but not atomically.
+follow_write_transaction = os.getenv("FOLLOW_WRITE_TRANSACTION", "false").lower() == "true"
+transaction_topologies = ("ReplicaSetWithPrimary", "Sharded")
+
+# Reference to the MongoDB "users" and "follows" collection
+user_collection_name = "users"
+follow_collection_name = "follows"
+
+register_index(follow_collection_name, [("follower_id", ASCENDING), ("target_id", ASCENDING)], unique=True,
+               serves="follow / unfollow edge existence, no duplicate edge")
+register_index(follow_collection_name, [("follower_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+               serves="following list of a user, ordered by follow time")
+register_index(follow_collection_name, [("target_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+               serves="followers list of a user, ordered by follow time")
+
+def get_user_collection():
+    return get_database_session().get_collection(user_collection_name)
+
+def get_follow_collection():
+    return get_database_session().get_collection(follow_collection_name)
+
+def uses_edges() -> bool:
+    return follow_storage == follow_storage_edges
+
+# Field of edge document for each direction.
+# "followers" of user X are edges with target_id X, the follower is in follower_id, and the other way around.
+edge_fields = {
+    "followers": ("target_id", "follower_id"),
+    "following": ("follower_id", "target_id"),
+}
+
+# Denormalized size of each follow list, kept in user document with $inc only when the list actually changes
+count_fields = {
+    "followers": "follower_count",
+    "following": "following_count",
+}
+
+# Whether FOLLOW_WRITE_TRANSACTION can be honored by the server, decided once (see check_write_transaction)
+write_transaction_ready = None
+
+async def check_write_transaction() -> bool:
+    """
+    Decide once whether follow writes run in a transaction (called upon app startup, otherwise by the first write).
+    Topology stays "Unknown" until the driver has discovered the server, so it is pinged first.
+    """
+    global write_transaction_ready
+    if write_transaction_ready is None:
+        ready = False
+        if follow_write_transaction:
+            client = get_client()
+            await client.admin.command("ping")
+            topology = getattr(client, "topology_description", None)
+            ready = topology is not None and topology.topology_type_name in transaction_topologies
+            if not ready:
+                logger.warning("FOLLOW_WRITE_TRANSACTION is enabled, but MongoDB is not replica set. Writing without transaction.")
+        write_transaction_ready = ready
+    return write_transaction_ready
+
+# Run write(session) against users collection, inside a transaction if enabled and supported (session is None otherwise).
+# with_transaction runs write again on TransientTransactionError (e.g. write conflict of concurrent follows)
+async def run_user_write(write):
+    if await check_write_transaction():
+        async with await get_client().start_session() as session:
+            return await session.with_transaction(write)
+    return await write(None)
+
+# Send update operations of users collection in one bulk_write, inside transaction if enabled and supported.
+# Return number of modified documents
+async def write_user_operations(operations: list) -> int:
+    async def write(session):
+        result = await get_user_collection().bulk_write(operations, ordered=False, session=session)
+        return result.modified_count
+    return await run_user_write(write)
+
+# Add follow edge. Return True if the graph was modified, False if already followed
+async def add_follow(follower_id: str, target_id: str) -> bool:
+    if uses_edges():
+        # Upsert, so existing edge is left untouched. Concurrent duplicate is rejected by the unique index
+        try:
+            result = await get_follow_collection().update_one(
+                {"follower_id": follower_id, "target_id": target_id},
+                {"$setOnInsert": {"created_at": datetime.now(timezone.utc).isoformat()}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        if result.upserted_id is None:
+            return False
+        await write_user_operations([
+            UpdateOne({"_id": follower_id}, {"$inc": {"following_count": 1}}),
+            UpdateOne({"_id": target_id}, {"$inc": {"follower_count": 1}})
+        ])
+        return True
+
+    # Filter only matches if the ID is not in the array yet, so the counter moves with the array
+    modified_count = await write_user_operations([
+        UpdateOne({"_id": follower_id, "following": {"$ne": target_id}},
+                  {"$addToSet": {"following": target_id}, "$inc": {"following_count": 1}}),
+        UpdateOne({"_id": target_id, "followers": {"$ne": follower_id}},
+                  {"$addToSet": {"followers": follower_id}, "$inc": {"follower_count": 1}})
+    ])
+    return modified_count > 0
+
+# Remove follow edge. Return True if the graph was modified, False if wasn't following
+async def remove_follow(follower_id: str, target_id: str) -> bool:
+    if uses_edges():
+        result = await get_follow_collection().delete_one({"follower_id": follower_id, "target_id": target_id})
+        if result.deleted_count == 0:
+            return False
+        await write_user_operations([
+            UpdateOne({"_id": follower_id}, {"$inc": {"following_count": -1}}),
+            UpdateOne({"_id": target_id}, {"$inc": {"follower_count": -1}})
+        ])
+        return True
+
+    modified_count = await write_user_operations([
+        UpdateOne({"_id": follower_id, "following": target_id},
+                  {"$pull": {"following": target_id}, "$inc": {"following_count": -1}}),
+        UpdateOne({"_id": target_id, "followers": follower_id},
+                  {"$pull": {"followers": follower_id}, "$inc": {"follower_count": -1}})
+    ])
+    return modified_count > 0
+
+# Return the IDs (among target_ids) already followed by follower_id
+async def get_followed_among(follower_id: str, target_ids: list) -> set:
+    if uses_edges():
+        cursor = get_follow_collection().find(
+            {"follower_id": follower_id, "target_id": {"$in": target_ids}},
+            {"target_id": 1, "_id": 0}
+        )
+        return {edge["target_id"] async for edge in cursor}
+
+    # Intersection is computed by MongoDB, so the whole following array is not sent back
+    cursor = get_user_collection().aggregate([
+        {"$match": {"_id": follower_id}},
+        {"$project": {"followed": {"$setIntersection": [{"$ifNull": ["$following", []]}, target_ids]}}}
+    ])
+    docs = await cursor.to_list(length=1)
+    return set(docs[0]["followed"]) if docs else set()
+
+# Add many follow edges from one follower. Return the set of newly followed ID
+async def add_follows(follower_id: str, target_ids: list) -> set:
+    if not target_ids:
+        return set()
+
+    if uses_edges():
+        now = datetime.now(timezone.utc).isoformat()
+        try:
+            result = await get_follow_collection().bulk_write([
+                UpdateOne(
+                    {"follower_id": follower_id, "target_id": target_id},
+                    {"$setOnInsert": {"created_at": now}},
+                    upsert=True
+                ) for target_id in target_ids
+            ], ordered=False)
+            upserted = result.upserted_ids.keys()
+        except BulkWriteError as e:
+            # Edge inserted first by a concurrent follow is rejected by the unique index, it is already followed
+            if e.details.get("writeConcernErrors") or any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            upserted = [entry["index"] for entry in e.details.get("upserted", [])]
+        followed = {target_ids[index] for index in upserted}
+        if followed:
+            await write_user_operations([
+                UpdateOne({"_id": follower_id}, {"$inc": {"following_count": len(followed)}}),
+                UpdateMany({"_id": {"$in": list(followed)}}, {"$inc": {"follower_count": 1}})
+            ])
+        return followed
+
+    # 'following' of follower with one pipeline update: only the IDs not in the array yet are appended and counted.
+    # The document before the update tells which targets were already followed (read by the same atomic write).
+    # 'followers' of every target with single update_many. Reverse side is written for every target (not only new one)
+    # to repair half written follow
+    following = {"$ifNull": ["$following", []]}
+    new_ids = {"$filter": {"input": target_ids, "cond": {"$not": [{"$in": ["$$this", following]}]}}}
+
+    async def write(session):
+        before = await get_user_collection().find_one_and_update(
+            {"_id": follower_id},
+            [{"$set": {
+                "following": {"$concatArrays": [following, new_ids]},
+                "following_count": {"$add": [{"$ifNull": ["$following_count", 0]}, {"$size": new_ids}]}
+            }}],
+            projection={"followed": {"$setIntersection": [following, target_ids]}},
+            session=session
+        )
+        await get_user_collection().update_many(
+            {"_id": {"$in": target_ids}, "followers": {"$ne": follower_id}},
+            {"$addToSet": {"followers": follower_id}, "$inc": {"follower_count": 1}},
+            session=session
+        )
+        return before
+
+    before = await run_user_write(write)
+    if before is None:
+        return set()
+    return set(target_ids) - set(before["followed"])
+
+# Remove many follow edges from one follower. Return the set of unfollowed ID
+async def remove_follows(follower_id: str, target_ids: list) -> set:
+    if not target_ids:
+        return set()
+
+    if uses_edges():
+        followed = await get_followed_among(follower_id, target_ids)
+        if not followed:
+            return followed
+        result = await get_follow_collection().delete_many({"follower_id": follower_id, "target_id": {"$in": list(followed)}})
+        operations = [UpdateOne({"_id": follower_id}, {"$inc": {"following_count": -result.deleted_count}})]
+        # Fewer deleted than read means a concurrent unfollow, which target lost a follower is unknown.
+        # Left to reconcile_follow_counts
+        if result.deleted_count == len(followed):
+            operations.append(UpdateMany({"_id": {"$in": list(followed)}}, {"$inc": {"follower_count": -1}}))
+        else:
+            logger.warning(f"Unfollow of user with ID {follower_id} raced, follower_count of targets left to reconciliation")
+        await write_user_operations(operations)
+        return followed
+
+    # Same as add_follows: one pipeline update removes the targets from 'following' (order of the rest is kept) and
+    # subtracts the number actually removed, the document before the update tells which targets were followed
+    following = {"$ifNull": ["$following", []]}
+    followed_ids = {"$setIntersection": [following, target_ids]}
+
+    async def write(session):
+        before = await get_user_collection().find_one_and_update(
+            {"_id": follower_id},
+            [{"$set": {
+                "following": {"$filter": {"input": following, "cond": {"$not": [{"$in": ["$$this", target_ids]}]}}},
+                "following_count": {"$subtract": [{"$ifNull": ["$following_count", 0]}, {"$size": followed_ids}]}
+            }}],
+            projection={"followed": followed_ids},
+            session=session
+        )
+        await get_user_collection().update_many(
+            {"_id": {"$in": target_ids}, "followers": follower_id},
+            {"$pull": {"followers": follower_id}, "$inc": {"follower_count": -1}},
+            session=session
+        )
+        return before
+
+    before = await run_user_write(write)
+    if before is None:
+        return set()
+    return set(before["followed"])
+
+# Get one page of "followers", "following" or "mutuals" (both follow each other) ID of a user. Return (list of ID, total)
+async def get_follow_page(user_id: str, direction: str, limit: int, offset: int = 0) -> tuple:
+    if direction == "mutuals":
+        return await get_mutual_page(user_id, limit, offset)
+
+    if uses_edges():
+        key, other = edge_fields[direction]
+        total = await get_follow_collection().count_documents({key: user_id})
+        cursor = get_follow_collection().find({key: user_id}, {other: 1, "_id": 0}) \
+            .sort([("created_at", 1), ("_id", 1)]) \
+            .skip(offset) \
+            .limit(limit)
+        page = [edge[other] async for edge in cursor]
+        return page, total
+
+    # Only the requested part of the array is sent back by MongoDB ($slice), alongside the array size
+    cursor = get_user_collection().aggregate([
+        {"$match": {"_id": user_id}},
+        {"$project": {
+            "page": {"$slice": [{"$ifNull": [f"${direction}", []]}, offset, limit]},
+            "total": {"$size": {"$ifNull": [f"${direction}", []]}}
+        }}
+    ])
+    docs = await cursor.to_list(length=1)
+    if not docs:
+        return [], 0
+    return docs[0]["page"], docs[0]["total"]
+
+# Page of the users followed by user_id who follow them back, ordered by ID, computed by MongoDB
+async def get_mutual_page(user_id: str, limit: int, offset: int = 0) -> tuple:
+    if uses_edges():
+        # Every following edge is checked for the reverse edge on the unique (follower_id, target_id) index
+        collection = get_follow_collection()
+        pipeline = [
+            {"$match": {"follower_id": user_id}},
+            {"$lookup": {
+                "from": follow_collection_name,
+                "let": {"target": "$target_id"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$and": [
+                        {"$eq": ["$follower_id", "$$target"]}, {"$eq": ["$target_id", user_id]}
+                    ]}}},
+                    {"$limit": 1}
+                ],
+                "as": "back"
+            }},
+            {"$match": {"back.0": {"$exists": True}}},
+            {"$project": {"mutual": "$target_id"}}
+        ]
+    else:
+        collection = get_user_collection()
+        pipeline = [
+            {"$match": {"_id": user_id}},
+            {"$project": {"mutual": {"$setIntersection": [
+                {"$ifNull": ["$following", []]}, {"$ifNull": ["$followers", []]}
+            ]}}},
+            {"$unwind": "$mutual"}
+        ]
+
+    pipeline += [
+        {"$sort": {"mutual": 1}},
+        {"$facet": {
+            "page": [{"$skip": offset}, {"$limit": limit}],
+            "total": [{"$count": "count"}]
+        }}
+    ]
+    docs = await collection.aggregate(pipeline).to_list(length=1)
+    if not docs:
+        return [], 0
+    total = docs[0]["total"][0]["count"] if docs[0]["total"] else 0
+    return [doc["mutual"] for doc in docs[0]["page"]], total
+
+# Whether user_id follows other_id and other_id follows user_id. Return (follows, followed_by)
+async def get_relationship(user_id: str, other_id: str) -> tuple:
+    if uses_edges():
+        cursor = get_follow_collection().find({"$or": [
+            {"follower_id": user_id, "target_id": other_id},
+            {"follower_id": other_id, "target_id": user_id}
+        ]}, {"follower_id": 1, "_id": 0})
+        followers = {edge["follower_id"] async for edge in cursor}
+        return user_id in followers, other_id in followers
+
+    # Membership is checked by MongoDB, so the arrays are not sent back
+    docs = await get_user_collection().aggregate([
+        {"$match": {"_id": user_id}},
+        {"$project": {
+            "follows": {"$in": [other_id, {"$ifNull": ["$following", []]}]},
+            "followed_by": {"$in": [other_id, {"$ifNull": ["$followers", []]}]}
+        }}
+    ]).to_list(length=1)
+    if not docs:
+        return False, False
+    return docs[0]["follows"], docs[0]["followed_by"]
+
+# Get every ID followed by a user. user is the already fetched user document (used by embedded layout)
+async def get_following_ids(user: dict) -> list:
+    if uses_edges():
+        cursor = get_follow_collection().find({"follower_id": user["_id"]}, {"target_id": 1, "_id": 0})
+        return [edge["target_id"] async for edge in cursor]
+    return user.get("following", [])
+
+# Get every follower ID of a user. user is the already fetched user document (used by embedded layout)
+async def get_follower_ids(user: dict) -> list:
+    if uses_edges():
+        cursor = get_follow_collection().find({"target_id": user["_id"]}, {"follower_id": 1, "_id": 0})
+        return [edge["follower_id"] async for edge in cursor]
+    return user.get("followers", [])
+
+# Count the users followed by user_ids (at most fanout followed users taken per user, so very high degree users
+# don't dominate the work), excluding the exclude IDs. Return [(ID, number of user_ids following it)], most first
+async def count_second_hop(user_ids: list, exclude: list, fanout: int, limit: int) -> list:
+    if not user_ids:
+        return []
+
+    if uses_edges():
+        # At most fanout edges are read per user (on the follower_id index), before anything is grouped
+        pipeline = [
+            {"$match": {"_id": {"$in": user_ids}}},
+            {"$lookup": {
+                "from": follow_collection_name,
+                "let": {"follower": "$_id"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$follower_id", "$$follower"]}}},
+                    {"$limit": fanout},
+                    {"$project": {"target_id": 1, "_id": 0}}
+                ],
+                "as": "edges"
+            }},
+            {"$project": {"targets": "$edges.target_id"}},
+        ]
+        collection = get_user_collection()
+    else:
+        pipeline = [
+            {"$match": {"_id": {"$in": user_ids}}},
+            {"$project": {"targets": {"$slice": [{"$ifNull": ["$following", []]}, fanout]}}},
+        ]
+        collection = get_user_collection()
+
+    pipeline += [
+        {"$unwind": "$targets"},
+        {"$match": {"targets": {"$nin": exclude}}},
+        {"$group": {"_id": "$targets", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$limit": limit}
+    ]
+    return [(doc["_id"], doc["count"]) async for doc in collection.aggregate(pipeline)]
+
+# Aggregation expression of follower_count / following_count. Documents written before the counters existed
+# (or not reconciled yet) fall back to the array size, computed by MongoDB so the arrays are not sent back
+def count_expressions() -> dict:
+    return {
+        count_field: {"$ifNull": [f"${count_field}", {"$size": {"$ifNull": [f"${direction}", []]}}]}
+        for direction, count_field in count_fields.items()
+    }
+
+# Find users with follower_count / following_count, without followers / following arrays
+async def find_user_profiles(user_ids: list) -> list:
+    return await get_user_collection().aggregate([
+        {"$match": {"_id": {"$in": user_ids}}},
+        {"$addFields": count_expressions()},
+        {"$project": {direction: 0 for direction in count_fields}}
+    ]).to_list(length=None)
+
+# Get follower_count / following_count of a user. None if user not found
+async def get_follow_counts(user_id: str) -> dict | None:
+    docs = await get_user_collection().aggregate([
+        {"$match": {"_id": user_id}},
+        {"$project": count_expressions()}
+    ]).to_list(length=1)
+    if not docs:
+        return None
+    return {count_field: docs[0][count_field] for count_field in count_fields.values()}
+
+# Actual follow list sizes of the given users: {user ID: {"follower_count": n, "following_count": n}}
+async def count_follow_lists(user_ids: list) -> dict:
+    counts = {user_id: {count_field: 0 for count_field in count_fields.values()} for user_id in user_ids}
+    if uses_edges():
+        for direction, count_field in count_fields.items():
+            user_field = edge_fields[direction][0]
+            async for doc in get_follow_collection().aggregate([
+                {"$match": {user_field: {"$in": user_ids}}},
+                {"$group": {"_id": f"${user_field}", "count": {"$sum": 1}}}
+            ]):
+                counts[doc["_id"]][count_field] = doc["count"]
+        return counts
+
+    async for doc in get_user_collection().aggregate([
+        {"$match": {"_id": {"$in": user_ids}}},
+        {"$project": {
+            count_field: {"$size": {"$ifNull": [f"${direction}", []]}} for direction, count_field in count_fields.items()
+        }}
+    ]):
+        counts[doc["_id"]] = {count_field: doc[count_field] for count_field in count_fields.values()}
+    return counts
+
+# Repair drift of follower_count / following_count (missing, or different from the actual follow lists).
+# Safe to run many times and while the API is serving, a counter changed meanwhile is left for the next run.
+async def reconcile_follow_counts(batch_size: int = 1000) -> dict:
+    users_scanned = 0
+    users_repaired = 0
+
+    async def reconcile(batch: list):
+        nonlocal users_repaired
+        actual = await count_follow_lists([user["_id"] for user in batch])
+        operations = []
+        for user in batch:
+            stored = {count_field: user.get(count_field) for count_field in count_fields.values()}
+            if stored != actual[user["_id"]]:
+                # Only overwrite the value read, so a concurrent $inc is not lost
+                operations.append(UpdateOne({"_id": user["_id"], **stored}, {"$set": actual[user["_id"]]}))
+        if operations:
+            result = await get_user_collection().bulk_write(operations, ordered=False)
+            users_repaired += result.modified_count
+
+    batch = []
+    cursor = get_user_collection().find({}, {count_field: 1 for count_field in count_fields.values()}).batch_size(batch_size)
+    async for user in cursor:
+        users_scanned += 1
+        batch.append(user)
+        if len(batch) >= batch_size:
+            await reconcile(batch)
+            batch = []
+            logger.info(f"Reconcile follow counts: {users_scanned} users scanned, {users_repaired} repaired")
+    if batch:
+        await reconcile(batch)
+
+    logger.info(f"Reconcile follow counts done: {users_scanned} users scanned, {users_repaired} repaired")
+    return {"users_scanned": users_scanned, "users_repaired": users_repaired}
+
+# Remove one bounded batch of references to a deleted user from the follow lists of other users.
+# direction is the list of the other users holding the ID ("followers" or "following"), its counter is decremented.
+# Return the IDs of the users updated (empty once nothing references the deleted user anymore)
+async def pull_deleted_user(user_id: str, direction: str, batch_size: int) -> list:
+    count_field = count_fields[direction]
+    if uses_edges():
+        # "followers" of other users hold the deleted user as follower_id, and the other way around
+        user_field, other_field = edge_fields["following" if direction == "followers" else "followers"]
+        edges = await get_follow_collection().find(
+            {user_field: user_id}, {other_field: 1}
+        ).limit(batch_size).to_list(length=batch_size)
+        if not edges:
+            return []
+        other_ids = [edge[other_field] for edge in edges]
+        result = await get_follow_collection().delete_many({"_id": {"$in": [edge["_id"] for edge in edges]}})
+        # Fewer deleted than read means a concurrent unfollow, the counters are left to reconcile_follow_counts
+        if result.deleted_count == len(edges):
+            await get_user_collection().update_many({"_id": {"$in": other_ids}}, {"$inc": {count_field: -1}})
+        return other_ids
+
+    # Uses the multikey index of the array, the filter is repeated so each user is decremented once
+    users = await get_user_collection().find({direction: user_id}, {"_id": 1}).limit(batch_size).to_list(length=batch_size)
+    if not users:
+        return []
+    other_ids = [user["_id"] for user in users]
+    await get_user_collection().update_many(
+        {"_id": {"$in": other_ids}, direction: user_id},
+        {"$pull": {direction: user_id}, "$inc": {count_field: -1}}
+    )
+    return other_ids
+
+# IDs referenced by the follow graph whose user document doesn't exist anymore (deleted without cascade).
+# Scans every follow list once, existence is checked per batch of referenced IDs
+async def find_orphan_ids(batch_size: int = 1000) -> set:
+    orphans = set()
+    referenced = set()
+
+    async def check():
+        existing = {user["_id"] async for user in get_user_collection().find({"_id": {"$in": list(referenced)}}, {"_id": 1})}
+        orphans.update(referenced - existing)
+        referenced.clear()
+
+    if uses_edges():
+        cursor = get_follow_collection().find({}, {"follower_id": 1, "target_id": 1, "_id": 0}).batch_size(batch_size)
+        async for edge in cursor:
+            referenced.update((edge["follower_id"], edge["target_id"]))
+            if len(referenced) >= batch_size:
+                await check()
+    else:
+        cursor = get_user_collection().find({}, {"followers": 1, "following": 1}).batch_size(batch_size)
+        async for user in cursor:
+            referenced.update(user.get("followers", []))
+            referenced.update(user.get("following", []))
+            if len(referenced) >= batch_size:
+                await check()
+    if referenced:
+        await check()
+    return orphans
+
+# Fill followers / following arrays of user documents from "follows" collection,
+# so user_helper returns the same result in both layout. Two queries for the whole list of users.
+async def attach_follow_lists(users: list) -> list:
+    if not uses_edges() or not users:
+        return users
+
+    by_id = {user["_id"]: user for user in users}
+    for user in users:
+        user["followers"] = []
+        user["following"] = []
+
+    user_ids = list(by_id.keys())
+    async for edge in get_follow_collection().find({"follower_id": {"$in": user_ids}}).sort([("created_at", 1), ("_id", 1)]):
+        by_id[edge["follower_id"]]["following"].append(edge["target_id"])
+    async for edge in get_follow_collection().find({"target_id": {"$in": user_ids}}).sort([("created_at", 1), ("_id", 1)]):
+        by_id[edge["target_id"]]["followers"].append(edge["follower_id"])
+    return users
+
+# Copy follow graph from followers / following arrays of user documents into "follows" collection.
+# Safe to run many times (edges are upserted). Optionally remove the arrays from user documents afterwards.
+# user_ids limits the backfill to these users (default every user)
+async def backfill_follow_edges(batch_size: int = 1000, unset_arrays: bool = False, user_ids: list | None = None) -> dict:
+    scope = {} if user_ids is None else {"_id": {"$in": user_ids}}
+    now = datetime.now(timezone.utc).isoformat()
+    operations = []
+    users_scanned = 0
+    edges_upserted = 0
+
+    async def flush():
+        nonlocal edges_upserted
+        if operations:
+            result = await get_follow_collection().bulk_write(operations, ordered=False)
+            edges_upserted += result.upserted_count
+            operations.clear()
+
+    cursor = get_user_collection().find(scope, {"followers": 1, "following": 1}).batch_size(batch_size)
+    async for user in cursor:
+        users_scanned += 1
+        # Read both side, in case the arrays were not consistent with each other
+        edges = [(user["_id"], target_id) for target_id in user.get("following", [])]
+        edges += [(follower_id, user["_id"]) for follower_id in user.get("followers", [])]
+        for follower_id, target_id in edges:
+            operations.append(UpdateOne(
+                {"follower_id": follower_id, "target_id": target_id},
+                {"$setOnInsert": {"created_at": now}},
+                upsert=True
+            ))
+        if len(operations) >= batch_size:
+            await flush()
+        if users_scanned % batch_size == 0:
+            logger.info(f"Backfill follow edges: {users_scanned} users scanned, {edges_upserted} edges created")
+    await flush()
+
+    arrays_removed = 0
+    if unset_arrays:
+        result = await get_user_collection().update_many(
+            {**scope, "$or": [{"followers": {"$exists": True}}, {"following": {"$exists": True}}]},
+            {"$unset": {"followers": "", "following": ""}}
+        )
+        arrays_removed = result.modified_count
+
+    logger.info(f"Backfill follow edges done: {users_scanned} users scanned, {edges_upserted} edges created, {arrays_removed} users arrays removed")
+    return {"users_scanned": users_scanned, "edges_created": edges_upserted, "arrays_removed": arrays_removed}
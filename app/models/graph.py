@@ -0,0 +1,360 @@
+import os
+import asyncio
+import sys
+from array import array
+from bisect import bisect_left
+from app.db.mongo import get_database_session
+from app.models import follow as follow_store
+
+from app.core.logging_config import logger
+
+# In-memory snapshot of the follow graph for analytics (optional, can be enabled from .env)
+# Built in the background upon startup, then kept up to date by follow / unfollow / delete of this process.
+FOLLOW_GRAPH_SNAPSHOT = os.getenv("FOLLOW_GRAPH_SNAPSHOT", "false").lower() == "true"
+# Pending changes on top of the snapshot before it is compacted into a new snapshot
+FOLLOW_GRAPH_DELTA_MAX = int(os.getenv("FOLLOW_GRAPH_DELTA_MAX", "100000"))
+
+def build_csr(node_count: int, sources: array, targets: array) -> tuple:
+    """
+    Compressed sparse row adjacency of the edges (sources[i] -> targets[i]): neighbors of node n are
+    adjacency[offsets[n]:offsets[n + 1]], sorted (membership check by binary search).
+    """
+    counts = array("Q", bytes(8 * (node_count + 1)))
+    for source in sources:
+        counts[source + 1] += 1
+    for node in range(node_count):
+        counts[node + 1] += counts[node]
+    offsets = counts
+
+    position = array("Q", offsets[:-1]) if node_count else array("Q")
+    adjacency = array("I", bytes(4 * len(sources)))
+    for source, target in zip(sources, targets):
+        adjacency[position[source]] = target
+        position[source] += 1
+    for node in range(node_count):
+        low, high = offsets[node], offsets[node + 1]
+        if high - low > 1:
+            adjacency[low:high] = array("I", sorted(adjacency[low:high]))
+    return offsets, adjacency
+
+class CSR:
+    """Immutable adjacency of one direction of the graph."""
+
+    def __init__(self, offsets: array | None = None, adjacency: array | None = None):
+        self.offsets = offsets if offsets is not None else array("Q", [0])
+        self.adjacency = adjacency if adjacency is not None else array("I")
+        self.node_count = len(self.offsets) - 1
+
+    def row(self, node: int) -> array:
+        if node >= self.node_count:
+            return self.adjacency[0:0]
+        return self.adjacency[self.offsets[node]:self.offsets[node + 1]]
+
+    def degree(self, node: int) -> int:
+        return self.offsets[node + 1] - self.offsets[node] if node < self.node_count else 0
+
+    def contains(self, node: int, other: int) -> bool:
+        if node >= self.node_count:
+            return False
+        low, high = self.offsets[node], self.offsets[node + 1]
+        position = bisect_left(self.adjacency, other, low, high)
+        return position < high and self.adjacency[position] == other
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.adjacency)
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.itemsize * len(self.offsets) + self.adjacency.itemsize * len(self.adjacency)
+
+def build_snapshot(node_count: int, sources: array, targets: array) -> tuple:
+    return CSR(*build_csr(node_count, sources, targets)), CSR(*build_csr(node_count, targets, sources))
+
+def percentile(values: list, rank: float) -> int:
+    return values[min(len(values) - 1, int(rank * len(values)))] if values else 0
+
+class FollowGraph:
+    """
+    Follow graph with user IDs mapped to dense integer indices. Edges are stored as two CSR snapshots
+    (following and followers), plus pending changes made since (added edges, removed edges, deleted users).
+    Once pending changes exceed delta_max, they are compacted into new snapshots in a worker thread, and the
+    deleted users are forgotten (index of their ID is left unused).
+    Changes made while a snapshot is built or compacted are logged, and replayed onto the new snapshots.
+    """
+
+    def __init__(self, enabled: bool = FOLLOW_GRAPH_SNAPSHOT, delta_max: int = FOLLOW_GRAPH_DELTA_MAX):
+        self.enabled = enabled
+        self.delta_max = delta_max
+        # index -> user ID (None once forgotten), and user ID -> index
+        self.ids = []
+        self.index = {}
+        self.snapshots = {"following": CSR(), "followers": CSR()}
+        # Pending changes: node -> added neighbors (per direction), removed (follower, target), deleted nodes
+        self.added = {"following": {}, "followers": {}}
+        self.added_count = 0
+        self.removed = set()
+        self.deleted = set()
+        self.ready = False
+        self.building = False
+        self.compaction = None
+        # (follower, target, added) changes made since the build / compaction in progress started, None otherwise
+        self.log = None
+        self.counters = {"builds": 0, "compactions": 0, "last_build_s": 0.0, "last_compaction_s": 0.0}
+
+    def node(self, user_id: str) -> int:
+        node = self.index.get(user_id)
+        if node is None:
+            node = len(self.ids)
+            self.ids.append(user_id)
+            self.index[user_id] = node
+        return node
+
+    # Writes (no-op if disabled). Applied even while building or compacting, and logged to be replayed afterwards
+
+    def add(self, follower_id: str, target_id: str):
+        if not self.enabled:
+            return
+        follower, target = self.node(follower_id), self.node(target_id)
+        if self.log is not None:
+            self.log.append((follower, target, True))
+        self.apply_add(follower, target)
+        self.maybe_compact()
+
+    def remove(self, follower_id: str, target_id: str):
+        if not self.enabled:
+            return
+        follower, target = self.node(follower_id), self.node(target_id)
+        if self.log is not None:
+            self.log.append((follower, target, False))
+        self.apply_remove(follower, target)
+        self.maybe_compact()
+
+    def remove_user(self, user_id: str):
+        if not self.enabled:
+            return
+        self.deleted.add(self.node(user_id))
+        self.maybe_compact()
+
+    # Pending changes relative to the current snapshots
+
+    def apply_add(self, follower: int, target: int):
+        self.removed.discard((follower, target))
+        if not self.snapshots["following"].contains(follower, target) and \
+                target not in self.added["following"].get(follower, ()):
+            self.added["following"].setdefault(follower, set()).add(target)
+            self.added["followers"].setdefault(target, set()).add(follower)
+            self.added_count += 1
+
+    def apply_remove(self, follower: int, target: int):
+        added = self.added["following"].get(follower)
+        if added is not None and target in added:
+            added.discard(target)
+            self.added["followers"][target].discard(follower)
+            self.added_count -= 1
+        # While building, the edge may still be read from MongoDB
+        if self.building or self.snapshots["following"].contains(follower, target):
+            self.removed.add((follower, target))
+
+    # Reads
+
+    def has_edge(self, follower: int, target: int) -> bool:
+        if follower in self.deleted or target in self.deleted or (follower, target) in self.removed:
+            return False
+        return target in self.added["following"].get(follower, ()) or self.snapshots["following"].contains(follower, target)
+
+    def neighbors(self, node: int, direction: str = "following") -> list:
+        def is_removed(other):
+            return (node, other) in self.removed if direction == "following" else (other, node) in self.removed
+
+        neighbors = [other for other in self.snapshots[direction].row(node)
+                     if other not in self.deleted and not (self.removed and is_removed(other))]
+        neighbors += [other for other in self.added[direction].get(node, ()) if other not in self.deleted]
+        return neighbors
+
+    def reach(self, user_id: str, max_hops: int = 2, direction: str = "following") -> dict | None:
+        """Breadth-first search: number of users first reached at each hop (1..max_hops). None if user is unknown."""
+        start = self.index.get(user_id)
+        if start is None or start in self.deleted:
+            return None
+        visited = bytearray(len(self.ids))
+        visited[start] = 1
+        frontier = [start]
+        per_hop = []
+        for _ in range(max_hops):
+            next_frontier = []
+            for node in frontier:
+                for other in self.neighbors(node, direction):
+                    if not visited[other]:
+                        visited[other] = 1
+                        next_frontier.append(other)
+            per_hop.append(len(next_frontier))
+            frontier = next_frontier
+            if not frontier:
+                break
+        return {"user_id": user_id, "direction": direction, "per_hop": per_hop, "reached": sum(per_hop)}
+
+    def is_mutual(self, user_id: str, other_id: str) -> bool:
+        user, other = self.index.get(user_id), self.index.get(other_id)
+        if user is None or other is None:
+            return False
+        return self.has_edge(user, other) and self.has_edge(other, user)
+
+    def mutual_follows(self, user_id: str) -> list:
+        """IDs of users following user_id back among the users it follows."""
+        user = self.index.get(user_id)
+        if user is None or user in self.deleted:
+            return []
+        followers = set(self.neighbors(user, "followers"))
+        return [self.ids[other] for other in self.neighbors(user, "following") if other in followers]
+
+    def degree(self, node: int, direction: str = "following") -> int:
+        # Removed edges and edges to deleted users are only known by filtering the neighbors
+        if self.removed or self.deleted:
+            return len(self.neighbors(node, direction))
+        return self.snapshots[direction].degree(node) + len(self.added[direction].get(node, ()))
+
+    def degree_stats(self, direction: str = "following") -> dict:
+        degrees = sorted(self.degree(node, direction) for node in self.index.values() if node not in self.deleted)
+        return {
+            "direction": direction,
+            "users": len(degrees),
+            "edges": sum(degrees),
+            "zero": sum(1 for degree in degrees if degree == 0),
+            "mean": round(sum(degrees) / len(degrees), 2) if degrees else 0,
+            "p50": percentile(degrees, 0.5),
+            "p90": percentile(degrees, 0.9),
+            "p99": percentile(degrees, 0.99),
+            "max": degrees[-1] if degrees else 0
+        }
+
+    # Snapshot (re)build
+
+    async def build(self, batch_size: int = 10000) -> int:
+        """Build the snapshots from MongoDB. Return the number of edges."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self.building = True
+        self.log = []
+        try:
+            sources, targets = array("I"), array("I")
+            if follow_store.uses_edges():
+                cursor = follow_store.get_follow_collection().find(
+                    {}, {"follower_id": 1, "target_id": 1, "_id": 0}, batch_size=batch_size
+                )
+                async for edge in cursor:
+                    sources.append(self.node(edge["follower_id"]))
+                    targets.append(self.node(edge["target_id"]))
+            else:
+                cursor = get_database_session()["users"].find(
+                    {"following.0": {"$exists": True}}, {"following": 1}, batch_size=batch_size
+                )
+                async for user in cursor:
+                    follower = self.node(user["_id"])
+                    for target_id in user["following"]:
+                        sources.append(follower)
+                        targets.append(self.node(target_id))
+            snapshots = await asyncio.to_thread(build_snapshot, len(self.ids), sources, targets)
+            self.building = False
+            self.swap(*snapshots, log=self.log)
+        finally:
+            self.building = False
+            self.log = None
+        self.counters["builds"] += 1
+        self.counters["last_build_s"] = round(loop.time() - started, 3)
+        logger.info(f"Follow graph snapshot built ({len(self.ids)} users, {len(sources)} edges)")
+        return len(sources)
+
+    def pending_count(self) -> int:
+        return self.added_count + len(self.removed) + len(self.deleted)
+
+    def maybe_compact(self):
+        if self.ready and self.compaction is None and self.pending_count() > self.delta_max:
+            self.compaction = asyncio.get_running_loop().create_task(self.compact())
+
+    async def compact(self):
+        """Merge pending changes into new snapshots (in a worker thread, writes keep going meanwhile)."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        following = self.snapshots["following"]
+        added = {node: set(others) for node, others in self.added["following"].items()}
+        removed, deleted, node_count = set(self.removed), set(self.deleted), len(self.ids)
+        self.log = []
+
+        def merge():
+            sources, targets = array("I"), array("I")
+            for node in range(following.node_count):
+                if node in deleted:
+                    continue
+                for other in following.row(node):
+                    if other not in deleted and (node, other) not in removed:
+                        sources.append(node)
+                        targets.append(other)
+            for node, others in added.items():
+                for other in others:
+                    if node not in deleted and other not in deleted:
+                        sources.append(node)
+                        targets.append(other)
+            return build_snapshot(node_count, sources, targets)
+
+        try:
+            snapshots = await asyncio.to_thread(merge)
+            # Deleted users have no edge left in the new snapshots, they are forgotten (with any change logged for them)
+            log = [(follower, target, added) for follower, target, added in self.log
+                   if follower not in deleted and target not in deleted]
+            self.swap(*snapshots, log=log)
+            self.forget(deleted)
+            self.counters["compactions"] += 1
+            self.counters["last_compaction_s"] = round(loop.time() - started, 3)
+        finally:
+            self.compaction = None
+            self.log = None
+
+    def forget(self, nodes: set):
+        for node in nodes:
+            self.index.pop(self.ids[node], None)
+            self.ids[node] = None
+        self.deleted -= nodes
+
+    def swap(self, following: CSR, followers: CSR, log: list | None = None):
+        self.snapshots = {"following": following, "followers": followers}
+        if log is not None:
+            # The new snapshots hold every change made before the log started, the logged ones are replayed on them
+            self.added = {"following": {}, "followers": {}}
+            self.added_count = 0
+            self.removed = set()
+            for follower, target, added in log:
+                if added:
+                    self.apply_add(follower, target)
+                else:
+                    self.apply_remove(follower, target)
+            self.ready = True
+            return
+
+        # Keep only the pending changes not already in the new snapshots
+        added = {"following": {}, "followers": {}}
+        self.added_count = 0
+        for node, others in self.added["following"].items():
+            for other in others:
+                if not following.contains(node, other):
+                    added["following"].setdefault(node, set()).add(other)
+                    added["followers"].setdefault(other, set()).add(node)
+                    self.added_count += 1
+        self.added = added
+        self.removed = {(node, other) for node, other in self.removed if following.contains(node, other)}
+        self.ready = True
+
+    def stats(self) -> dict:
+        snapshot_bytes = sum(snapshot.nbytes for snapshot in self.snapshots.values())
+        return {
+            **self.counters,
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "users": len(self.index) - len(self.deleted),
+            "snapshot_edges": self.snapshots["following"].edge_count,
+            "pending_changes": self.pending_count(),
+            "snapshot_bytes": snapshot_bytes,
+            "index_bytes": sys.getsizeof(self.ids) + sys.getsizeof(self.index)
+        }
+
+follow_graph = FollowGraph()
@@ -0,0 +1,202 @@
+import os
+import math
+from app.db.mongo import get_database_session
+from app.models import nearby as nearby_query
+
+from app.core.logging_config import logger
+
+# In-process spatial index of user locations (optional, can be enabled from .env)
+# Users are bucketed by geohash cell, nearby friends are answered from memory instead of $geoNear.
+# Only writes made through this process are seen, so enable it with a single API process.
+NEARBY_GRID = os.getenv("NEARBY_GRID", "false").lower() == "true"
+# Geohash length of a cell. 6 is about 1.2 km x 0.6 km
+NEARBY_GRID_PRECISION = int(os.getenv("NEARBY_GRID_PRECISION", "6"))
+
+geohash_alphabet = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+user_collection_name = "users"
+
+def get_user_collection():
+    return get_database_session().get_collection(user_collection_name)
+
+def geohash(lng: float, lat: float, precision: int) -> str:
+    lng_range, lat_range = [-180.0, 180.0], [-90.0, 90.0]
+    bits = 0
+    bit_count = 0
+    even = True
+    code = []
+    while len(code) < precision:
+        value, value_range = (lng, lng_range) if even else (lat, lat_range)
+        middle = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            value_range[0] = middle
+        else:
+            value_range[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            code.append(geohash_alphabet[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(code)
+
+# Size (degree) of geohash cell: (longitude width, latitude height)
+def cell_size(precision: int) -> tuple:
+    lng_bits = math.ceil(precision * 5 / 2)
+    lat_bits = math.floor(precision * 5 / 2)
+    return 360 / 2 ** lng_bits, 180 / 2 ** lat_bits
+
+class GeoGrid:
+    """
+    Users bucketed by geohash cell. Query scans the cells covering the radius and keeps the followed users,
+    or checks the followed users directly when they are fewer than the users in those cells.
+    Distance is the spherical distance of $geoNear, the result is ordered by (distance, _id) like query_nearby.
+    """
+
+    def __init__(self, enabled: bool = NEARBY_GRID, precision: int = NEARBY_GRID_PRECISION):
+        self.enabled = enabled
+        self.precision = precision
+        self.cell_lng, self.cell_lat = cell_size(precision)
+        # user ID -> (cell, compact user document)
+        self.entries = {}
+        # cell -> user IDs
+        self.cells = {}
+        self.ready = False
+        self.loading = False
+        # IDs written while loading, their in-memory entry is newer than the loaded document
+        self.touched = set()
+        self.counters = {"queries": 0, "misses": 0, "cells_scanned": 0, "candidates": 0}
+
+    def set(self, user: dict):
+        """Add or update user (document with _id, username, name, location)."""
+        if not self.enabled:
+            return
+        user_id = user["_id"]
+        if self.loading:
+            self.touched.add(user_id)
+        location = user.get("location")
+        if not location or not location.get("coordinates"):
+            self.discard(user_id)
+            return
+        lng, lat = location["coordinates"][:2]
+        cell = geohash(lng, lat, self.precision)
+        doc = {"_id": user_id, "username": user.get("username"), "name": user.get("name"), "location": location}
+        previous = self.entries.get(user_id)
+        if previous is not None and previous[0] != cell:
+            self.discard(user_id)
+        self.entries[user_id] = (cell, doc)
+        self.cells.setdefault(cell, set()).add(user_id)
+
+    def update(self, user_id: str, fields: dict):
+        """Apply updated fields (location, username, name) to user already in the grid."""
+        if not self.enabled:
+            return
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return
+        self.set({**entry[1], **{key: value for key, value in fields.items() if key in ("username", "name", "location")}})
+
+    def remove(self, user_id: str):
+        if not self.enabled:
+            return
+        if self.loading:
+            self.touched.add(user_id)
+        self.discard(user_id)
+
+    def discard(self, user_id: str):
+        entry = self.entries.pop(user_id, None)
+        if entry is None:
+            return
+        users = self.cells.get(entry[0])
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self.cells[entry[0]]
+
+    async def load(self, batch_size: int = 10000) -> int:
+        """Fill the grid from every user location. Queries fall back to MongoDB until it is done."""
+        self.loading = True
+        self.touched = set()
+        loaded = 0
+        try:
+            cursor = get_user_collection().find(
+                {"location": {"$exists": True}}, {"username": 1, "name": 1, "location": 1}, batch_size=batch_size
+            )
+            async for user in cursor:
+                if user["_id"] not in self.touched:
+                    self.set(user)
+                    loaded += 1
+        finally:
+            self.loading = False
+            self.touched = set()
+        self.ready = True
+        logger.info(f"Nearby grid loaded ({loaded} users, {len(self.cells)} cells)")
+        return loaded
+
+    def covering_cells(self, coordinates: list, max_distance_m: float) -> list | None:
+        """Cells covering the circle, None when it contains a pole or is too wide (scanning is pointless)."""
+        lng, lat = coordinates[0], coordinates[1]
+        angle = max_distance_m / nearby_query.earth_radius_m
+        radius_lat = math.degrees(angle)
+        min_lat, max_lat = lat - radius_lat, lat + radius_lat
+        # Bounding box of spherical cap, every longitude if it contains a pole
+        ratio = math.sin(angle) / math.cos(math.radians(lat)) if abs(lat) < 90 else 2
+        if min_lat <= -90 or max_lat >= 90 or ratio >= 1:
+            return None
+        radius_lng = math.degrees(math.asin(ratio))
+        if radius_lng >= 60:
+            return None
+
+        cells = set()
+        # Walk cell centers, starting from the cell containing the bottom-left corner
+        row = (math.floor((min_lat + 90) / self.cell_lat) + 0.5) * self.cell_lat - 90
+        while row - self.cell_lat / 2 <= max_lat:
+            column = (math.floor((lng - radius_lng + 180) / self.cell_lng) + 0.5) * self.cell_lng - 180
+            while column - self.cell_lng / 2 <= lng + radius_lng:
+                wrapped = (column + 180) % 360 - 180
+                cells.add(geohash(wrapped, row, self.precision))
+                column += self.cell_lng
+            row += self.cell_lat
+        return list(cells)
+
+    def query(self, coordinates: list, friend_ids: list, max_distance_m: float, limit: int, after=None) -> list | None:
+        """
+        Same as nearby.query_nearby (compact documents with distance_m, ordered by (distance, _id), starting right
+        after the after position, at most limit). None when the grid is not ready (use MongoDB instead).
+        """
+        self.counters["queries"] += 1
+        if not self.ready:
+            self.counters["misses"] += 1
+            return None
+
+        candidates = friend_ids
+        cells = self.covering_cells(coordinates, max_distance_m)
+        if cells is not None:
+            cell_users = [self.cells[cell] for cell in cells if cell in self.cells]
+            in_cells = sum(len(users) for users in cell_users)
+            # Scan the cells only if they hold fewer users than the following list
+            if in_cells < len(friend_ids):
+                following = set(friend_ids)
+                candidates = [user_id for users in cell_users for user_id in users if user_id in following]
+                self.counters["cells_scanned"] += len(cells)
+
+        docs = []
+        for user_id in candidates:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                continue
+            self.counters["candidates"] += 1
+            distance = nearby_query.distance_m(coordinates, entry[1]["location"]["coordinates"])
+            if distance <= max_distance_m:
+                doc = {**entry[1], "distance_m": distance}
+                if nearby_query.is_after(doc, after):
+                    docs.append(doc)
+        docs.sort(key=nearby_query.sort_key)
+        return docs[:limit]
+
+    def stats(self) -> dict:
+        return {**self.counters, "enabled": self.enabled, "ready": self.ready, "users": len(self.entries), "cells": len(self.cells)}
+
+nearby_grid = GeoGrid()
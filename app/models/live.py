@@ -0,0 +1,223 @@
+import os
+import asyncio
+from pymongo.errors import PyMongoError
+from app.db.mongo import get_database_session
+from app.models import follow as follow_store
+from app.models import nearby as nearby_query
+
+from app.core.logging_config import logger
+
+# Live nearby friends configuration (all optional, can be overridden from .env)
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "1000"))
+LIVE_HEARTBEAT_SECONDS = float(os.getenv("LIVE_HEARTBEAT_SECONDS", "15"))
+LIVE_RETRY_SECONDS = float(os.getenv("LIVE_RETRY_SECONDS", "1"))
+
+user_collection_name = "users"
+
+def get_user_collection():
+    return get_database_session().get_collection(user_collection_name)
+
+# Change stream of users collection, limited to location change (update of location or location.*,
+# replace and delete). Only fields needed to evaluate proximity are sent.
+location_change_pipeline = [
+    {"$match": {"$or": [
+        {"operationType": {"$in": ["replace", "delete"]}},
+        {"operationType": "update", "$expr": {"$gt": [{"$size": {"$filter": {
+            "input": {"$objectToArray": "$updateDescription.updatedFields"},
+            "cond": {"$eq": [{"$substrCP": ["$$this.k", 0, 8]}, "location"]}
+        }}}, 0]}}
+    ]}},
+    {"$project": {
+        "operationType": 1, "documentKey": 1,
+        "fullDocument._id": 1, "fullDocument.username": 1, "fullDocument.name": 1, "fullDocument.location": 1
+    }}
+]
+
+# Change streams need replica set or sharded cluster, the answer is kept for the process lifetime
+_change_stream_support = None
+
+async def supports_change_streams() -> bool:
+    global _change_stream_support
+    if _change_stream_support is None:
+        hello = await get_database_session().command("hello")
+        _change_stream_support = "setName" in hello or hello.get("msg") == "isdbgrid"
+    return _change_stream_support
+
+class NearbySubscription:
+    """
+    Nearby friends of one user, kept up to date from location changes of the user and the followed users.
+    The following list is taken upon subscription (reconnect to take new follow into account).
+    """
+
+    def __init__(self, user: dict, friend_ids: list, max_distance_m: int):
+        self.user_id = user["_id"]
+        self.username = user["username"]
+        self.coordinates = user["location"]["coordinates"]
+        self.friend_ids = friend_ids
+        self.max_distance_m = max_distance_m
+        # friend ID -> compact friend with distance_m, of friends currently within distance
+        self.inside = {}
+        self.queue = asyncio.Queue(maxsize=LIVE_QUEUE_SIZE)
+        self.resync = False
+
+    def watched_ids(self) -> list:
+        return [self.user_id, *self.friend_ids]
+
+    def push(self, change: dict):
+        try:
+            self.queue.put_nowait(change)
+        except asyncio.QueueFull:
+            # Slow consumer, changes are dropped and a new snapshot is sent instead
+            self.resync = True
+
+    async def snapshot(self) -> dict:
+        docs, _ = await nearby_query.query_nearby(
+            self.coordinates, self.friend_ids, self.max_distance_m, max(1, len(self.friend_ids))
+        )
+        self.inside = {doc["_id"]: nearby_query.nearby_helper(doc) for doc in docs}
+        return {"nearby_friends": list(self.inside.values())}
+
+    async def apply(self, change: dict) -> list:
+        """Evaluate one location change, return the resulting (event, data) list."""
+        changed_id = change["documentKey"]["_id"]
+        doc = change.get("fullDocument") if change["operationType"] != "delete" else None
+
+        if changed_id == self.user_id:
+            if doc is None:
+                return [("end", {"reason": "user deleted"})]
+            if not doc.get("location"):
+                return []
+            # The user moved, every friend is evaluated again
+            before = self.inside
+            self.coordinates = doc["location"]["coordinates"]
+            await self.snapshot()
+            events = [("leave", self.leave_data(friend)) for friend_id, friend in before.items() if friend_id not in self.inside]
+            events += [("enter", friend) for friend_id, friend in self.inside.items() if friend_id not in before]
+            return events
+
+        if doc is None or not doc.get("location"):
+            friend = self.inside.pop(changed_id, None)
+            return [("leave", self.leave_data(friend))] if friend else []
+
+        distance = nearby_query.distance_m(self.coordinates, doc["location"]["coordinates"])
+        if distance <= self.max_distance_m:
+            was_inside = changed_id in self.inside
+            self.inside[changed_id] = nearby_query.nearby_helper({**doc, "distance_m": distance})
+            return [] if was_inside else [("enter", self.inside[changed_id])]
+        friend = self.inside.pop(changed_id, None)
+        return [("leave", self.leave_data(friend))] if friend else []
+
+    @staticmethod
+    def leave_data(friend: dict) -> dict:
+        return {"id": friend["id"], "username": friend["username"]}
+
+class LocationFeed:
+    """
+    One change stream of location changes per process, shared by every subscription.
+    Each change is routed to the subscriptions watching the changed user.
+    """
+
+    def __init__(self):
+        # user ID -> subscriptions watching the user
+        self.watchers = {}
+        self.subscriptions = set()
+        self.task = None
+        self.ready = None
+        self.counters = {"changes": 0, "dispatched": 0, "resyncs": 0, "errors": 0}
+
+    def subscribe(self, subscription: NearbySubscription):
+        self.subscriptions.add(subscription)
+        for user_id in subscription.watched_ids():
+            self.watchers.setdefault(user_id, set()).add(subscription)
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.ready = asyncio.Event()
+            self.task = loop.create_task(self.run())
+
+    def unsubscribe(self, subscription: NearbySubscription):
+        self.subscriptions.discard(subscription)
+        for user_id in subscription.watched_ids():
+            watchers = self.watchers.get(user_id)
+            if watchers is not None:
+                watchers.discard(subscription)
+                if not watchers:
+                    del self.watchers[user_id]
+        # Close the change stream once nobody listens
+        if not self.subscriptions and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        resume_token = None
+        while True:
+            try:
+                async with get_user_collection().watch(
+                    location_change_pipeline, full_document="updateLookup", resume_after=resume_token
+                ) as stream:
+                    while stream.alive:
+                        # First try_next opens the stream, changes from then on are received
+                        change = await stream.try_next()
+                        self.ready.set()
+                        resume_token = stream.resume_token
+                        if change is not None:
+                            self.dispatch(change)
+            except PyMongoError as e:
+                self.counters["errors"] += 1
+                logger.error(f"Location change stream failed, retrying: {e}")
+                await asyncio.sleep(LIVE_RETRY_SECONDS)
+
+    def dispatch(self, change: dict):
+        self.counters["changes"] += 1
+        for subscription in self.watchers.get(change["documentKey"]["_id"], ()):
+            self.counters["dispatched"] += 1
+            subscription.push(change)
+
+    def stats(self) -> dict:
+        return {**self.counters, "subscriptions": len(self.subscriptions), "watched_users": len(self.watchers)}
+
+location_feed = LocationFeed()
+
+async def subscribe_nearby_friends(username: str, max_distance_m: int = 1000):
+    """Return subscription of nearby friends of user, None if user not found, "Not Supported" without change streams."""
+    if not await supports_change_streams():
+        logger.error("Failed Live Nearby Following. Change streams need MongoDB replica set")
+        return "Not Supported"
+    user = await get_user_collection().find_one({"username": username}, {"username": 1, "location": 1, "following": 1})
+    if not user or "location" not in user:
+        logger.error(f"Failed Get User Information. The user with username {username} is Non-Existance User")
+        return None
+    friend_ids = await follow_store.get_following_ids(user)
+    return NearbySubscription(user, friend_ids, max_distance_m)
+
+async def nearby_friend_events(subscription: NearbySubscription):
+    """
+    Async generator of (event, data): "snapshot" of nearby friends first, then "enter" / "leave" when a friend
+    comes within / goes out of distance, "heartbeat" when idle, and "end" if the user is deleted.
+    """
+    # Subscribe before the snapshot, so no change is missed in between
+    location_feed.subscribe(subscription)
+    try:
+        try:
+            await asyncio.wait_for(location_feed.ready.wait(), timeout=LIVE_HEARTBEAT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning("Location change stream is not open yet, snapshot is sent anyway")
+        yield "snapshot", await subscription.snapshot()
+        while True:
+            try:
+                change = await asyncio.wait_for(subscription.queue.get(), timeout=LIVE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield "heartbeat", None
+                continue
+            if subscription.resync:
+                location_feed.counters["resyncs"] += 1
+                subscription.resync = False
+                while not subscription.queue.empty():
+                    subscription.queue.get_nowait()
+                yield "snapshot", await subscription.snapshot()
+                continue
+            for event, data in await subscription.apply(change):
+                yield event, data
+                if event == "end":
+                    return
+    finally:
+        location_feed.unsubscribe(subscription)
@@ -0,0 +1,215 @@
+import os
+import asyncio
+import time
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
+from app.db.mongo import get_database_session
+from app.core.cache import user_cache
+from app.models.grid import nearby_grid
+from app.models.user import user_cache_key, moved_user_ids, invalidate_moved_nearby
+
+from app.core.logging_config import logger
+
+# Location ping buffer configuration (all optional, can be overridden from .env)
+LOCATION_FLUSH_INTERVAL_MS = float(os.getenv("LOCATION_FLUSH_INTERVAL_MS", "1000"))
+LOCATION_FLUSH_MAX_BATCH = int(os.getenv("LOCATION_FLUSH_MAX_BATCH", "5000"))
+LOCATION_BUFFER_MAX_USERS = int(os.getenv("LOCATION_BUFFER_MAX_USERS", "100000"))
+# Write concern of the flush: "0" (fire and forget), "1", "majority", ...
+LOCATION_WRITE_CONCERN = os.getenv("LOCATION_WRITE_CONCERN", "1")
+
+user_collection_name = "users"
+
+# Write error codes of a ping worth retrying on next flush (transient server state). Any other error (e.g. coordinates
+# rejected by the 2dsphere index) fails again on every retry, so the ping is dropped
+retryable_write_error_codes = {6, 7, 50, 89, 91, 112, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436}
+
+def location_write_concern() -> WriteConcern:
+    w = LOCATION_WRITE_CONCERN
+    return WriteConcern(w=int(w) if w.isdigit() else w)
+
+def get_user_collection():
+    return get_database_session().get_collection(user_collection_name, write_concern=location_write_concern())
+
+class LocationBuffer:
+    """
+    In-memory buffer of location pings. Only the latest ping per user is kept, and the buffer is flushed
+    periodically (or once LOCATION_FLUSH_MAX_BATCH users are pending) as one unordered bulk_write.
+    When LOCATION_BUFFER_MAX_USERS users are pending, ping of new user is rejected (backpressure).
+    """
+
+    def __init__(self, flush_interval_ms: float = LOCATION_FLUSH_INTERVAL_MS, max_batch: int = LOCATION_FLUSH_MAX_BATCH,
+                 max_users: int = LOCATION_BUFFER_MAX_USERS):
+        self.flush_interval_ms = flush_interval_ms
+        self.max_batch = max_batch
+        self.max_users = max_users
+        # user ID -> (location, timestamp)
+        self.pending = {}
+        self.flusher = None
+        self.wake = None
+        self.flush_lock = None
+        self.counters = {
+            "received": 0, "coalesced": 0, "stale": 0, "dropped": 0,
+            "flushes": 0, "flushed": 0, "unmatched": 0, "flush_errors": 0, "invalid": 0,
+            "last_flush_ms": 0.0, "max_flush_ms": 0.0, "total_flush_ms": 0.0
+        }
+
+    def add(self, user_id: str, location: dict, timestamp: datetime | None = None) -> str | bool:
+        """Buffer a ping. Return True if accepted, "Buffer Full" if rejected by backpressure."""
+        self.ensure_flusher()
+        self.counters["received"] += 1
+        timestamp = timestamp or datetime.now(timezone.utc)
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        # Stored as UTC ISO string, so stored timestamps compare in time order. Clamped to now, so one ping dated in
+        # the future (client clock) doesn't block every later ping of the user
+        timestamp = min(timestamp.astimezone(timezone.utc), datetime.now(timezone.utc))
+
+        current = self.pending.get(user_id)
+        if current is not None:
+            if current[1] > timestamp:
+                # Older than the buffered ping (out of order delivery)
+                self.counters["stale"] += 1
+                return True
+            self.counters["coalesced"] += 1
+        elif len(self.pending) >= self.max_users:
+            self.counters["dropped"] += 1
+            self.wake.set()
+            return "Buffer Full"
+
+        self.pending[user_id] = (location, timestamp)
+        if len(self.pending) >= self.max_batch:
+            self.wake.set()
+        return True
+
+    # Flusher task runs on the event loop of the caller (started lazily, or upon app startup)
+    def ensure_flusher(self):
+        loop = asyncio.get_running_loop()
+        if self.flusher is not None and not self.flusher.done() and self.flusher.get_loop() is loop:
+            return
+        self.wake = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+        self.flusher = loop.create_task(self.run())
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=self.flush_interval_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Location flush failed: {e}")
+
+    async def flush(self) -> int:
+        """Write every pending ping now. Return the number of written users."""
+        self.ensure_flusher()
+        async with self.flush_lock:
+            return await self.drain()
+
+    async def drain(self) -> int:
+        written = 0
+        # Only the pings pending now, the one put back by a failed write wait for the next flush
+        user_ids = list(self.pending.keys())
+        for start in range(0, len(user_ids), self.max_batch):
+            batch_ids = [user_id for user_id in user_ids[start:start + self.max_batch] if user_id in self.pending]
+            batch = {user_id: self.pending.pop(user_id) for user_id in batch_ids}
+            if batch:
+                written += await self.write(batch)
+        return written
+
+    async def write(self, batch: dict) -> int:
+        started = time.perf_counter()
+        # A ping older than the location already stored (flushed earlier) is not written
+        operations = [
+            UpdateOne(
+                {"_id": user_id, "$or": [
+                    {"locationUpdatedAt": {"$lt": timestamp.isoformat(timespec="microseconds")}},
+                    {"locationUpdatedAt": {"$exists": False}}
+                ]},
+                {"$set": {"location": location, "locationUpdatedAt": timestamp.isoformat(timespec="microseconds")}}
+            )
+            for user_id, (location, timestamp) in batch.items()
+        ]
+        # Unordered write, so a failing ping doesn't stop the others
+        failed = set()
+        try:
+            result = await get_user_collection().bulk_write(operations, ordered=False)
+            acknowledged, matched_count = result.acknowledged, result.matched_count
+        except BulkWriteError as e:
+            self.counters["flush_errors"] += 1
+            acknowledged, matched_count = True, e.details["nMatched"]
+            user_ids = list(batch.keys())
+            retry = {}
+            for error in e.details["writeErrors"]:
+                user_id = user_ids[error["index"]]
+                failed.add(user_id)
+                if error["code"] in retryable_write_error_codes:
+                    retry[user_id] = batch[user_id]
+                else:
+                    self.counters["invalid"] += 1
+                    logger.error(f"Location ping of user with ID {user_id} dropped: {error.get('errmsg')}")
+            self.requeue(retry)
+        except BaseException as e:
+            # Also upon cancellation (shutdown), stop() writes what is pending afterwards
+            if isinstance(e, Exception):
+                self.counters["flush_errors"] += 1
+            self.requeue(batch)
+            raise
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.counters["flushes"] += 1
+        self.counters["flushed"] += len(batch) - len(failed)
+        if acknowledged:
+            # Unknown user, or ping older than the stored location
+            self.counters["unmatched"] += len(batch) - len(failed) - matched_count
+        self.counters["last_flush_ms"] = round(elapsed_ms, 2)
+        self.counters["max_flush_ms"] = round(max(self.counters["max_flush_ms"], elapsed_ms), 2)
+        self.counters["total_flush_ms"] += elapsed_ms
+
+        # Pings written (or not matched), failed one are left out of the invalidation
+        written = {user_id: ping for user_id, ping in batch.items() if user_id not in failed}
+        if not written:
+            return 0
+
+        # Unknown user, or ping older than the stored location: the stored locations are used from here on
+        locations = {user_id: location for user_id, (location, _) in written.items()}
+        if acknowledged and matched_count < len(written):
+            cursor = get_user_collection().find({"_id": {"$in": list(written.keys())}}, {"location": 1})
+            locations = {user["_id"]: user["location"] async for user in cursor if user.get("location")}
+
+        # Cached profile is outdated, nearby results only once the user moved beyond threshold
+        for user_id, location in locations.items():
+            nearby_grid.update(user_id, {"location": location})
+        await user_cache.delete(*[user_cache_key(user_id) for user_id in written.keys()])
+        moved = await moved_user_ids({user_id: location["coordinates"] for user_id, location in locations.items()})
+        await invalidate_moved_nearby(moved)
+        return len(written)
+
+    # Put pings of a failed write back (unless a newer ping arrived meanwhile), they are retried on next flush
+    def requeue(self, pings: dict):
+        for user_id, ping in pings.items():
+            if user_id not in self.pending:
+                self.pending[user_id] = ping
+
+    async def stop(self):
+        """Stop the flusher and write what is still pending (called upon app shutdown)."""
+        if self.flusher is not None and not self.flusher.done():
+            self.flusher.cancel()
+            try:
+                await self.flusher
+            except asyncio.CancelledError:
+                pass
+        self.flusher = None
+        await self.drain()
+
+    def stats(self) -> dict:
+        flushes = self.counters["flushes"]
+        average = self.counters["total_flush_ms"] / flushes if flushes else 0
+        stats = {key: value for key, value in self.counters.items() if key != "total_flush_ms"}
+        return {**stats, "pending": len(self.pending), "average_flush_ms": round(average, 2)}
+
+location_buffer = LocationBuffer()
@@ -0,0 +1,236 @@
+import os
+import asyncio
+import base64
+import heapq
+import json
+import math
+from app.db.mongo import get_database_session
+
+# Query strategy of nearby friends, chosen by the size of following list (can be overridden from .env)
+# "in_near"   : one $geoNear query constrained by _id $in following (small list)
+# "chunked"   : following split into chunks, one $geoNear per chunk in parallel, merged by distance (medium list)
+# "geo_first" : one $geoNear over every user within radius, intersected with following in memory (large list)
+strategy_in_near = "in_near"
+strategy_chunked = "chunked"
+strategy_geo_first = "geo_first"
+nearby_strategies = (strategy_in_near, strategy_chunked, strategy_geo_first)
+
+NEARBY_IN_MAX_IDS = int(os.getenv("NEARBY_IN_MAX_IDS", "1000"))
+NEARBY_CHUNKED_MAX_IDS = int(os.getenv("NEARBY_CHUNKED_MAX_IDS", "20000"))
+NEARBY_CHUNK_SIZE = int(os.getenv("NEARBY_CHUNK_SIZE", "1000"))
+NEARBY_CHUNK_CONCURRENCY = int(os.getenv("NEARBY_CHUNK_CONCURRENCY", "8"))
+
+user_collection_name = "users"
+
+# Compact projection of nearby user, the distance (meter) is added by $geoNear
+nearby_projection = {"username": 1, "name": 1, "location": 1, "distance_m": 1}
+
+def get_user_collection():
+    return get_database_session().get_collection(user_collection_name)
+
+def choose_strategy(following_count: int) -> str:
+    if following_count <= NEARBY_IN_MAX_IDS:
+        return strategy_in_near
+    if following_count <= NEARBY_CHUNKED_MAX_IDS:
+        return strategy_chunked
+    return strategy_geo_first
+
+def point(coordinates: list) -> dict:
+    return {"type": "Point", "coordinates": coordinates}
+
+# Whether location is GeoJSON Point with [lng, lat] in range, anything else is rejected by the 2dsphere index upon write
+def is_valid_point(location: dict) -> bool:
+    coordinates = location.get("coordinates") or []
+    return location.get("type") == "Point" and len(coordinates) == 2 \
+        and -180 <= coordinates[0] <= 180 and -90 <= coordinates[1] <= 90
+
+# Earth radius (meter) used by MongoDB for spherical distance ($geoNear, $centerSphere radius in radian)
+earth_radius_m = 6378100
+
+# Great-circle distance (meter) between two [lng, lat], same as spherical distance of $geoNear
+def distance_m(origin: list, destination: list) -> float:
+    lng1, lat1, lng2, lat2 = map(math.radians, (origin[0], origin[1], destination[0], destination[1]))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * earth_radius_m * math.asin(min(1.0, math.sqrt(a)))
+
+def nearby_helper(doc: dict) -> dict:
+    return {
+        "id": str(doc.get("_id")),
+        "username": doc.get("username"),
+        "name": doc.get("name"),
+        "location": doc.get("location"),
+        "distance_m": round(doc.get("distance_m", 0), 2)
+    }
+
+# Opaque cursor for nearby pagination, encode position (distance, _id) of last returned user
+def encode_distance_cursor(doc: dict) -> str:
+    raw = json.dumps([doc["distance_m"], str(doc["_id"])])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_distance_cursor(cursor: str):
+    try:
+        distance, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(distance, (int, float)) or not isinstance(last_id, str):
+        return None
+    return float(distance), last_id
+
+def sort_key(doc: dict) -> tuple:
+    return doc["distance_m"], doc["_id"]
+
+def is_after(doc: dict, after) -> bool:
+    return after is None or sort_key(doc) > after
+
+# Pipeline of $geoNear from coordinates, starting right after cursor position, ordered by (distance, _id)
+def geo_near_pipeline(coordinates: list, max_distance_m: int, after=None, query: dict | None = None,
+                      limit: int | None = None, projection: dict | None = None) -> list:
+    geo_near = {
+        "near": point(coordinates),
+        "distanceField": "distance_m",
+        "maxDistance": max_distance_m,
+        "spherical": True
+    }
+    if query:
+        geo_near["query"] = query
+    pipeline = [{"$geoNear": geo_near}]
+    if after is not None:
+        distance, last_id = after
+        geo_near["minDistance"] = distance
+        pipeline.append({"$match": {"$or": [
+            {"distance_m": {"$gt": distance}},
+            {"distance_m": distance, "_id": {"$gt": last_id}}
+        ]}})
+    # Tie on distance is ordered by _id, so the cursor is stable
+    pipeline.append({"$sort": {"distance_m": 1, "_id": 1}})
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    if projection is not None:
+        pipeline.append({"$project": projection})
+    return pipeline
+
+# Small following list: single $geoNear constrained by $in
+async def nearby_in_near(coordinates: list, friend_ids: list, max_distance_m: int, limit: int, after=None) -> list:
+    cursor = get_user_collection().aggregate(geo_near_pipeline(
+        coordinates, max_distance_m, after=after, query={"_id": {"$in": friend_ids}},
+        limit=limit, projection=nearby_projection
+    ))
+    return await cursor.to_list(length=None)
+
+# Medium following list: smaller $in per query, run in parallel, then merged by distance
+async def nearby_chunked(coordinates: list, friend_ids: list, max_distance_m: int, limit: int, after=None) -> list:
+    semaphore = asyncio.Semaphore(NEARBY_CHUNK_CONCURRENCY)
+
+    async def run_chunk(chunk):
+        async with semaphore:
+            return await nearby_in_near(coordinates, chunk, max_distance_m, limit, after=after)
+
+    chunks = [friend_ids[i:i + NEARBY_CHUNK_SIZE] for i in range(0, len(friend_ids), NEARBY_CHUNK_SIZE)]
+    results = await asyncio.gather(*(run_chunk(chunk) for chunk in chunks))
+    # Every chunk result is already sorted by (distance, _id), keep the closest limit of all
+    merged = heapq.merge(*results, key=sort_key)
+    return [doc for _, doc in zip(range(limit), merged)]
+
+# Large following list: ask only for _id and distance of every user within radius (no huge $in),
+# keep the followed one in memory, then fetch the compact documents of the matches
+async def nearby_geo_first(coordinates: list, friend_ids: list, max_distance_m: int, limit: int, after=None) -> list:
+    following = set(friend_ids)
+    cursor = get_user_collection().aggregate([
+        {"$geoNear": {
+            "near": point(coordinates),
+            "distanceField": "distance_m",
+            "maxDistance": max_distance_m,
+            "spherical": True,
+            **({"minDistance": after[0]} if after is not None else {})
+        }},
+        {"$project": {"_id": 1, "distance_m": 1}}
+    ])
+
+    matched = []
+    async for doc in cursor:
+        # Stream is ordered by distance. Stop once enough matches and past the tie of the last one
+        if len(matched) >= limit and doc["distance_m"] > matched[limit - 1]["distance_m"]:
+            break
+        if doc["_id"] in following and is_after(doc, after):
+            matched.append(doc)
+    matched = sorted(matched, key=sort_key)[:limit]
+    if not matched:
+        return []
+
+    found = {}
+    async for doc in get_user_collection().find({"_id": {"$in": [doc["_id"] for doc in matched]}}, nearby_projection):
+        found[doc["_id"]] = doc
+    result = []
+    for doc in matched:
+        if doc["_id"] in found:
+            found[doc["_id"]]["distance_m"] = doc["distance_m"]
+            result.append(found[doc["_id"]])
+    return result
+
+strategy_functions = {
+    strategy_in_near: nearby_in_near,
+    strategy_chunked: nearby_chunked,
+    strategy_geo_first: nearby_geo_first,
+}
+
+async def query_nearby(coordinates: list, friend_ids: list, max_distance_m: int, limit: int,
+                       after=None, strategy: str | None = None) -> tuple:
+    """
+    Return (compact documents of friend_ids within max_distance_m, closest first, with distance_m, used strategy).
+    At most limit documents are returned, starting right after the after position (distance, _id).
+    """
+    strategy = strategy or choose_strategy(len(friend_ids))
+    if not friend_ids:
+        return [], strategy
+    docs = await strategy_functions[strategy](coordinates, friend_ids, max_distance_m, limit, after=after)
+    return docs, strategy
+
+
+# Parse "lng,lat;lng,lat;..." into list of [lng, lat]
+def parse_points(raw: str) -> list | None:
+    try:
+        points = [[float(value) for value in pair.split(",")] for pair in raw.split(";") if pair.strip()]
+    except ValueError:
+        return None
+    if any(len(point) != 2 or not (-180 <= point[0] <= 180 and -90 <= point[1] <= 90) for point in points):
+        return None
+    return points
+
+def polygon(points: list) -> dict:
+    # GeoJSON polygon ring must be closed
+    if points[0] != points[-1]:
+        points = points + [points[0]]
+    return {"type": "Polygon", "coordinates": [points]}
+
+def build_area_filter(lng: float | None = None, lat: float | None = None, radius_m: float | None = None,
+                      bbox: str | None = None, polygon_points: str | None = None):
+    """
+    Build $geoWithin filter on location from exactly one area: circle (lng, lat, radius_m),
+    bbox "minLng,minLat,maxLng,maxLat" or polygon "lng,lat;lng,lat;...". Return error string if invalid.
+    """
+    areas = [radius_m is not None, bbox is not None, polygon_points is not None]
+    if sum(areas) != 1:
+        return "Invalid Area"
+
+    if radius_m is not None:
+        if lng is None or lat is None or radius_m <= 0 or not (-180 <= lng <= 180 and -90 <= lat <= 90):
+            return "Invalid Area"
+        return {"location": {"$geoWithin": {"$centerSphere": [[lng, lat], radius_m / earth_radius_m]}}}
+
+    if bbox is not None:
+        values = bbox.split(",")
+        corners = parse_points(f"{values[0]},{values[1]};{values[2]},{values[3]}") if len(values) == 4 else None
+        if not corners:
+            return "Invalid Area"
+        (min_lng, min_lat), (max_lng, max_lat) = corners
+        if min_lng >= max_lng or min_lat >= max_lat:
+            return "Invalid Area"
+        # $box only works with legacy 2d index, so the box is sent as GeoJSON polygon (served by 2dsphere index)
+        return {"location": {"$geoWithin": {"$geometry": polygon([
+            [min_lng, min_lat], [max_lng, min_lat], [max_lng, max_lat], [min_lng, max_lat]
+        ])}}}
+
+    points = parse_points(polygon_points)
+    if not points or len(set(map(tuple, points))) < 3:
+        return "Invalid Area"
+    return {"location": {"$geoWithin": {"$geometry": polygon(points)}}}
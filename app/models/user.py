@@ -1,12 +1,36 @@
+import os
+import asyncio
+import base64
+import json
 from datetime import datetime, timezone, date
 from uuid import uuid4
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from app.db.mongo import get_database_session
+from app.db.loader import get_loader
+from app.models import follow as follow_store
+from app.models import nearby as nearby_query
+from app.models.grid import nearby_grid
+from app.models.graph import follow_graph
+from app.models.cascade import DeleteCascade
+from app.core.cache import user_cache
 
 from app.core.logging_config import logger
 
 # Reference to the MongoDB "users" collection
 user_collection_name = "users"
 
+# Handle to "users" collection from the shared (pooled) client
+def get_user_collection():
+    return get_database_session().get_collection(user_collection_name)
+
+# Load user document by ID. Concurrent lookups are batched into one $in query (see app/db/loader.py)
+async def load_user(user_id: str):
+    return await get_loader("user", user_collection_name).load(user_id)
+
+# Same batching, but only _id is fetched. Used for existence check
+async def load_user_ids(user_ids: list) -> list:
+    return await get_loader("user_exists", user_collection_name, {"_id": 1}).load_many(user_ids)
+
 # Helper to format MongoDB result to match our schema
 def user_helper(user) -> dict:
     return {
@@ -19,21 +43,175 @@ def user_helper(user) -> dict:
         "createdAt": user.get("createdAt"),
         "followers": user.get("followers", []),
         "following": user.get("following", []),
+        "follower_count": user.get("follower_count", len(user.get("followers", []))),
+        "following_count": user.get("following_count", len(user.get("following", []))),
         "location": user.get("location")
     }
 
+# Same as user_helper, without followers / following arrays (only their counts)
+def user_profile_helper(user) -> dict:
+    result = user_helper(user)
+    del result["followers"], result["following"]
+    return result
+
+# Whether profile responses include followers / following arrays by default (can be changed per request)
+profile_follow_lists = os.getenv("PROFILE_FOLLOW_LISTS", "true").lower() == "true"
+
+# Fields of user which can be requested in projection. "id" is stored as "_id" in MongoDB
+user_fields = ("id", "username", "name", "dob", "address", "description", "createdAt", "followers", "following",
+               "follower_count", "following_count", "location")
+
+# Parse comma separated field list (e.g. "id,username,name"). None means all fields.
+def parse_user_fields(fields: str | None):
+    if not fields:
+        return None
+    field_list = [field.strip() for field in fields.split(",") if field.strip()]
+    if not field_list or any(field not in user_fields for field in field_list):
+        return "Invalid Fields"
+    return field_list
+
+# Build MongoDB projection from list of user fields. None means all fields.
+def user_projection(field_list: list | None, *extra_fields) -> dict | None:
+    if field_list is None:
+        return None
+    projection = {("_id" if field == "id" else field): 1 for field in field_list}
+    for field in extra_fields:
+        projection[field] = 1
+    return projection
+
+# Same as user_helper, but only return requested fields
+def project_user(user, field_list: list | None) -> dict:
+    result = user_helper(user)
+    if field_list is None:
+        return result
+    return {field: result[field] for field in field_list}
+
+# In "edges" follow storage, follow arrays are not inside user document and need to be attached
+def needs_follow_lists(field_list: list | None) -> bool:
+    return field_list is None or "followers" in field_list or "following" in field_list
+
+# Opaque cursor for list pagination, encode position (createdAt, _id) of last returned user
+def encode_cursor(user) -> str:
+    raw = json.dumps([user.get("createdAt"), str(user.get("_id"))])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(created_at, str) or not isinstance(last_id, str):
+        return None
+    return created_at, last_id
+
+# Opaque cursor for lists ordered by ID only, encode _id of last returned user
+def encode_id_cursor(user) -> str:
+    raw = json.dumps([str(user.get("_id"))])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_id_cursor(cursor: str):
+    try:
+        (last_id,) = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(last_id, str):
+        return None
+    return last_id
+
+# Cache keys of the user model. Each key holds every variant (field) of one data, see app/core/cache.py
+def user_cache_key(user_id: str) -> str:
+    return f"user:{user_id}"
+
+def username_cache_key(username: str) -> str:
+    return f"username:{username}"
+
+def follow_list_cache_key(user_id: str, direction: str) -> str:
+    return f"{direction}:{user_id}"
+
+def nearby_cache_key(user_id: str) -> str:
+    return f"nearby:{user_id}"
+
+def suggestions_cache_key(user_id: str) -> str:
+    return f"suggestions:{user_id}"
+
+def location_anchor_key(user_id: str) -> str:
+    return f"anchor:{user_id}"
+
+# Only its generation is used: bumped when the location (beyond threshold), username or name of the user changes
+def nearby_version_key(user_id: str) -> str:
+    return f"nearby-version:{user_id}"
+
+# Moves shorter than this (meter) since the last invalidation don't invalidate cached nearby friends results
+nearby_cache_move_threshold_m = float(os.getenv("NEARBY_CACHE_MOVE_THRESHOLD_M", "50"))
+
+# Return the users (ID -> new [lng, lat]) who moved beyond the threshold from their anchor (location upon last
+# invalidation). Their anchor is moved to the new location. Without anchor (expired or never set) the user counts as moved
+async def moved_user_ids(coordinates: dict) -> list:
+    user_ids = list(coordinates.keys())
+    anchors = await asyncio.gather(*(user_cache.get(location_anchor_key(user_id)) for user_id in user_ids))
+    moved = [
+        user_id for user_id, anchor in zip(user_ids, anchors)
+        if anchor is None or nearby_query.distance_m(anchor, coordinates[user_id]) > nearby_cache_move_threshold_m
+    ]
+    await asyncio.gather(*(user_cache.set(location_anchor_key(user_id), coordinates[user_id]) for user_id in moved))
+    return moved
+
+# Invalidate cached nearby friends result of moved users. Results of their followers are not deleted one by one
+# (O(followers) upon every ping flush), they are stamped with the nearby version of every friend instead
+async def invalidate_moved_nearby(user_ids: list):
+    if not user_ids:
+        return
+    await user_cache.delete(*[nearby_cache_key(user_id) for user_id in user_ids],
+                            *[nearby_version_key(user_id) for user_id in user_ids])
+
+# Current nearby version of every friend, {friend ID: version}. Taken before querying the friends locations
+async def nearby_versions(friend_ids: list) -> dict:
+    return dict(zip(friend_ids, await user_cache.generation_many([nearby_version_key(friend_id) for friend_id in friend_ids])))
+
+# Cached nearby friends result is still valid if none of the friends changed since it was computed
+async def nearby_versions_match(versions: dict) -> bool:
+    current = await user_cache.generation_many([nearby_version_key(friend_id) for friend_id in versions])
+    return -1 not in current and current == list(versions.values())
+
+# Invalidate every cached data of the user which changes when follow graph of the user changes
+async def invalidate_follow_cache(follower_id: str, target_ids: list):
+    keys = [user_cache_key(follower_id), follow_list_cache_key(follower_id, "following"),
+            follow_list_cache_key(follower_id, "mutuals"), nearby_cache_key(follower_id), suggestions_cache_key(follower_id)]
+    for target_id in target_ids:
+        keys += [user_cache_key(target_id), follow_list_cache_key(target_id, "followers"), follow_list_cache_key(target_id, "mutuals")]
+    await user_cache.delete(*keys)
+
+# Invalidate cached profile, follow lists and nearby friends of users whose follow lists changed without them
+# (delete cascade, one call per batch of updated users)
+async def invalidate_follow_lists(user_ids: list):
+    keys = []
+    for user_id in user_ids:
+        keys += [user_cache_key(user_id), follow_list_cache_key(user_id, "followers"), follow_list_cache_key(user_id, "following"),
+                 follow_list_cache_key(user_id, "mutuals"), nearby_cache_key(user_id), suggestions_cache_key(user_id)]
+    await user_cache.delete(*keys)
+
+# References to a deleted user are removed from other users follow lists in the background
+delete_cascade = DeleteCascade(invalidate=invalidate_follow_lists)
+
 # CRUD OPERATIONS (to be called from the route layer)
 
-async def create_user(data: dict) -> dict:
-    """Insert a new user into the database."""
+# Fill generated fields (ID, creation time) of new user document
+def prepare_new_user(data: dict) -> dict:
     data["_id"] = str(uuid4())
     data["createdAt"] = datetime.now(timezone.utc).isoformat()
+    data["follower_count"] = 0
+    data["following_count"] = 0
 
     # Convert dob from datetime.date to datetime.datetime
     if isinstance(data.get("dob"), date):
         data["dob"] = datetime.combine(data["dob"], datetime.min.time())
+    return data
 
-    username_check = await get_database_session().get_collection(user_collection_name).find_one({"username": data["username"]})
+async def create_user(data: dict) -> dict:
+    """Insert a new user into the database."""
+    prepare_new_user(data)
+
+    username_check = await get_user_collection().find_one({"username": data["username"]})
     if username_check:
         logger.error(f"Failed Created User. Username ({data['username']}) already used by other user")
         return "Duplicate Username"
@@ -44,20 +222,180 @@ async def create_user(data: dict) -> dict:
             logger.error("Mandatory User Information Not Complete. Failed to create user.")
             return "Incomplete Data"
     
-    await get_database_session().get_collection(user_collection_name).insert_one(data)
+    # Concurrent create with the same username passes the check above, but is rejected by the unique index
+    try:
+        await get_user_collection().insert_one(data)
+    except DuplicateKeyError:
+        logger.error(f"Failed Created User. Username ({data['username']}) already used by other user")
+        return "Duplicate Username"
+    nearby_grid.set(data)
     
     return return_data
 
-async def retrieve_user(user_id: str) -> dict:
-    """Retrieve a single user by ID."""
-    user = await get_database_session().get_collection(user_collection_name).find_one({"_id": user_id})
+# Default and maximum number of records validated and inserted together in bulk_create_users
+bulk_create_default_chunk_size = 1000
+bulk_create_max_chunk_size = 10000
+
+# Insert one chunk of validated users with single unordered insert_many.
+# Returns list of inserted {"index", "id"} and list of failed {"index", "username", "error"}
+async def insert_user_chunk(chunk: list) -> tuple:
+    inserted = []
+    failed = []
+
+    # Duplicate username check for the whole chunk in one query, instead of one find_one per user
+    usernames = [data["username"] for _, data in chunk]
+    taken = set()
+    async for doc in get_user_collection().find({"username": {"$in": usernames}}, {"username": 1}):
+        taken.add(doc["username"])
+
+    docs = []
+    doc_indexes = []
+    for index, data in chunk:
+        if data["username"] in taken:
+            failed.append({"index": index, "username": data["username"], "error": "Duplicate Username"})
+            continue
+        # Also catch duplicate inside the same batch
+        taken.add(data["username"])
+        docs.append(prepare_new_user(data))
+        doc_indexes.append(index)
+
+    if not docs:
+        return inserted, failed
+
+    # ordered=False so one failing document (e.g. unique index violation) doesn't abort the rest
+    write_errors = {}
+    try:
+        await get_user_collection().insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            write_errors[error["index"]] = "Duplicate Username" if error.get("code") == 11000 else error.get("errmsg", "Write Error")
+
+    for position, doc in enumerate(docs):
+        if position in write_errors:
+            failed.append({"index": doc_indexes[position], "username": doc["username"], "error": write_errors[position]})
+        else:
+            inserted.append({"index": doc_indexes[position], "id": doc["_id"]})
+            nearby_grid.set(doc)
+    return inserted, failed
+
+async def bulk_create_users(records, chunk_size: int = bulk_create_default_chunk_size) -> dict:
+    """
+    Insert many users. records is (async) iterable of (index, data) where data is either validated
+    user dict or error message string. Failed records are reported without aborting the batch.
+    """
+    chunk_size = max(1, min(chunk_size, bulk_create_max_chunk_size))
+    inserted = []
+    failed = []
+    chunk = []
+
+    async def flush():
+        chunk_inserted, chunk_failed = await insert_user_chunk(chunk)
+        inserted.extend(chunk_inserted)
+        failed.extend(chunk_failed)
+        chunk.clear()
+
+    async for index, data in records:
+        if isinstance(data, str):
+            failed.append({"index": index, "username": None, "error": data})
+            continue
+        chunk.append((index, data))
+        if len(chunk) >= chunk_size:
+            await flush()
+    if chunk:
+        await flush()
+
+    failed.sort(key=lambda item: item["index"])
+    logger.info(f"Bulk Create User ({len(inserted)} inserted, {len(failed)} failed)")
+    return {
+        "inserted_count": len(inserted),
+        "failed_count": len(failed),
+        "inserted": inserted,
+        "failed": failed
+    }
+
+async def retrieve_user(user_id: str, follow_lists: bool = True) -> dict:
+    """Retrieve a single user by ID. Without follow_lists, followers / following arrays are neither read nor returned."""
+    if not follow_lists:
+        return await retrieve_user_profile(user_id)
+
+    cached = await user_cache.get(user_cache_key(user_id))
+    if cached is not None:
+        logger.info(f"Get User Information with ID {user_id} (cached)")
+        return cached
+
+    # Taken before reading, so a result outdated by a concurrent update is not cached
+    generation = await user_cache.generation(user_cache_key(user_id))
+    user = await load_user(user_id)
     if user:
+        await follow_store.attach_follow_lists([user])
         logger.info(f"Get User Information with ID {user_id}")
-        return user_helper(user)
+        result = user_helper(user)
+        await user_cache.set(user_cache_key(user_id), result, generation=generation)
+        return result
     else:
         logger.error(f"Failed Get User Information. The user with ID {user_id} is Non-Existance User")
         return None
 
+async def retrieve_user_profile(user_id: str) -> dict:
+    """Retrieve a single user by ID, with follower / following counts instead of the arrays."""
+    cached = await user_cache.get(user_cache_key(user_id), "profile")
+    if cached is not None:
+        logger.info(f"Get User Profile with ID {user_id} (cached)")
+        return cached
+
+    generation = await user_cache.generation(user_cache_key(user_id))
+    users = await follow_store.find_user_profiles([user_id])
+    if users:
+        logger.info(f"Get User Profile with ID {user_id}")
+        result = user_profile_helper(users[0])
+        await user_cache.set(user_cache_key(user_id), result, "profile", generation=generation)
+        return result
+    else:
+        logger.error(f"Failed Get User Profile. The user with ID {user_id} is Non-Existance User")
+        return None
+
+# Get follower / following counts of a user without reading the arrays
+async def get_user_stats(user_id: str):
+    cached = await user_cache.get(user_cache_key(user_id), "stats")
+    if cached is not None:
+        return cached
+
+    generation = await user_cache.generation(user_cache_key(user_id))
+    counts = await follow_store.get_follow_counts(user_id)
+    if counts is None:
+        logger.error(f"Failed Get User Stats. The user with ID {user_id} is Non-Existance User")
+        return "No Exist User"
+    result = {"id": user_id, **counts}
+    await user_cache.set(user_cache_key(user_id), result, "stats", generation=generation)
+    logger.info(f"Get User Stats with ID {user_id}")
+    return result
+
+# Maximum number of IDs resolved by one retrieve_users call
+batch_get_max_ids = int(os.getenv("BATCH_GET_MAX_IDS", "500"))
+
+async def retrieve_users(user_ids: list, follow_lists: bool = True) -> dict:
+    """Retrieve many users by ID with single query. Found users are returned in request order."""
+    # Remove duplicate ID but keep request order
+    user_ids = list(dict.fromkeys(user_ids))
+    if len(user_ids) > batch_get_max_ids:
+        logger.error(f"Failed Get Users Information. {len(user_ids)} IDs requested, maximum is {batch_get_max_ids}")
+        return "Too Many IDs"
+
+    if follow_lists:
+        found = {}
+        async for user in get_user_collection().find({"_id": {"$in": user_ids}}):
+            found[user["_id"]] = user
+        await follow_store.attach_follow_lists(list(found.values()))
+        helper = user_helper
+    else:
+        found = {user["_id"]: user for user in await follow_store.find_user_profiles(user_ids)}
+        helper = user_profile_helper
+
+    users = [helper(found[user_id]) for user_id in user_ids if user_id in found]
+    missing = [user_id for user_id in user_ids if user_id not in found]
+    logger.info(f"Get Users Information ({len(users)} found, {len(missing)} missing)")
+    return {"users": users, "missing": missing}
+
 async def update_user(user_id: str, data: dict) -> dict:
     """Update user info."""
     
@@ -65,14 +403,48 @@ async def update_user(user_id: str, data: dict) -> dict:
         data["dob"] = datetime.combine(data["dob"], datetime.min.time())
     
     if "username" in data and isinstance(data["username"], str):
-        username_check = await get_database_session().get_collection(user_collection_name).find_one({"username": data["username"]})
+        username_check = await get_user_collection().find_one({"username": data["username"]})
         if username_check:
             logger.error(f"Failed Created User. Username ({data['username']}) already used by other user")
             return "Duplicate Username"
 
-    user = await get_database_session().get_collection(user_collection_name).find_one({"_id": user_id})
+    # Buffered location ping taken before this update must not overwrite it (see app/models/location.py)
+    if data.get("location"):
+        data["locationUpdatedAt"] = datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+    # Arrays written directly replace the follow lists, so their counters follow
+    if not follow_store.uses_edges():
+        for direction, count_field in follow_store.count_fields.items():
+            if isinstance(data.get(direction), list):
+                data[direction] = list(dict.fromkeys(data[direction]))
+                data[count_field] = len(data[direction])
+
+    user = await get_user_collection().find_one({"_id": user_id})
     if user:
-        await get_database_session().get_collection(user_collection_name).update_one({"_id": user_id}, {"$set": data})
+        try:
+            await get_user_collection().update_one({"_id": user_id}, {"$set": data})
+        except DuplicateKeyError:
+            logger.error(f"Failed Update User. Username ({data['username']}) already used by other user")
+            return "Duplicate Username"
+        nearby_grid.update(user_id, data)
+        await follow_store.attach_follow_lists([user])
+
+        keys = [user_cache_key(user_id), username_cache_key(user.get("username")),
+                follow_list_cache_key(user_id, "followers"), follow_list_cache_key(user_id, "following"),
+                follow_list_cache_key(user_id, "mutuals")]
+        # Nearby friends results only change upon move beyond threshold (or location removed with null),
+        # or new name of a friend inside them
+        if data.get("location"):
+            moved = bool(await moved_user_ids({user_id: data["location"]["coordinates"]}))
+        else:
+            moved = "location" in data
+        if moved:
+            keys.append(nearby_cache_key(user_id))
+        # Cached nearby results of the followers are outdated, see nearby_versions_match
+        if moved or "username" in data or "name" in data:
+            keys.append(nearby_version_key(user_id))
+        await user_cache.delete(*keys)
+
         logger.info(f"Update User Information with ID {user_id}")
         return user_helper(user)
     else:
@@ -81,21 +453,95 @@ async def update_user(user_id: str, data: dict) -> dict:
 
 async def delete_user(user_id: str) -> bool:
     """Delete a user by ID."""
-    result = await get_database_session().get_collection(user_collection_name).delete_one({"_id": user_id})
-    return_result = result.deleted_count == 1
+    user = await get_user_collection().find_one_and_delete({"_id": user_id}, {"username": 1})
+    return_result = user is not None
     if return_result:
+        nearby_grid.remove(user_id)
+        follow_graph.remove_user(user_id)
+        keys = [user_cache_key(user_id), username_cache_key(user.get("username")), nearby_cache_key(user_id),
+                follow_list_cache_key(user_id, "followers"), follow_list_cache_key(user_id, "following"),
+                follow_list_cache_key(user_id, "mutuals"), nearby_version_key(user_id)]
+        await user_cache.delete(*keys)
+        # Followers / following lists of other users still hold the ID, they are cleaned in the background
+        # (their cached data included, batch by batch)
+        delete_cascade.enqueue(user_id)
         logger.info(f"Delete User Information with ID {user_id}")
     else:
         logger.error(f"Failed Delete User Information with ID {user_id}")
     return return_result
 
-async def list_users() -> list:
-    """Get all users in the database."""
-    users = []
-    async for user in get_database_session().get_collection(user_collection_name).find():
-        users.append(user_helper(user))
-    logger.info(f"Get List of User")
-    return users
+# Default and maximum page size of list_users
+list_users_default_limit = 50
+list_users_max_limit = 500
+
+async def list_users(limit: int = list_users_default_limit, after: str | None = None, fields: str | None = None) -> dict:
+    """Get one page of users, ordered by creation time. Use next_cursor as after to get next page."""
+    field_list = parse_user_fields(fields)
+    if isinstance(field_list, str):
+        logger.error(f"Failed Get List of User. Invalid fields requested ({fields})")
+        return field_list
+
+    # Keyset pagination: continue right after (createdAt, _id) of last user from previous page
+    query = {}
+    if after:
+        position = decode_cursor(after)
+        if position is None:
+            logger.error(f"Failed Get List of User. Invalid cursor ({after})")
+            return "Invalid Cursor"
+        created_at, last_id = position
+        query = {"$or": [
+            {"createdAt": {"$gt": created_at}},
+            {"createdAt": created_at, "_id": {"$gt": last_id}}
+        ]}
+
+    limit = max(1, min(limit, list_users_max_limit))
+    # Fetch one extra document to know if there is next page
+    cursor = get_user_collection().find(query, user_projection(field_list, "createdAt")) \
+        .sort([("createdAt", 1), ("_id", 1)]) \
+        .limit(limit + 1)
+    docs = await cursor.to_list(length=limit + 1)
+
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    docs = docs[:limit]
+    if needs_follow_lists(field_list):
+        await follow_store.attach_follow_lists(docs)
+    users = [project_user(doc, field_list) for doc in docs]
+    logger.info(f"Get List of User ({len(users)} users)")
+    return {"users": users, "next_cursor": next_cursor}
+
+# Default and maximum batch size of export_users
+export_users_default_batch_size = 1000
+export_users_max_batch_size = 10000
+
+async def export_users(field_list: list | None = None, batch_size: int = export_users_default_batch_size):
+    """Stream every user as NDJSON (one JSON per line), batch by batch straight from the cursor."""
+    batch_size = max(1, min(batch_size, export_users_max_batch_size))
+    cursor = get_user_collection().find({}, user_projection(field_list)) \
+        .sort("_id", 1) \
+        .batch_size(batch_size)
+
+    async def render(docs):
+        if needs_follow_lists(field_list):
+            await follow_store.attach_follow_lists(docs)
+        return "".join(json.dumps(project_user(doc, field_list), default=str) + "\n" for doc in docs)
+
+    docs = []
+    total = 0
+    async for doc in cursor:
+        docs.append(doc)
+        if len(docs) >= batch_size:
+            total += len(docs)
+            yield await render(docs)
+            docs = []
+    if docs:
+        total += len(docs)
+        yield await render(docs)
+    logger.info(f"Export List of User ({total} users)")
+
+# Check existence of every user ID, batched with concurrent lookups into single query
+async def users_exist(user_ids: list) -> bool:
+    users = await load_user_ids(list(set(user_ids)))
+    return all(user is not None for user in users)
 
 # Follow another user
 async def follow_user(follower_id: str, target_id: str) -> bool:
@@ -104,26 +550,18 @@ async def follow_user(follower_id: str, target_id: str) -> bool:
         return "Self Follow"  # Prevent self-follow
     
     # Check if both user is existing
-    follower_user = await get_database_session().get_collection(user_collection_name).find_one({"_id": follower_id})
-    target_user = await get_database_session().get_collection(user_collection_name).find_one({"_id": target_id})
-    
-    if follower_user is None or target_user is None:
+    if not await users_exist([follower_id, target_id]):
         logger.error(f"Failed Follow. Either or both of Follower or Target User is non-existance.")
         return "No Exist User" # Prevent non-existance User
 
-    # Update 'following' of follower
-    result_1 = await get_database_session().get_collection(user_collection_name).update_one(
-        {"_id": follower_id},
-        {"$addToSet": {"following": target_id}}
-    )
-    # Update 'followers' of target
-    result_2 = await get_database_session().get_collection(user_collection_name).update_one(
-        {"_id": target_id},
-        {"$addToSet": {"followers": follower_id}}
-    )
+    # Update 'following' of follower and 'followers' of target in one write (or add the edge)
+    modified = await follow_store.add_follow(follower_id, target_id)
+    if modified:
+        follow_graph.add(follower_id, target_id)
+        await invalidate_follow_cache(follower_id, [target_id])
     
     # Give warning of already followed
-    if result_1.modified_count == 0 and result_2.modified_count == 0:
+    if not modified:
         logger.warning(f"User with ID {follower_id} already followed user with ID {target_id}")
         return "Not Modified"
     # Return success
@@ -134,27 +572,18 @@ async def follow_user(follower_id: str, target_id: str) -> bool:
 # Unfollow a user
 async def unfollow_user(follower_id: str, target_id: str) -> bool:
     # Check if both user is existing
-    follower_user = await get_database_session().get_collection(user_collection_name).find_one({"_id": follower_id})
-    target_user = await get_database_session().get_collection(user_collection_name).find_one({"_id": target_id})
-    
-    if follower_user is None or target_user is None:
+    if not await users_exist([follower_id, target_id]):
         logger.error(f"Failed Follow. Either or both of Follower or Target User is non-existance.")
         return "No Exist User" # Prevent non-existance User
 
-    # Update 'following' of target
-    result_1 = await get_database_session().get_collection(user_collection_name).update_one(
-        {"_id": follower_id},
-        {"$pull": {"following": target_id}}
-    )
-
-    # Update 'followers' of target
-    result_2 = await get_database_session().get_collection(user_collection_name).update_one(
-        {"_id": target_id},
-        {"$pull": {"followers": follower_id}}
-    )
+    # Update 'following' of follower and 'followers' of target in one write (or remove the edge)
+    modified = await follow_store.remove_follow(follower_id, target_id)
+    if modified:
+        follow_graph.remove(follower_id, target_id)
+        await invalidate_follow_cache(follower_id, [target_id])
 
     # Give warning of wasn't following
-    if result_1.modified_count == 0 and result_2.modified_count == 0:
+    if not modified:
         logger.warning(f"User with ID {follower_id} wasn't following user with ID {target_id}")
         return "Not Modified"
     # Return success
@@ -162,44 +591,324 @@ async def unfollow_user(follower_id: str, target_id: str) -> bool:
         logger.info(f"User with ID {follower_id} unfollowed user with ID {target_id}")
         return True
 
+# Maximum number of target in one follow_users / unfollow_users call
+follow_batch_max_targets = int(os.getenv("FOLLOW_BATCH_MAX_TARGETS", "1000"))
+
+# Validate follower and targets of batch follow / unfollow with one query.
+# Return (list of target ID in request order without duplicates, list of valid target ID,
+# dict of per-target result already decided) or error string
+async def prepare_follow_batch(follower_id: str, target_ids: list):
+    target_ids = list(dict.fromkeys(target_ids))
+    if len(target_ids) > follow_batch_max_targets:
+        logger.error(f"Failed Batch Follow. {len(target_ids)} targets requested, maximum is {follow_batch_max_targets}")
+        return "Too Many Targets"
+
+    found = set()
+    async for user in get_user_collection().find({"_id": {"$in": [follower_id] + target_ids}}, {"_id": 1}):
+        found.add(user["_id"])
+    if follower_id not in found:
+        logger.error(f"Failed Batch Follow. Follower User with ID {follower_id} is non-existance.")
+        return "No Exist User"
+
+    statuses = {}
+    valid = []
+    for target_id in target_ids:
+        if target_id == follower_id:
+            statuses[target_id] = "self_follow"
+        elif target_id not in found:
+            statuses[target_id] = "not_found"
+        else:
+            valid.append(target_id)
+    return target_ids, valid, statuses
+
+def follow_batch_result(target_ids: list, statuses: dict) -> dict:
+    results = [{"target_id": target_id, "status": statuses[target_id]} for target_id in target_ids]
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    return {"results": results, "counts": counts}
+
+# Follow many users at once
+async def follow_users(follower_id: str, target_ids: list) -> dict:
+    prepared = await prepare_follow_batch(follower_id, target_ids)
+    if isinstance(prepared, str):
+        return prepared
+    target_ids, valid, statuses = prepared
+
+    followed = await follow_store.add_follows(follower_id, valid)
+    if followed:
+        for target_id in followed:
+            follow_graph.add(follower_id, target_id)
+        await invalidate_follow_cache(follower_id, list(followed))
+    for target_id in valid:
+        statuses[target_id] = "followed" if target_id in followed else "already_followed"
+
+    logger.info(f"User with ID {follower_id} followed {len(followed)} users in batch")
+    return follow_batch_result(target_ids, statuses)
+
+# Unfollow many users at once
+async def unfollow_users(follower_id: str, target_ids: list) -> dict:
+    prepared = await prepare_follow_batch(follower_id, target_ids)
+    if isinstance(prepared, str):
+        return prepared
+    target_ids, valid, statuses = prepared
+
+    unfollowed = await follow_store.remove_follows(follower_id, valid)
+    if unfollowed:
+        for target_id in unfollowed:
+            follow_graph.remove(follower_id, target_id)
+        await invalidate_follow_cache(follower_id, list(unfollowed))
+    for target_id in valid:
+        statuses[target_id] = "unfollowed" if target_id in unfollowed else "not_following"
+
+    logger.info(f"User with ID {follower_id} unfollowed {len(unfollowed)} users in batch")
+    return follow_batch_result(target_ids, statuses)
+
+# Default and maximum page size of followers / following list
+follow_list_default_limit = 100
+follow_list_max_limit = 1000
+
+# Compact user representation, used when list of user ID is expanded
+def user_summary_helper(user) -> dict:
+    return {
+        "id": str(user.get("_id")),
+        "username": user.get("username"),
+        "name": user.get("name"),
+        "location": user.get("location")
+    }
+
+user_summary_projection = {"username": 1, "name": 1, "location": 1}
+
+# Resolve list of user ID into user summaries with one query, keeping the order of the IDs
+async def expand_user_ids(user_ids: list) -> list:
+    found = {}
+    async for user in get_user_collection().find({"_id": {"$in": user_ids}}, user_summary_projection):
+        found[user["_id"]] = user
+    return [user_summary_helper(found[user_id]) for user_id in user_ids if user_id in found]
+
+# Get one page of follow list ("followers" or "following") of a user, alongside the total size
+async def get_follow_list(user_id: str, field: str, limit: int = follow_list_default_limit, offset: int = 0, expand: bool = False) -> dict:
+    limit = max(1, min(limit, follow_list_max_limit))
+    offset = max(0, offset)
+
+    # Only ID page is cached, expanded summaries depend on other users data
+    cache_key = follow_list_cache_key(user_id, field)
+    cache_field = f"{offset}:{limit}"
+    cached = await user_cache.get(cache_key, cache_field)
+    if cached is not None:
+        page, total = cached
+    else:
+        generation = await user_cache.generation(cache_key)
+        page, total = await follow_store.get_follow_page(user_id, field, limit=limit, offset=offset)
+        await user_cache.set(cache_key, [page, total], cache_field, generation=generation)
+
+    if expand and page:
+        page = await expand_user_ids(page)
+    return {field: page, "total": total, "limit": limit, "offset": offset}
+
+# Get users followed by a user who follow them back
+async def get_mutuals(user_id: str, limit: int = follow_list_default_limit, offset: int = 0, expand: bool = False) -> dict:
+    result = await get_follow_list(user_id, "mutuals", limit=limit, offset=offset, expand=expand)
+    logger.info(f"Get Mutuals of User with ID {user_id}")
+    return result
+
+# Get follow relationship between two users
+async def get_relationship(user_id: str, other_id: str):
+    if not await users_exist([user_id, other_id]):
+        logger.error(f"Failed Get Relationship. User with ID {user_id} or {other_id} is Non-Existance User")
+        return "No Exist User"
+    follows, followed_by = await follow_store.get_relationship(user_id, other_id)
+    return {"follows": follows, "followed_by": followed_by, "mutual": follows and followed_by}
+
 # Get followers of a user
-async def get_followers(user_id: str) -> list:
-    user = await get_database_session().get_collection(user_collection_name).find_one({"_id": user_id})
+async def get_followers(user_id: str, limit: int = follow_list_default_limit, offset: int = 0, expand: bool = False) -> dict:
+    result = await get_follow_list(user_id, "followers", limit=limit, offset=offset, expand=expand)
     logger.info(f"Get Followers of User with ID {user_id}")
-    return user.get("followers", []) if user else []
+    return result
 
 # Get following list of a user
-async def get_following(user_id: str) -> list:
-    user = await get_database_session().get_collection(user_collection_name).find_one({"_id": user_id})
+async def get_following(user_id: str, limit: int = follow_list_default_limit, offset: int = 0, expand: bool = False) -> dict:
+    result = await get_follow_list(user_id, "following", limit=limit, offset=offset, expand=expand)
     logger.info(f"Get Following of User with ID {user_id}")
-    return user.get("following", []) if user else []
+    return result
+
+# Default and maximum number of nearby friends per page (k nearest)
+nearby_default_limit = 100
+nearby_max_limit = 1000
+
+# First page of nearby friends is cached per distance bucket: computed at the bucket distance, then cut to the
+# asked distance. Distance above the last bucket is not cached
+nearby_cache_distance_buckets = (100, 250, 500, 1000, 2000, 5000, 10000, 20000, 50000)
+
+def nearby_distance_bucket(max_distance_m: int) -> int | None:
+    for bucket in nearby_cache_distance_buckets:
+        if max_distance_m <= bucket:
+            return bucket
+    return None
+
+# Page of nearby friends within max_distance_m from documents ordered by distance (limit + 1 within the query distance)
+def nearby_page(docs: list, max_distance_m: int, limit: int) -> dict:
+    within = [doc for doc in docs if doc["distance_m"] <= max_distance_m]
+    return {
+        "nearby_friends": [nearby_query.nearby_helper(doc) for doc in within[:limit]],
+        "next_cursor": nearby_query.encode_distance_cursor(within[limit - 1]) if len(within) > limit else None
+    }
 
-# Get nearby user following
-async def find_nearby_friends(username: str, max_distance_m: int = 1000) -> list:
-    user = await get_database_session().get_collection(user_collection_name).find_one({"username": username})
+# Get nearby user following, closest first, with distance in meter
+async def find_nearby_friends(username: str, max_distance_m: int = 1000, limit: int = nearby_default_limit,
+                              after: str | None = None, strategy: str | None = None) -> dict:
+    """
+    Following users within max_distance_m, closest first (k nearest with limit), in compact form with distance_m.
+    Use next_cursor as after to get next page. strategy forces query strategy (see app/models/nearby.py).
+    """
+    limit = max(1, min(limit, nearby_max_limit))
+    position = None
+    if after:
+        position = nearby_query.decode_distance_cursor(after)
+        if position is None:
+            logger.error(f"Failed Get Nearby Following. Invalid cursor ({after})")
+            return "Invalid Cursor"
+
+    # Only first page is cached, per distance bucket (see nearby_distance_bucket)
+    bucket = nearby_distance_bucket(max_distance_m) if after is None and strategy is None else None
+    cache_field = f"{bucket}:{limit}"
+    user_id = await user_cache.get(username_cache_key(username)) if bucket is not None else None
+    # Result is only cached when the user ID is known before reading (generation of the nearby key taken beforehand)
+    username_generation = nearby_generation = None
+    if user_id is not None:
+        cached = await user_cache.get(nearby_cache_key(user_id), cache_field)
+        if cached is not None and await nearby_versions_match(cached["versions"]):
+            logger.info(f"Get Nearby Following of User with ID {username} (cached)")
+            return nearby_page(cached["docs"], max_distance_m, limit)
+        nearby_generation = await user_cache.generation(nearby_cache_key(user_id))
+    elif bucket is not None:
+        username_generation = await user_cache.generation(username_cache_key(username))
+
+    user = await get_user_collection().find_one({"username": username})
     if not user or "location" not in user:
         logger.error(f"Failed Get User Information. The user with username {username} is Non-Existance User")
         return None
+    if username_generation is not None:
+        await user_cache.set(username_cache_key(username), user["_id"], generation=username_generation)
 
     user_coords = user["location"]["coordinates"]
-    friend_ids = user.get("following", [])  # or followers
-
-    # Query users within radius who are in their "following" list
-    cursor = get_database_session().get_collection(user_collection_name).find({
-        "_id": {"$in": friend_ids},
-        "location": {
-            "$near": {
-                "$geometry": {
-                    "type": "Point",
-                    "coordinates": user_coords
-                },
-                "$maxDistance": max_distance_m
-            }
-        }
-    })
-
-    nearby = []
-    async for doc in cursor:
-        nearby.append(user_helper(doc))
-    logger.info(f"Get Nearby Following of User with ID {username}")
-    return nearby
+    friend_ids = await follow_store.get_following_ids(user)  # or followers
+    cacheable = nearby_generation is not None and user["_id"] == user_id
+    versions = await nearby_versions(friend_ids) if cacheable else None
+
+    # Query users within radius (bucket distance if cached) who are in their "following" list. One extra user to know
+    # if there is next page. Answered from the in-process grid when enabled, otherwise the query strategy depends on
+    # the size of following list
+    query_distance = bucket or max_distance_m
+    docs = nearby_grid.query(user_coords, friend_ids, query_distance, limit + 1, after=position) if strategy is None else None
+    used_strategy = "grid"
+    if docs is None:
+        docs, used_strategy = await nearby_query.query_nearby(
+            user_coords, friend_ids, query_distance, limit + 1, after=position, strategy=strategy
+        )
+    if cacheable:
+        await user_cache.set(nearby_cache_key(user_id), {"docs": docs, "versions": versions}, cache_field,
+                             generation=nearby_generation)
+    logger.info(f"Get Nearby Following of User with ID {username} ({used_strategy}, {len(friend_ids)} following)")
+    return nearby_page(docs, max_distance_m, limit)
+
+# Default and maximum page size of search_users_in_area
+area_search_default_limit = 100
+area_search_max_limit = 1000
+# Compact fields returned by area search when fields is not given
+area_search_default_fields = "id,username,name,location"
+
+async def search_users_in_area(area: dict, limit: int = area_search_default_limit, after: str | None = None,
+                               fields: str | None = None) -> dict:
+    """
+    Get one page of every user inside area ($geoWithin filter from nearby.build_area_filter), ordered by ID.
+    Use next_cursor as after to get next page.
+    """
+    field_list = parse_user_fields(fields or area_search_default_fields)
+    if isinstance(field_list, str):
+        logger.error(f"Failed Search User in Area. Invalid fields requested ({fields})")
+        return field_list
+
+    query = dict(area)
+    if after:
+        last_id = decode_id_cursor(after)
+        if last_id is None:
+            logger.error(f"Failed Search User in Area. Invalid cursor ({after})")
+            return "Invalid Cursor"
+        query["_id"] = {"$gt": last_id}
+
+    limit = max(1, min(limit, area_search_max_limit))
+    # Fetch one extra document to know if there is next page
+    cursor = get_user_collection().find(query, user_projection(field_list)) \
+        .sort("_id", 1) \
+        .limit(limit + 1)
+    docs = await cursor.to_list(length=limit + 1)
+
+    next_cursor = encode_id_cursor(docs[limit - 1]) if len(docs) > limit else None
+    docs = docs[:limit]
+    if needs_follow_lists(field_list):
+        await follow_store.attach_follow_lists(docs)
+    users = [project_user(doc, field_list) for doc in docs]
+    logger.info(f"Search User in Area ({len(users)} users)")
+    return {"users": users, "next_cursor": next_cursor}
+
+# Friend suggestions (friend of friend) configuration (can be overridden from .env)
+suggestions_default_limit = 20
+suggestions_max_limit = 100
+# Following users expanded for the second hop, and following users taken from each of them (bounded fan-out)
+suggestions_max_following = int(os.getenv("SUGGESTIONS_MAX_FOLLOWING", "1000"))
+suggestions_fanout = int(os.getenv("SUGGESTIONS_FANOUT", "500"))
+# Candidates (most mutual connections first) ranked again with proximity boost
+suggestions_candidates = int(os.getenv("SUGGESTIONS_CANDIDATES", "500"))
+# Proximity boost: up to weight mutual connections, decreasing linearly to 0 at radius
+suggestions_proximity_weight = float(os.getenv("SUGGESTIONS_PROXIMITY_WEIGHT", "5"))
+suggestions_proximity_radius_m = float(os.getenv("SUGGESTIONS_PROXIMITY_RADIUS_M", "10000"))
+
+async def get_suggestions(user_id: str, limit: int = suggestions_default_limit, near: bool = False):
+    """
+    Suggest users followed by the users user_id follows (not already followed), ranked by the number of mutual
+    connections (followed users following them). With near, closer users within the proximity radius rank higher.
+    """
+    limit = max(1, min(limit, suggestions_max_limit))
+    cache_field = "near" if near else "mutual"
+    cached = await user_cache.get(suggestions_cache_key(user_id), cache_field)
+    if cached is not None:
+        logger.info(f"Get Suggestions of User with ID {user_id} (cached)")
+        return {"suggestions": cached[:limit]}
+
+    generation = await user_cache.generation(suggestions_cache_key(user_id))
+    user = await get_user_collection().find_one({"_id": user_id}, {"following": 1, "location": 1})
+    if not user:
+        logger.error(f"Failed Get Suggestions. The user with ID {user_id} is Non-Existance User")
+        return "No Exist User"
+
+    following = await follow_store.get_following_ids(user)
+    counts = await follow_store.count_second_hop(
+        following[:suggestions_max_following], [user_id, *following], suggestions_fanout, suggestions_candidates
+    )
+
+    found = {}
+    async for candidate in get_user_collection().find({"_id": {"$in": [candidate_id for candidate_id, _ in counts]}},
+                                                      user_summary_projection):
+        found[candidate["_id"]] = candidate
+
+    origin = (user.get("location") or {}).get("coordinates")
+    ranked = []
+    for candidate_id, mutual_count in counts:
+        if candidate_id not in found:
+            continue
+        suggestion = {**user_summary_helper(found[candidate_id]), "mutual_count": mutual_count, "score": mutual_count}
+        location = found[candidate_id].get("location")
+        if near and origin and location:
+            distance = nearby_query.distance_m(origin, location["coordinates"])
+            boost = suggestions_proximity_weight * max(0.0, 1 - distance / suggestions_proximity_radius_m)
+            suggestion["distance_m"] = round(distance, 2)
+            suggestion["score"] = round(mutual_count + boost, 4)
+        ranked.append(suggestion)
+    ranked.sort(key=lambda suggestion: (-suggestion["score"], -suggestion["mutual_count"], suggestion["id"]))
+
+    # Top of the ranking is cached, any limit is served from it
+    ranked = ranked[:suggestions_max_limit]
+    await user_cache.set(suggestions_cache_key(user_id), ranked, cache_field, generation=generation)
+    logger.info(f"Get Suggestions of User with ID {user_id} ({len(following)} following, {len(counts)} candidates)")
+    return {"suggestions": ranked[:limit]}
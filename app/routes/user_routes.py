@@ -1,9 +1,20 @@
-from fastapi import APIRouter, HTTPException, status
-from app.schemas.user_schema import UserCreate, UserUpdate, UserInDB
+import json
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, Request, status
+from pydantic import ValidationError
+from fastapi.responses import StreamingResponse
+from app.schemas.user_schema import UserCreate, UserUpdate, UserInDB, UserPage, UserBatchGet, UserBatch, UserStats, FollowBatch, LocationPing
 from app.models import user as user_model
+from app.models import nearby as nearby_query
+from app.models.location import location_buffer
+from app.models import live as live_model
+from app.core.singleflight import SingleFlight
 
 router = APIRouter()
 
+# Identical concurrent reads (same user, same nearby query) share one in-flight query
+read_flight = SingleFlight("user_reads")
+
 # CREATE a user
 @router.post("/", response_model=UserInDB, status_code=status.HTTP_201_CREATED)
 async def create_user(user: UserCreate):
@@ -18,17 +29,135 @@ async def create_user(user: UserCreate):
             raise HTTPException(status_code=422, detail="User data not completed")
     return new_user
 
+# EXPORT all users as NDJSON stream
+# Declared before "/{user_id}" so "export" is not taken as user ID
+@router.get("/export")
+async def export_users(
+    batch_size: int = Query(user_model.export_users_default_batch_size, ge=1, le=user_model.export_users_max_batch_size),
+    fields: Optional[str] = None
+):
+    """
+    Export every user as NDJSON (one user JSON per line), streamed directly from database cursor.
+    Use `fields` to only return some fields, e.g. `fields=id,username,name`.
+    """
+    field_list = user_model.parse_user_fields(fields)
+    if isinstance(field_list, str):
+        raise HTTPException(status_code=400, detail=f"Invalid fields. Available fields: {', '.join(user_model.user_fields)}")
+    return StreamingResponse(
+        user_model.export_users(field_list, batch_size=batch_size),
+        media_type="application/x-ndjson"
+    )
+
+# Parse NDJSON request body line by line while it is being received
+async def iter_ndjson_records(request: Request):
+    buffer = b""
+    index = 0
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield index, line
+                index += 1
+    if buffer.strip():
+        yield index, buffer
+
+async def iter_json_array_records(items: list):
+    for index, item in enumerate(items):
+        yield index, item
+
+# Validate each raw record as UserCreate. Yield (index, data) or (index, error message)
+async def validate_user_records(records):
+    async for index, raw in records:
+        try:
+            if isinstance(raw, bytes):
+                raw = json.loads(raw)
+            yield index, UserCreate.model_validate(raw).model_dump()
+        except ValidationError as e:
+            yield index, "; ".join(f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}" for error in e.errors())
+        # Malformed JSON or invalid UTF-8 (JSONDecodeError and UnicodeDecodeError are both ValueError)
+        except ValueError:
+            yield index, "Invalid JSON"
+
+# CREATE many users at once
+@router.post("/bulk")
+async def bulk_create_users(
+    request: Request,
+    chunk_size: int = Query(user_model.bulk_create_default_chunk_size, ge=1, le=user_model.bulk_create_max_chunk_size)
+):
+    """
+    Create many users at once. Body is either JSON array of users, or NDJSON (one user per line)
+    with `Content-Type: application/x-ndjson`. Every user has the same mandatory fields as single creation.
+    Failed records (validation error, duplicate username) are reported by their index without aborting the batch.
+    """
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        records = iter_ndjson_records(request)
+    else:
+        try:
+            items = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array of users")
+        records = iter_json_array_records(items)
+
+    return await user_model.bulk_create_users(validate_user_records(records), chunk_size=chunk_size)
+
+# SEARCH every user inside an area
+# Declared before "/{user_id}" so "nearby" is not taken as user ID
+@router.get("/nearby", response_model=UserPage, response_model_exclude_unset=True)
+async def search_users_in_area(
+    lng: Optional[float] = None,
+    lat: Optional[float] = None,
+    radius: Optional[float] = Query(None, gt=0, description="Radius in meter around (lng, lat)"),
+    bbox: Optional[str] = Query(None, description="Bounding box: minLng,minLat,maxLng,maxLat"),
+    polygon: Optional[str] = Query(None, description="Polygon: lng,lat;lng,lat;lng,lat;..."),
+    limit: int = Query(user_model.area_search_default_limit, ge=1, le=user_model.area_search_max_limit),
+    after: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    """
+    Search every user (not only friends) inside exactly one area: circle (`lng`, `lat`, `radius` in meter),
+    bounding box (`bbox`) or polygon (`polygon`). Users are returned page by page, pass `next_cursor` of the
+    response as `after` to get the next page. By default only `id,username,name,location` are returned, use `fields` to change.
+    """
+    area = nearby_query.build_area_filter(lng=lng, lat=lat, radius_m=radius, bbox=bbox, polygon_points=polygon)
+    if isinstance(area, str):
+        raise HTTPException(status_code=400, detail="Invalid area. Give either lng, lat and radius, or bbox, or polygon.")
+
+    result = await user_model.search_users_in_area(area, limit=limit, after=after, fields=fields)
+    if isinstance(result, str):
+        if result == "Invalid Fields":
+            raise HTTPException(status_code=400, detail=f"Invalid fields. Available fields: {', '.join(user_model.user_fields)}")
+        elif result == "Invalid Cursor":
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return result
+
 # GET a single user by ID
-@router.get("/{user_id}", response_model=UserInDB)
-async def get_user(user_id: str):
+@router.get("/{user_id}", response_model=UserInDB, response_model_exclude_unset=True)
+async def get_user(user_id: str, follow_lists: bool = user_model.profile_follow_lists):
     """
-    Get a user by their ID.
+    Get a user by their ID. Set `follow_lists=false` to only get `follower_count` / `following_count`
+    instead of the whole `followers` / `following` arrays.
     """
-    user = await user_model.retrieve_user(user_id)
+    user = await read_flight.do(f"user:{user_id}:{follow_lists}", lambda: user_model.retrieve_user(user_id, follow_lists))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
+# GET many users by ID in one request
+@router.post("/batch-get", response_model=UserBatch, response_model_exclude_unset=True)
+async def batch_get_users(request: UserBatchGet, follow_lists: bool = user_model.profile_follow_lists):
+    """
+    Get many users by their ID in one request. Found users are returned in the same order as requested,
+    and the IDs which are not found are listed in `missing`. Set `follow_lists=false` to omit the follow arrays.
+    """
+    result = await user_model.retrieve_users(request.ids, follow_lists)
+    if isinstance(result, str):
+        if result == "Too Many IDs":
+            raise HTTPException(status_code=400, detail=f"Too many IDs. Maximum is {user_model.batch_get_max_ids}")
+    return result
+
 # UPDATE a user
 @router.patch("/{user_id}", response_model=UserInDB)
 async def update_user(user_id: str, user_data: UserUpdate):
@@ -43,6 +172,23 @@ async def update_user(user_id: str, user_data: UserUpdate):
             raise HTTPException(status_code=404, detail="User not found")
     return updated_user
 
+# UPDATE location of a user (high frequency ping)
+@router.put("/{user_id}/location", status_code=status.HTTP_202_ACCEPTED)
+async def update_location(user_id: str, ping: LocationPing):
+    """
+    Record the current location of a user. The ping is buffered and written in batch shortly after,
+    only the latest ping per user is written. Ping of unknown user is ignored upon write.
+    """
+    location = ping.location.model_dump()
+    # Checked now, the ping is written later in batch with other users pings
+    if not nearby_query.is_valid_point(location):
+        raise HTTPException(status_code=400, detail="Invalid location. Coordinates must be [longitude, latitude] within range.")
+    accepted = location_buffer.add(user_id, location, ping.timestamp)
+    if accepted == "Buffer Full":
+        raise HTTPException(status_code=503, detail="Too many pending location updates. Retry later.",
+                            headers={"Retry-After": "1"})
+    return {"status": "accepted"}
+
 # DELETE a user
 @router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_user(user_id: str):
@@ -55,12 +201,24 @@ async def delete_user(user_id: str):
     return None
 
 # LIST all users
-@router.get("/", response_model=list[UserInDB])
-async def list_users():
+@router.get("/", response_model=UserPage, response_model_exclude_unset=True)
+async def list_users(
+    limit: int = Query(user_model.list_users_default_limit, ge=1, le=user_model.list_users_max_limit),
+    after: Optional[str] = None,
+    fields: Optional[str] = None
+):
     """
-    List all users in the database.
+    List users in the database page by page, ordered by creation time.
+    Pass `next_cursor` of the response as `after` to get the next page (null means no more page).
+    Use `fields` to only return some fields, e.g. `fields=id,username,name`.
     """
-    return await user_model.list_users()
+    result = await user_model.list_users(limit=limit, after=after, fields=fields)
+    if isinstance(result, str):
+        if result == "Invalid Fields":
+            raise HTTPException(status_code=400, detail=f"Invalid fields. Available fields: {', '.join(user_model.user_fields)}")
+        elif result == "Invalid Cursor":
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return result
 
 # Follow another user
 @router.patch("/{user_id}/follow/{target_id}")
@@ -92,29 +250,164 @@ async def unfollow(user_id: str, target_id: str):
             raise HTTPException(status_code=409, detail=f"User {user_id} wasn't following user with ID {target_id}")
     return {"message": f"User {user_id} unfollowed user with ID {target_id}"}
 
+# Follow many users at once
+@router.post("/{user_id}/follow")
+async def follow_many(user_id: str, request: FollowBatch):
+    """
+    Get user follow many users at once (e.g. contact import). Result of every target is reported in `results`
+    with status `followed`, `already_followed`, `not_found` or `self_follow`.
+    """
+    result = await user_model.follow_users(user_id, request.target_ids)
+    if isinstance(result, str):
+        if result == "No Exist User":
+            raise HTTPException(status_code=400, detail="Invalid follower ID. Please check your input.")
+        elif result == "Too Many Targets":
+            raise HTTPException(status_code=400, detail=f"Too many targets. Maximum is {user_model.follow_batch_max_targets}")
+    return result
+
+# Unfollow many users at once
+@router.post("/{user_id}/unfollow")
+async def unfollow_many(user_id: str, request: FollowBatch):
+    """
+    Get user unfollow many users at once. Result of every target is reported in `results`
+    with status `unfollowed`, `not_following`, `not_found` or `self_follow`.
+    """
+    result = await user_model.unfollow_users(user_id, request.target_ids)
+    if isinstance(result, str):
+        if result == "No Exist User":
+            raise HTTPException(status_code=400, detail="Invalid follower ID. Please check your input.")
+        elif result == "Too Many Targets":
+            raise HTTPException(status_code=400, detail=f"Too many targets. Maximum is {user_model.follow_batch_max_targets}")
+    return result
+
 # Get followers
 @router.get("/{user_id}/followers")
-async def followers(user_id: str):
+async def followers(
+    user_id: str,
+    limit: int = Query(user_model.follow_list_default_limit, ge=1, le=user_model.follow_list_max_limit),
+    offset: int = Query(0, ge=0),
+    expand: bool = False
+):
     """
-    Get the list of follower by ID  
+    Get the list of follower by ID, page by page using `limit` and `offset`. `total` is the number of all followers.
+    Set `expand=true` to get compact user information (id, username, name, location) instead of only ID.
     """
-    result = await user_model.get_followers(user_id)
-    return {"followers": result}
+    return await user_model.get_followers(user_id, limit=limit, offset=offset, expand=expand)
 
 # Get following
 @router.get("/{user_id}/following")
-async def following(user_id: str):
+async def following(
+    user_id: str,
+    limit: int = Query(user_model.follow_list_default_limit, ge=1, le=user_model.follow_list_max_limit),
+    offset: int = Query(0, ge=0),
+    expand: bool = False
+):
+    """
+    Get the list of following by ID, page by page using `limit` and `offset`. `total` is the number of all following.
+    Set `expand=true` to get compact user information (id, username, name, location) instead of only ID.
+    """
+    return await user_model.get_following(user_id, limit=limit, offset=offset, expand=expand)
+
+# Get follower / following counts
+@router.get("/{user_id}/stats", response_model=UserStats)
+async def user_stats(user_id: str):
+    """
+    Get `follower_count` and `following_count` of a user, without reading the follow lists.
+    """
+    result = await user_model.get_user_stats(user_id)
+    if result == "No Exist User":
+        raise HTTPException(status_code=404, detail="User not found")
+    return result
+
+# Get mutuals (following who follow back)
+@router.get("/{user_id}/mutuals")
+async def mutuals(
+    user_id: str,
+    limit: int = Query(user_model.follow_list_default_limit, ge=1, le=user_model.follow_list_max_limit),
+    offset: int = Query(0, ge=0),
+    expand: bool = False
+):
+    """
+    Get the users followed by ID who follow them back, ordered by ID, page by page using `limit` and `offset`.
+    `total` is the number of all mutuals. Set `expand=true` to get compact user information instead of only ID.
+    """
+    return await user_model.get_mutuals(user_id, limit=limit, offset=offset, expand=expand)
+
+# Get relationship between two users
+@router.get("/{user_id}/relationship/{other_id}")
+async def relationship(user_id: str, other_id: str):
+    """
+    Whether user_id follows other_id (`follows`), other_id follows user_id (`followed_by`), and both (`mutual`).
+    """
+    result = await user_model.get_relationship(user_id, other_id)
+    if result == "No Exist User":
+        raise HTTPException(status_code=404, detail="User not found")
+    return result
+
+# GET friend suggestions of a user
+@router.get("/{user_id}/suggestions")
+async def suggestions(
+    user_id: str,
+    limit: int = Query(user_model.suggestions_default_limit, ge=1, le=user_model.suggestions_max_limit),
+    near: bool = False
+):
+    """
+    Suggest users to follow: people followed by the users they follow, ranked by `mutual_count`
+    (how many of the users they follow follow the suggestion). Use `near=true` to rank closer users higher.
     """
-    Get the list of following by ID  
+    result = await user_model.get_suggestions(user_id, limit=limit, near=near)
+    if result == "No Exist User":
+        raise HTTPException(status_code=404, detail="User not found")
+    return result
+
+# STREAM nearby friends of a user (Server-Sent Events)
+@router.get("/{username}/nearby-friends/stream")
+async def stream_nearby_friends(username: str, request: Request, distance: int = Query(1000, ge=1)):
+    """
+    Push nearby friends of a user as Server-Sent Events instead of polling. First a `snapshot` event with every
+    friend within X meters, then `enter` / `leave` events when a friend comes within / goes out of distance.
+    Needs MongoDB replica set (change streams).
     """
-    result = await user_model.get_following(user_id)
-    return {"following": result}
+    subscription = await live_model.subscribe_nearby_friends(username, max_distance_m=distance)
+    if subscription == "Not Supported":
+        raise HTTPException(status_code=503, detail="Live nearby friends needs MongoDB replica set")
+    if subscription is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    async def events():
+        async for event, data in live_model.nearby_friend_events(subscription):
+            if await request.is_disconnected():
+                break
+            if event == "heartbeat":
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # Get neary by following
 @router.get("/{username}/nearby-friends")
-async def get_nearby_friends(username: str, distance: int = 1000):
+async def get_nearby_friends(
+    username: str,
+    distance: int = 1000,
+    limit: int = Query(user_model.nearby_default_limit, ge=1, le=user_model.nearby_max_limit),
+    k: Optional[int] = Query(None, ge=1, le=user_model.nearby_max_limit),
+    after: Optional[str] = None
+):
     """
-    Return nearby friends (people they follow) by Username within X meters. Default X is 1000
+    Return nearby friends (people they follow) by Username within X meters, closest first. Default X is 1000.
+    Every friend has `distance_m` (distance in meter). Use `limit` (or `k`) to get only the k nearest,
+    and pass `next_cursor` of the response as `after` to get the next page.
     """
-    nearby = await user_model.find_nearby_friends(username, max_distance_m=distance)
-    return {"nearby_friends": nearby}
\ No newline at end of file
+    limit = k or limit
+    nearby = await read_flight.do(
+        f"nearby:{username}:{distance}:{limit}:{after}",
+        lambda: user_model.find_nearby_friends(username, max_distance_m=distance, limit=limit, after=after)
+    )
+    if isinstance(nearby, str):
+        if nearby == "Invalid Cursor":
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    if nearby is None:
+        return {"nearby_friends": None, "next_cursor": None}
+    return nearby
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from typing import Optional, List
-from datetime import date
+from datetime import date, datetime
 
 class Location(BaseModel):
     type: str = Field(default="Point",json_schema_extra={"example": "Point"})
@@ -32,9 +32,56 @@ class UserUpdate(BaseModel):
 class UserInDB(UserBase):
     id: str
     createdAt: str
-    followers: List[str]
-    following: List[str]
+    followers: Optional[List[str]] = None
+    following: Optional[List[str]] = None
+    follower_count: int = 0
+    following_count: int = 0
     
     model_config = {
         "from_attributes": True
     }
+
+
+class UserListItem(BaseModel):
+    """Schema of user inside a list. Every field is optional as the list can be projected."""
+    id: Optional[str] = None
+    username: Optional[str] = None
+    name: Optional[str] = None
+    dob: Optional[date] = None
+    address: Optional[str] = None
+    description: Optional[str] = None
+    createdAt: Optional[str] = None
+    followers: Optional[List[str]] = None
+    following: Optional[List[str]] = None
+    follower_count: Optional[int] = None
+    following_count: Optional[int] = None
+    location: Optional[Location] = None
+
+class UserPage(BaseModel):
+    """Schema of one page of user list."""
+    users: List[UserListItem]
+    next_cursor: Optional[str] = None
+
+class UserBatchGet(BaseModel):
+    """Schema of request to get many users by ID."""
+    ids: List[str] = Field(...,json_schema_extra={"example": ["1", "2", "3"]})
+
+class UserBatch(BaseModel):
+    """Schema of many users found by ID, alongside the IDs not found."""
+    users: List[UserInDB]
+    missing: List[str]
+
+class UserStats(BaseModel):
+    """Schema of follower / following counts of a user."""
+    id: str
+    follower_count: int
+    following_count: int
+
+class FollowBatch(BaseModel):
+    """Schema of request to follow or unfollow many users at once."""
+    target_ids: List[str] = Field(...,json_schema_extra={"example": ["1", "2", "3"]})
+
+class LocationPing(BaseModel):
+    """Schema of location ping. Timestamp (when the location was taken) defaults to the time it is received."""
+    location: Location = Field(...,json_schema_extra={"example": {"type": "Point", "coordinates": [106.8456, -6.2088]}})
+    timestamp: Optional[datetime] = Field(None,json_schema_extra={"example": "2024-01-01T08:00:00Z"})
@@ -0,0 +1,96 @@
+# Benchmark of the in-memory follow graph snapshot (see app/models/graph.py)
+#
+# Generates a random follow graph in memory (popular users get many more followers, like a real social graph),
+# builds the CSR snapshot, then prints memory and timing of the analytics queries and of incremental updates.
+# No MongoDB is needed.
+#
+# Usage:
+#   python -m benchmarks.follow_graph --users 200000 --edges 2000000
+import argparse
+import asyncio
+import itertools
+import random
+import time
+import tracemalloc
+from array import array
+
+from app.models.graph import FollowGraph, build_snapshot
+
+def random_edges(user_count: int, edge_count: int, skew: float) -> tuple:
+    # Target popularity follows Zipf-like weights, follower is uniform
+    weights = list(itertools.accumulate(1 / (rank + 1) ** skew for rank in range(user_count)))
+    seen = set()
+    sources, targets = array("I"), array("I")
+    while len(sources) < edge_count:
+        batch = edge_count - len(sources)
+        for source, target in zip(random.choices(range(user_count), k=batch),
+                                  random.choices(range(user_count), cum_weights=weights, k=batch)):
+            key = source * user_count + target
+            if source != target and key not in seen:
+                seen.add(key)
+                sources.append(source)
+                targets.append(target)
+    return sources, targets
+
+def timed(fn, repeat: int = 1) -> tuple:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) * 1000 / repeat, result
+
+async def main(args):
+    random.seed(args.seed)
+    started = time.perf_counter()
+    sources, targets = random_edges(args.users, args.edges, args.skew)
+    print(f"Generated {args.users} users, {len(sources)} edges in {time.perf_counter() - started:.1f} s")
+
+    # Memory of the ID index is traced, the CSR arrays size is exact
+    tracemalloc.start()
+    graph = FollowGraph(enabled=True, delta_max=args.updates + 1)
+    for user in range(args.users):
+        graph.node(f"user_{user}")
+    index_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    build_ms, snapshots = timed(lambda: build_snapshot(args.users, sources, targets))
+    graph.swap(*snapshots)
+    snapshot_bytes = graph.stats()["snapshot_bytes"]
+
+    print(f"Build              : {build_ms / 1000:.2f} s")
+    print(f"Memory snapshot    : {snapshot_bytes / 2 ** 20:.1f} MiB (CSR arrays of both directions)")
+    print(f"Memory ID index    : {index_bytes / 2 ** 20:.1f} MiB")
+    print(f"Bytes per edge     : {(snapshot_bytes + index_bytes) / len(sources):.1f} (snapshot and index)")
+
+    sample = [f"user_{user}" for user in random.sample(range(args.users), args.samples)]
+    for hops in (1, 2, 3):
+        elapsed_ms = sum(timed(lambda: graph.reach(user_id, max_hops=hops))[0] for user_id in sample) / len(sample)
+        reached = sum(graph.reach(user_id, max_hops=hops)["reached"] for user_id in sample) / len(sample)
+        print(f"Reach {hops} hop(s)     : {elapsed_ms:.2f} ms (average {reached:.0f} users reached)")
+
+    elapsed_ms, stats = timed(lambda: graph.degree_stats("followers"))
+    print(f"Degree stats       : {elapsed_ms:.0f} ms {stats}")
+
+    pairs = [(f"user_{random.randrange(args.users)}", f"user_{random.randrange(args.users)}") for _ in range(10000)]
+    elapsed_ms, _ = timed(lambda: [graph.is_mutual(a, b) for a, b in pairs])
+    print(f"Mutual check       : {elapsed_ms * 1000 / len(pairs):.2f} us per pair")
+    elapsed_ms = sum(timed(lambda: graph.mutual_follows(user_id))[0] for user_id in sample) / len(sample)
+    print(f"Mutual follows list: {elapsed_ms:.3f} ms per user")
+
+    updates = [(f"user_{random.randrange(args.users)}", f"user_{random.randrange(args.users)}") for _ in range(args.updates)]
+    elapsed_ms, _ = timed(lambda: [graph.add(a, b) for a, b in updates])
+    print(f"Incremental add    : {elapsed_ms * 1000 / len(updates):.2f} us per follow ({graph.stats()['pending_changes']} pending)")
+    elapsed_ms, _ = timed(lambda: [graph.remove(a, b) for a, b in updates[: len(updates) // 2]])
+    print(f"Incremental remove : {elapsed_ms * 1000 / (len(updates) // 2):.2f} us per unfollow")
+
+    started = time.perf_counter()
+    await graph.compact()
+    print(f"Compaction         : {time.perf_counter() - started:.2f} s ({graph.stats()['snapshot_edges']} edges)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark in-memory follow graph snapshot")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--edges", type=int, default=1000000)
+    parser.add_argument("--skew", type=float, default=0.8, help="Zipf exponent of target popularity")
+    parser.add_argument("--samples", type=int, default=20, help="Users sampled for reach and mutual follows")
+    parser.add_argument("--updates", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=42)
+    asyncio.run(main(parser.parse_args()))
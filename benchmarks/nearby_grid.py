@@ -0,0 +1,78 @@
+# Benchmark of the in-process nearby grid (see app/models/grid.py) against the MongoDB nearby query
+#
+# Seeds a dedicated database like nearby_strategies.py, loads the grid, then for several following list sizes
+# runs both and prints the average latency. The results of both are checked to be identical.
+#
+# Usage (needs a MongoDB, use a dedicated database, it is filled with benchmark data):
+#   MONGO_DB_NAME=ryde_benchmark python -m benchmarks.nearby_grid --users 200000 --following 100 1000 10000 50000
+import argparse
+import asyncio
+import random
+import time
+
+from app.db import mongo
+from app.db.mongo import init_db_indexes, get_database_session, close_database_client
+from app.models import follow as follow_store
+from app.models import nearby as nearby_query
+from app.models.grid import GeoGrid
+from benchmarks.nearby_strategies import seed, cleanup
+
+async def time_query(query, repeat: int) -> tuple:
+    result = None
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = await query()
+    elapsed_ms = (time.perf_counter() - started) * 1000 / repeat
+    return elapsed_ms, result
+
+async def main(args):
+    if mongo.DATABASE_NAME == "ryde_users_db" and not args.allow_default_db:
+        raise SystemExit("Refusing to seed benchmark data into the application database. Set MONGO_DB_NAME or pass --allow-default-db")
+
+    random.seed(args.seed)
+    await init_db_indexes()
+    try:
+        centers = await seed(args.users, args.following, args.spread_km)
+        grid = GeoGrid(enabled=True, precision=args.precision)
+        started = time.perf_counter()
+        loaded = await grid.load()
+        print(f"Grid loaded {loaded} users into {len(grid.cells)} cells in {time.perf_counter() - started:.2f} s")
+
+        print(f"{args.users} users within {args.spread_km} km, radius {args.distance} m, {args.limit} nearest, average of {args.repeat} runs")
+        print(f"{'following':>10} | {'mongodb':>12} | {'grid':>12} | speedup")
+        for size, username in centers.items():
+            user = await get_database_session()["users"].find_one({"username": username})
+            coordinates = user["location"]["coordinates"]
+            friend_ids = await follow_store.get_following_ids(user)
+
+            async def mongo_query():
+                docs, _ = await nearby_query.query_nearby(coordinates, friend_ids, args.distance, args.limit)
+                return docs
+
+            async def grid_query():
+                return grid.query(coordinates, friend_ids, args.distance, args.limit)
+
+            mongo_ms, expected = await time_query(mongo_query, args.repeat)
+            grid_ms, result = await time_query(grid_query, args.repeat)
+            # Both must find the same users in the same order, at the same distance
+            assert [doc["_id"] for doc in result] == [doc["_id"] for doc in expected], f"grid result differs for following={size}"
+            assert all(abs(a["distance_m"] - b["distance_m"]) < 1e-3 for a, b in zip(result, expected))
+            print(f"{size:>10} | {mongo_ms:>9.2f} ms | {grid_ms:>9.3f} ms | {mongo_ms / grid_ms if grid_ms else float('inf'):.0f}x")
+    finally:
+        if not args.keep:
+            await cleanup()
+        close_database_client()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark in-process nearby grid against MongoDB nearby query")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--following", type=int, nargs="+", default=[100, 1000, 5000, 20000, 50000])
+    parser.add_argument("--distance", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=1000, help="k nearest friends to return")
+    parser.add_argument("--spread-km", type=float, default=30)
+    parser.add_argument("--precision", type=int, default=6, help="Geohash length of grid cell")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="Keep benchmark data afterwards")
+    parser.add_argument("--allow-default-db", action="store_true")
+    asyncio.run(main(parser.parse_args()))
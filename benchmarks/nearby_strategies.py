@@ -0,0 +1,122 @@
+# Benchmark of nearby friends query strategies (see app/models/nearby.py)
+#
+# Seeds a dedicated database with random users around one point, then for several following list sizes
+# runs every strategy and prints the average latency. The results of every strategy are checked to be identical.
+#
+# Usage (needs a MongoDB, use a dedicated database, it is filled with benchmark data):
+#   MONGO_DB_NAME=ryde_benchmark python -m benchmarks.nearby_strategies --users 200000 --following 100 1000 10000 50000
+import argparse
+import asyncio
+import math
+import random
+import time
+
+from app.db import mongo
+from app.db.mongo import init_db_indexes, get_database_session, close_database_client
+from app.models import follow as follow_store
+from app.models import nearby as nearby_query
+from app.models.user import find_nearby_friends, prepare_new_user
+
+# Singapore, users are spread within spread_km around it
+center = [103.8198, 1.3521]
+
+def random_location(spread_km: float) -> dict:
+    # Uniform in a disc, good enough for benchmark at this scale
+    radius = spread_km * math.sqrt(random.random()) / 111.32
+    angle = random.random() * 2 * math.pi
+    return {"type": "Point", "coordinates": [center[0] + radius * math.cos(angle), center[1] + radius * math.sin(angle)]}
+
+def bench_user(username: str, location: dict) -> dict:
+    return prepare_new_user({
+        "username": username,
+        "name": username,
+        "dob": None,
+        "address": "Benchmark",
+        "description": "Benchmark user",
+        "location": location,
+    })
+
+# Every benchmark user has username starting with bench_
+bench_filter = {"username": {"$regex": "^bench_"}}
+
+async def cleanup():
+    users = get_database_session()["users"]
+    center_ids = [doc["_id"] async for doc in users.find({"username": {"$regex": "^bench_center_"}}, {"_id": 1})]
+    await follow_store.get_follow_collection().delete_many({"follower_id": {"$in": center_ids}})
+    await users.delete_many(bench_filter)
+
+async def seed(user_count: int, following_sizes: list, spread_km: float) -> dict:
+    users = get_database_session()["users"]
+    await cleanup()
+
+    ids = []
+    batch = []
+    for i in range(user_count):
+        doc = bench_user(f"bench_user_{i}", random_location(spread_km))
+        ids.append(doc["_id"])
+        batch.append(doc)
+        if len(batch) >= 10000:
+            await users.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await users.insert_many(batch, ordered=False)
+
+    centers = {}
+    for size in following_sizes:
+        doc = bench_user(f"bench_center_{size}", {"type": "Point", "coordinates": center})
+        await users.insert_one(doc)
+        following = random.sample(ids, min(size, len(ids)))
+        for i in range(0, len(following), 10000):
+            await follow_store.add_follows(doc["_id"], following[i:i + 10000])
+        centers[size] = doc["username"]
+    return centers
+
+async def time_strategy(username: str, distance: int, limit: int, strategy: str, repeat: int) -> tuple:
+    result = None
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = await find_nearby_friends(username, max_distance_m=distance, limit=limit, strategy=strategy)
+    elapsed_ms = (time.perf_counter() - started) * 1000 / repeat
+    return elapsed_ms, [friend["id"] for friend in result["nearby_friends"]]
+
+async def main(args):
+    if mongo.DATABASE_NAME == "ryde_users_db" and not args.allow_default_db:
+        raise SystemExit("Refusing to seed benchmark data into the application database. Set MONGO_DB_NAME or pass --allow-default-db")
+
+    random.seed(args.seed)
+    await init_db_indexes()
+    try:
+        centers = await seed(args.users, args.following, args.spread_km)
+
+        print(f"{args.users} users within {args.spread_km} km, radius {args.distance} m, {args.limit} nearest, average of {args.repeat} runs")
+        print(f"{'following':>10} | " + " | ".join(f"{strategy:>12}" for strategy in nearby_query.nearby_strategies) + " | auto choice")
+        for size, username in centers.items():
+            timings = {}
+            expected = None
+            for strategy in nearby_query.nearby_strategies:
+                elapsed_ms, result = await time_strategy(username, args.distance, args.limit, strategy, args.repeat)
+                timings[strategy] = elapsed_ms
+                if expected is None:
+                    expected = result
+                # Every strategy must find the same users in the same order
+                assert result == expected, f"{strategy} result differs for following={size}"
+            winner = min(timings, key=timings.get)
+            row = " | ".join(f"{timings[strategy]:>9.1f} ms" for strategy in nearby_query.nearby_strategies)
+            print(f"{size:>10} | {row} | {nearby_query.choose_strategy(size)} (fastest: {winner})")
+    finally:
+        if not args.keep:
+            await cleanup()
+        close_database_client()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark nearby friends query strategies")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--following", type=int, nargs="+", default=[100, 1000, 5000, 20000, 50000])
+    parser.add_argument("--distance", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=1000, help="k nearest friends to return")
+    parser.add_argument("--spread-km", type=float, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="Keep benchmark data afterwards")
+    parser.add_argument("--allow-default-db", action="store_true")
+    asyncio.run(main(parser.parse_args()))
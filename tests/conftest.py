@@ -0,0 +1,16 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest_asyncio
+from app.db.mongo import init_db_indexes
+
+# The tests call the app through ASGITransport, which doesn't run the lifespan (where indexes are built upon startup).
+# Build them before the first test, so queries like $geoNear find their index on a fresh database
+indexes_ready = False
+
+@pytest_asyncio.fixture(autouse=True)
+async def db_indexes():
+    global indexes_ready
+    if not indexes_ready:
+        await init_db_indexes()
+        indexes_ready = True
@@ -0,0 +1,145 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from fnmatch import fnmatchcase
+import pytest
+from app.core.cache import RedisCache, redis_set_if_generation
+
+class LocalRedis:
+    """
+    Local stand-in of redis.asyncio client, with the commands used by RedisCache.
+    Values are returned as bytes like Redis, expiration follows the now attribute (seconds) instead of the clock.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.expires_at = {}
+        self.now = 0.0
+
+    def alive(self, name: str):
+        if name in self.expires_at and self.expires_at[name] <= self.now:
+            self.data.pop(name, None)
+            del self.expires_at[name]
+        return self.data.get(name)
+
+    async def hget(self, name: str, field: str):
+        value = (self.alive(name) or {}).get(field)
+        return value.encode() if value is not None else None
+
+    async def hset(self, name: str, field: str, value: str):
+        if not isinstance(self.alive(name), dict):
+            self.data[name] = {}
+        self.data[name][field] = value
+
+    async def expire(self, name: str, seconds: int):
+        if self.alive(name) is not None:
+            self.expires_at[name] = self.now + seconds
+
+    async def delete(self, *names: str):
+        for name in names:
+            self.data.pop(name, None)
+            self.expires_at.pop(name, None)
+
+    async def get(self, name: str):
+        value = self.alive(name)
+        return str(value).encode() if value is not None else None
+
+    async def mget(self, names: list):
+        return [await self.get(name) for name in names]
+
+    async def incr(self, name: str):
+        self.data[name] = int(self.alive(name) or 0) + 1
+        return self.data[name]
+
+    async def eval(self, script: str, numkeys: int, *args):
+        # Only the check-and-set script of RedisCache
+        assert script == redis_set_if_generation and numkeys == 2
+        name, generation_name, generation, field, value, ttl = args
+        if str(self.alive(generation_name) or 0) != generation:
+            return 0
+        await self.hset(name, field, value)
+        await self.expire(name, ttl)
+        return 1
+
+    async def scan_iter(self, match: str, count: int = 10):
+        for name in list(self.data):
+            if self.alive(name) is not None and fnmatchcase(name, match):
+                yield name.encode()
+
+    def pipeline(self, transaction: bool = True):
+        return LocalPipeline(self)
+
+class LocalPipeline:
+    def __init__(self, client: LocalRedis):
+        self.client = client
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __getattr__(self, command: str):
+        return lambda *args: self.commands.append((command, args))
+
+    async def execute(self):
+        return [await getattr(self.client, command)(*args) for command, args in self.commands]
+
+# Test Redis Cache Get / Set / Delete and TTL (against local stand-in)
+@pytest.mark.asyncio
+async def test_redis_cache_get_set_delete():
+
+    client = LocalRedis()
+    cache = RedisCache(client=client, ttl_seconds=60, prefix="test:")
+
+    assert await cache.get("user:1") is None
+    await cache.set("user:1", {"name": "Test User"})
+    await cache.set("user:1", {"name": "Test User", "profile": True}, "profile")
+    assert await cache.get("user:1") == {"name": "Test User"}
+    assert await cache.get("user:1", "profile") == {"name": "Test User", "profile": True}
+    assert "test:user:1" in client.data
+    # None means miss, it is never cached
+    await cache.set("user:2", None)
+    assert await cache.get("user:2") is None
+
+    # Delete removes every field of the key and bumps its generation
+    await cache.delete("user:1")
+    assert await cache.get("user:1") is None
+    assert await cache.get("user:1", "profile") is None
+    assert await cache.generation("user:1") == 1
+    assert await cache.generation_many(["user:1", "user:2"]) == [1, 0]
+
+    # Entry expires after ttl_seconds
+    await cache.set("user:3", {"name": "Test User"})
+    client.now = 59
+    assert await cache.get("user:3") == {"name": "Test User"}
+    client.now = 61
+    assert await cache.get("user:3") is None
+    assert cache.stats()["hits"] == 3
+
+# Test Redis Cache Generation Check (value read before an invalidation is not written back)
+@pytest.mark.asyncio
+async def test_redis_cache_generation():
+
+    client = LocalRedis()
+    cache = RedisCache(client=client, prefix="test:")
+
+    generation = await cache.generation("user:1")
+    await cache.delete("user:1")
+    await cache.set("user:1", {"address": "stale"}, generation=generation)
+    assert await cache.get("user:1") is None
+    assert cache.stats()["stale_sets"] == 1
+
+    generation = await cache.generation("user:1")
+    await cache.set("user:1", {"address": "fresh"}, generation=generation)
+    assert await cache.get("user:1") == {"address": "fresh"}
+
+    # Clear removes every entry under the prefix (not other keys), and bumps their generation
+    await client.hset("other:user:1", "", "{}")
+    generation = await cache.generation("user:1")
+    await cache.clear()
+    assert await cache.get("user:1") is None
+    assert "other:user:1" in client.data
+    await cache.set("user:1", {"address": "stale"}, generation=generation)
+    assert await cache.get("user:1") is None
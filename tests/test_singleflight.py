@@ -0,0 +1,124 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+import pytest
+from app.core.singleflight import SingleFlight
+
+# Test Concurrent Calls of the Same Key Share One Execution
+@pytest.mark.asyncio
+async def test_single_flight_coalesces_concurrent_calls():
+
+    flight = SingleFlight("test")
+    executions = []
+    release = asyncio.Event()
+
+    async def fetch(value):
+        executions.append(value)
+        await release.wait()
+        return value
+
+    calls = [asyncio.create_task(flight.do("key", lambda: fetch("first"))) for _ in range(5)]
+    other = asyncio.create_task(flight.do("other", lambda: fetch("other")))
+    await asyncio.sleep(0)
+    assert flight.stats()["in_flight"] == 2
+    release.set()
+
+    assert await asyncio.gather(*calls) == ["first"] * 5
+    assert await other == "other"
+    assert sorted(executions) == ["first", "other"]
+    assert flight.stats()["coalesced"] == 4
+    assert flight.stats()["in_flight"] == 0
+
+    # Key is released once done, the next call runs again
+    assert await flight.do("key", lambda: fetch("second")) == "second"
+    assert flight.stats()["executions"] == 3
+
+# Test Error of the Shared Call Reaches Every Caller and Releases the Key
+@pytest.mark.asyncio
+async def test_single_flight_error():
+
+    flight = SingleFlight("test")
+    release = asyncio.Event()
+
+    async def failing():
+        await release.wait()
+        raise ValueError("lookup failed")
+
+    calls = [asyncio.create_task(flight.do("key", failing)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+
+    results = await asyncio.gather(*calls, return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.stats()["errors"] == 1
+    assert flight.stats()["in_flight"] == 0
+
+    async def succeeding():
+        return "ok"
+
+    assert await flight.do("key", succeeding) == "ok"
+
+# Test Cancelled Caller Doesn't Cancel the Call Shared With the Others
+@pytest.mark.asyncio
+async def test_single_flight_cancelled_caller():
+
+    flight = SingleFlight("test")
+    release = asyncio.Event()
+    executions = []
+
+    async def fetch():
+        executions.append(1)
+        await release.wait()
+        return "value"
+
+    cancelled = asyncio.create_task(flight.do("key", fetch))
+    waiting = asyncio.create_task(flight.do("key", fetch))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+
+    release.set()
+    assert await waiting == "value"
+    assert len(executions) == 1
+
+    # Every caller cancelled: the call still completes in the background and the key is released
+    release.clear()
+    only = asyncio.create_task(flight.do("key", fetch))
+    await asyncio.sleep(0)
+    only.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await only
+    assert flight.stats()["in_flight"] == 1
+    call = flight.calls[asyncio.get_running_loop()]["key"]
+    release.set()
+    assert await call == "value"
+    await asyncio.sleep(0)
+    assert flight.stats()["in_flight"] == 0
+    assert len(executions) == 2
+
+# Test Calls Beyond max_keys Run Directly Without Coalescing
+@pytest.mark.asyncio
+async def test_single_flight_overflow():
+
+    flight = SingleFlight("test", max_keys=1)
+    release = asyncio.Event()
+    executions = []
+
+    async def fetch(value):
+        executions.append(value)
+        await release.wait()
+        return value
+
+    first = asyncio.create_task(flight.do("first", lambda: fetch("first")))
+    await asyncio.sleep(0)
+    overflow = [asyncio.create_task(flight.do("second", lambda: fetch("second"))) for _ in range(2)]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await first == "first"
+    assert await asyncio.gather(*overflow) == ["second", "second"]
+    assert executions.count("second") == 2
+    assert flight.stats()["overflow"] == 2
+    assert flight.stats()["in_flight"] == 0
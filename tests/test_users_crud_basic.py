@@ -1,10 +1,13 @@
 import os, sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+import json
+import asyncio
 import pytest
 from httpx import AsyncClient
 from httpx._transports.asgi import ASGITransport
 from app.main import app
+from app.core.cache import user_cache, MemoryCache
 
 # Test All Basic Operation with Best Scenario (no Error)
 @pytest.mark.asyncio
@@ -102,8 +105,20 @@ async def test_create_and_update_username_duplicate():
         response_3 = await ac.patch(f"/users/{user_id_2}", json=updated_data)
         assert response_3.status_code == 409
 
+        # Concurrent create / update with the same username, only one gets it (unique index)
+        test_user_3 = {**test_user_1, "username": "test_user_3"}
+        responses = await asyncio.gather(
+            ac.post("/users/", json=test_user_3),
+            ac.post("/users/", json=test_user_3),
+            ac.patch(f"/users/{user_id_2}", json={"username": "test_user_3"})
+        )
+        assert [response.status_code for response in responses].count(409) == 2
+        created = [response.json()["id"] for response in responses[:2] if response.status_code == 201]
+
         await ac.delete(f"/users/{user_id_1}")
         await ac.delete(f"/users/{user_id_2}")
+        for user_id_3 in created:
+            await ac.delete(f"/users/{user_id_3}")
 
 # Test Error Handling for Create User request with missing fields
 @pytest.mark.asyncio
@@ -139,4 +154,303 @@ async def test_create_user_with_invalid_date():
     transport = ASGITransport(app=app)
     async with AsyncClient(transport=transport, base_url="http://test") as ac:
         response = await ac.post("/users/", json=bad_date_user)
-        assert response.status_code == 422
\ No newline at end of file
+        assert response.status_code == 422
+
+# Test Listing User page by page with cursor and field projection
+@pytest.mark.asyncio
+async def test_list_users_pagination():
+
+    list_test_user = [
+        {
+            "username": f"test_user_page_{i}",
+            "name": f"Test User Page {i}",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [106.8456, -6.2088]
+            }
+        } for i in range(3)
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        # Create dummy user for testing
+        created_ids = []
+        for test_user in list_test_user:
+            response = await ac.post("/users/", json=test_user)
+            created_ids.append(response.json()["id"])
+
+        # Go through every page with small page size
+        listed_ids = []
+        after = None
+        while True:
+            params = {"limit": 2, "fields": "id,username"}
+            if after:
+                params["after"] = after
+            response = await ac.get("/users/", params=params)
+            assert response.status_code == 200
+            page = response.json()
+            assert len(page["users"]) <= 2
+            for user in page["users"]:
+                # Only requested fields returned
+                assert set(user.keys()) == {"id", "username"}
+                listed_ids.append(user["id"])
+            after = page["next_cursor"]
+            if after is None:
+                break
+
+        # Every user listed exactly once
+        assert len(listed_ids) == len(set(listed_ids))
+        for user_id in created_ids:
+            assert user_id in listed_ids
+
+        # Test error handling of invalid field and cursor
+        response = await ac.get("/users/", params={"fields": "id,password"})
+        assert response.status_code == 400
+
+        response = await ac.get("/users/", params={"after": "not-a-cursor"})
+        assert response.status_code == 400
+
+        for user_id in created_ids:
+            await ac.delete(f"/users/{user_id}")
+
+# Test Export User as NDJSON stream
+@pytest.mark.asyncio
+async def test_export_users_ndjson():
+
+    list_test_user = [
+        {
+            "username": f"test_user_export_{i}",
+            "name": f"Test User Export {i}",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [106.8456, -6.2088]
+            }
+        } for i in range(3)
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        # Create dummy user for testing
+        created_ids = []
+        for test_user in list_test_user:
+            response = await ac.post("/users/", json=test_user)
+            created_ids.append(response.json()["id"])
+
+        response = await ac.get("/users/export", params={"batch_size": 2, "fields": "id,username"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+
+        exported = [json.loads(line) for line in response.text.splitlines() if line]
+        exported_ids = [user["id"] for user in exported]
+        for user in exported:
+            assert set(user.keys()) == {"id", "username"}
+        for user_id in created_ids:
+            assert user_id in exported_ids
+
+        # Test error handling of invalid field
+        response = await ac.get("/users/export", params={"fields": "password"})
+        assert response.status_code == 400
+
+        for user_id in created_ids:
+            await ac.delete(f"/users/{user_id}")
+
+# Test Bulk Create User with JSON array and NDJSON, including failed records
+@pytest.mark.asyncio
+async def test_bulk_create_users():
+
+    def make_user(username):
+        return {
+            "username": username,
+            "name": "Test User Bulk",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [106.8456, -6.2088]
+            }
+        }
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        # JSON array with duplicate username inside batch and incomplete record
+        payload = [
+            make_user("test_user_bulk_1"),
+            make_user("test_user_bulk_2"),
+            make_user("test_user_bulk_1"),
+            {"name": "No Username"}
+        ]
+        response = await ac.post("/users/bulk", params={"chunk_size": 2}, json=payload)
+        assert response.status_code == 200
+        result = response.json()
+        assert result["inserted_count"] == 2
+        assert result["failed_count"] == 2
+        assert sorted(item["index"] for item in result["failed"]) == [2, 3]
+        created_ids = [item["id"] for item in result["inserted"]]
+
+        # NDJSON with username already exist in database
+        body = "\n".join(json.dumps(user) for user in [make_user("test_user_bulk_2"), make_user("test_user_bulk_3")])
+        response = await ac.post("/users/bulk", content=body, headers={"Content-Type": "application/x-ndjson"})
+        assert response.status_code == 200
+        result = response.json()
+        assert result["inserted_count"] == 1
+        assert result["failed"][0]["index"] == 0
+        assert result["failed"][0]["error"] == "Duplicate Username"
+        created_ids += [item["id"] for item in result["inserted"]]
+
+        # NDJSON with a line of invalid UTF-8 and a line of malformed JSON, only those records fail
+        body = b"\xff\xfe{\n{not json\n" + json.dumps(make_user("test_user_bulk_4")).encode()
+        response = await ac.post("/users/bulk", content=body, headers={"Content-Type": "application/x-ndjson"})
+        assert response.status_code == 200
+        result = response.json()
+        assert result["inserted_count"] == 1
+        assert [(item["index"], item["error"]) for item in result["failed"]] == [(0, "Invalid JSON"), (1, "Invalid JSON")]
+        created_ids += [item["id"] for item in result["inserted"]]
+
+        for user_id in created_ids:
+            response = await ac.get(f"/users/{user_id}")
+            assert response.status_code == 200
+            await ac.delete(f"/users/{user_id}")
+
+# Test Get Many User by ID in one request
+@pytest.mark.asyncio
+async def test_batch_get_users():
+
+    list_test_user = [
+        {
+            "username": f"test_user_batch_{i}",
+            "name": f"Test User Batch {i}",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [106.8456, -6.2088]
+            }
+        } for i in range(3)
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        # Create dummy user for testing
+        created_ids = []
+        for test_user in list_test_user:
+            response = await ac.post("/users/", json=test_user)
+            created_ids.append(response.json()["id"])
+
+        # Request in reverse order with one fake ID
+        request_ids = [created_ids[2], "123123123", created_ids[0], created_ids[1]]
+        response = await ac.post("/users/batch-get", json={"ids": request_ids})
+        assert response.status_code == 200
+        result = response.json()
+        assert [user["id"] for user in result["users"]] == [created_ids[2], created_ids[0], created_ids[1]]
+        assert result["missing"] == ["123123123"]
+
+        for user_id in created_ids:
+            await ac.delete(f"/users/{user_id}")
+
+# Test Cached User is served from cache and invalidated upon update
+@pytest.mark.asyncio
+async def test_user_cache_hit_and_invalidation():
+
+    test_user = {
+        "username": "test_user_cache",
+        "name": "Test User Cache",
+        "dob": "1999-12-31",
+        "address": "123 Testing Lane",
+        "description": "Just a test user",
+        "location": {
+            "type": "Point",
+            "coordinates": [106.8456, -6.2088]
+        }
+    }
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        response = await ac.post("/users/", json=test_user)
+        user_id = response.json()["id"]
+
+        # First read fills the cache, second read is a hit
+        await ac.get(f"/users/{user_id}")
+        hits_before = (await ac.get("/metrics")).json()["user_cache"].get("hits", 0)
+        response = await ac.get(f"/users/{user_id}")
+        assert response.status_code == 200
+        if user_cache.stats()["backend"] != "none":
+            assert (await ac.get("/metrics")).json()["user_cache"]["hits"] == hits_before + 1
+
+        # Update must not return stale cached user
+        response = await ac.patch(f"/users/{user_id}", json={"address": "456 Cached Ave"})
+        assert response.status_code == 200
+        response = await ac.get(f"/users/{user_id}")
+        assert response.json()["address"] == "456 Cached Ave"
+
+        # Deleted user must not be served from cache
+        await ac.delete(f"/users/{user_id}")
+        response = await ac.get(f"/users/{user_id}")
+        assert response.status_code == 404
+
+# Test Value Read Before an Invalidation is not Written Back to the Cache Afterwards
+@pytest.mark.asyncio
+async def test_user_cache_stale_write_back():
+
+    cache = MemoryCache(max_entries=2)
+    # Reader misses, takes the generation, then the key is invalidated before it writes
+    generation = await cache.generation("user:1")
+    await cache.delete("user:1")
+    await cache.set("user:1", {"address": "stale"}, generation=generation)
+    assert await cache.get("user:1") is None
+    assert cache.stats()["stale_sets"] == 1
+
+    # Read started after the invalidation is cached
+    generation = await cache.generation("user:1")
+    await cache.set("user:1", {"address": "fresh"}, generation=generation)
+    assert await cache.get("user:1") == {"address": "fresh"}
+
+    # Generation forgotten (more deleted keys than max_entries) still doesn't match the one seen before
+    generation = await cache.generation("user:2")
+    await cache.delete("user:2", "user:3", "user:4")
+    await cache.set("user:2", {"address": "stale"}, generation=generation)
+    assert await cache.get("user:2") is None
+
+# Test Concurrent Get User (batched into one lookup) returns the right user to every request
+@pytest.mark.asyncio
+async def test_concurrent_get_users():
+
+    list_test_user = [
+        {
+            "username": f"test_user_concurrent_{i}",
+            "name": f"Test User Concurrent {i}",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [106.8456, -6.2088]
+            }
+        } for i in range(5)
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        created_ids = []
+        for test_user in list_test_user:
+            response = await ac.post("/users/", json=test_user)
+            created_ids.append(response.json()["id"])
+
+        request_ids = created_ids + ["123123123"] + created_ids
+        responses = await asyncio.gather(*(ac.get(f"/users/{user_id}") for user_id in request_ids))
+        for user_id, response in zip(request_ids, responses):
+            if user_id == "123123123":
+                assert response.status_code == 404
+            else:
+                assert response.status_code == 200
+                assert response.json()["id"] == user_id
+
+        for user_id in created_ids:
+            await ac.delete(f"/users/{user_id}")
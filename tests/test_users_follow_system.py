@@ -1,10 +1,14 @@
 import os, sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+import asyncio
 import pytest
 from httpx import AsyncClient
 from httpx._transports.asgi import ASGITransport
 from app.main import app
+from app.models import follow as follow_store
+from app.models.graph import FollowGraph
+from app.models.user import delete_cascade
 
 # Test Following and Unfollowing User
 @pytest.mark.asyncio
@@ -382,4 +386,605 @@ async def test_unfollowing_not_followed_user():
 
         # Delete Dummy User as the test case already completede
         for one_user_id in user_id.keys():
-            response = await ac.delete(f"/users/{user_id[one_user_id]}")
\ No newline at end of file
+            response = await ac.delete(f"/users/{user_id[one_user_id]}")
+
+
+# Test Paginated and Expanded Followers and Following List
+@pytest.mark.asyncio
+async def test_followers_following_pagination_and_expand():
+
+    list_test_user = [
+        {
+            "username": f"test_user_{i}",
+            "name": f"Test User {i}",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8198,1.3521]
+            }
+        } for i in range(1, 5)
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+
+        # Create Necessary Dummy User for Test
+        user_id = {}
+        for test_user in list_test_user:
+            response = await ac.post("/users/", json=test_user)
+            user = response.json()
+            user_id[test_user['name']] = user["id"]
+
+        # Test User 2, 3, 4 follow Test User 1
+        for name in ["Test User 2", "Test User 3", "Test User 4"]:
+            response = await ac.patch(f"/users/{user_id[name]}/follow/{user_id['Test User 1']}")
+            assert response.status_code == 200
+
+        # Page through followers
+        response = await ac.get(f"/users/{user_id['Test User 1']}/followers?limit=2&offset=0")
+        assert response.status_code == 200
+        first_page = response.json()
+        assert first_page["total"] == 3
+        assert len(first_page["followers"]) == 2
+
+        response = await ac.get(f"/users/{user_id['Test User 1']}/followers?limit=2&offset=2")
+        second_page = response.json()
+        assert len(second_page["followers"]) == 1
+        assert set(first_page["followers"] + second_page["followers"]) == {
+            user_id["Test User 2"], user_id["Test User 3"], user_id["Test User 4"]
+        }
+
+        # Expanded followers contain compact user information
+        response = await ac.get(f"/users/{user_id['Test User 1']}/followers?expand=true")
+        expanded = response.json()["followers"]
+        assert {friend["username"] for friend in expanded} == {"test_user_2", "test_user_3", "test_user_4"}
+        assert "followers" not in expanded[0]
+
+        response = await ac.get(f"/users/{user_id['Test User 2']}/following?expand=true")
+        following = response.json()
+        assert following["total"] == 1
+        assert following["following"][0]["id"] == user_id["Test User 1"]
+
+        # Delete Dummy User as the test case already completede
+        for one_user_id in user_id.keys():
+            response = await ac.delete(f"/users/{user_id[one_user_id]}")
+
+# Test Backfill of follows collection from embedded followers / following arrays
+@pytest.mark.asyncio
+@pytest.mark.skipif(follow_store.uses_edges(), reason="Backfill reads embedded arrays, only relevant before switching to edges storage")
+async def test_backfill_follow_edges():
+
+    list_test_user = [
+        {
+            "username": f"test_user_{i}",
+            "name": f"Test User {i}",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8198,1.3521]
+            }
+        } for i in range(1, 3)
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+
+        # Create Necessary Dummy User for Test
+        user_id = {}
+        for test_user in list_test_user:
+            response = await ac.post("/users/", json=test_user)
+            user = response.json()
+            user_id[test_user['name']] = user["id"]
+
+        response = await ac.patch(f"/users/{user_id['Test User 1']}/follow/{user_id['Test User 2']}")
+        assert response.status_code == 200
+
+        # Backfill (only the users of this test) twice, the second run must not create duplicate edge
+        result = await follow_store.backfill_follow_edges(user_ids=list(user_id.values()))
+        assert result["users_scanned"] == 2
+        await follow_store.backfill_follow_edges(user_ids=list(user_id.values()))
+
+        edges = await follow_store.get_follow_collection().find(
+            {"follower_id": user_id["Test User 1"], "target_id": user_id["Test User 2"]}
+        ).to_list(length=None)
+        assert len(edges) == 1
+
+        # Delete Dummy User and edges as the test case already completede
+        await follow_store.get_follow_collection().delete_many({"follower_id": {"$in": list(user_id.values())}})
+        for one_user_id in user_id.keys():
+            response = await ac.delete(f"/users/{user_id[one_user_id]}")
+
+# Test Batch Follow and Unfollow with per-target result
+@pytest.mark.asyncio
+async def test_batch_follow_and_unfollow():
+
+    list_test_user = [
+        {
+            "username": f"test_user_{i}",
+            "name": f"Test User {i}",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8198,1.3521]
+            }
+        } for i in range(1, 5)
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+
+        # Create Necessary Dummy User for Test
+        user_id = {}
+        for test_user in list_test_user:
+            response = await ac.post("/users/", json=test_user)
+            user = response.json()
+            user_id[test_user['name']] = user["id"]
+
+        # Test User 1 already follow Test User 2 before the batch
+        response = await ac.patch(f"/users/{user_id['Test User 1']}/follow/{user_id['Test User 2']}")
+        assert response.status_code == 200
+
+        target_ids = [user_id["Test User 2"], user_id["Test User 3"], user_id["Test User 4"], "123123123", user_id["Test User 1"]]
+        response = await ac.post(f"/users/{user_id['Test User 1']}/follow", json={"target_ids": target_ids})
+        assert response.status_code == 200
+        statuses = {result["target_id"]: result["status"] for result in response.json()["results"]}
+        assert statuses[user_id["Test User 2"]] == "already_followed"
+        assert statuses[user_id["Test User 3"]] == "followed"
+        assert statuses[user_id["Test User 4"]] == "followed"
+        assert statuses["123123123"] == "not_found"
+        assert statuses[user_id["Test User 1"]] == "self_follow"
+
+        # Both side of follow are written
+        response = await ac.get(f"/users/{user_id['Test User 1']}/following")
+        assert set(response.json()["following"]) == {user_id["Test User 2"], user_id["Test User 3"], user_id["Test User 4"]}
+        response = await ac.get(f"/users/{user_id['Test User 4']}/followers")
+        assert response.json()["followers"] == [user_id["Test User 1"]]
+
+        # Batch unfollow
+        target_ids = [user_id["Test User 3"], user_id["Test User 4"]]
+        response = await ac.post(f"/users/{user_id['Test User 1']}/unfollow", json={"target_ids": target_ids})
+        assert response.status_code == 200
+        assert response.json()["counts"] == {"unfollowed": 2}
+
+        response = await ac.get(f"/users/{user_id['Test User 1']}/following")
+        assert response.json()["following"] == [user_id["Test User 2"]]
+        response = await ac.get(f"/users/{user_id['Test User 4']}/followers")
+        assert response.json()["followers"] == []
+
+        # Check Error Handling of non-existance follower
+        response = await ac.post("/users/123123123/follow", json={"target_ids": [user_id["Test User 2"]]})
+        assert response.status_code == 400
+
+        # Delete Dummy User as the test case already completede
+        for one_user_id in user_id.keys():
+            response = await ac.delete(f"/users/{user_id[one_user_id]}")
+
+# Test Friend Suggestions (friend of friend ranked by mutual connections)
+@pytest.mark.asyncio
+async def test_friend_suggestions():
+
+    coordinates = {
+        1: [103.8198,1.3521],
+        2: [103.8198,1.3521],
+        3: [103.8198,1.3521],
+        4: [104.5000,1.3521],
+        5: [104.5000,1.3521],
+        6: [103.8199,1.3522]
+    }
+    list_test_user = [
+        {
+            "username": f"test_user_suggest_{i}",
+            "name": f"Test User Suggest {i}",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": coordinates[i]
+            }
+        } for i in range(1, 7)
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+
+        # Create Necessary Dummy User for Test
+        user_id = {}
+        for i, test_user in enumerate(list_test_user, start=1):
+            response = await ac.post("/users/", json=test_user)
+            user_id[i] = response.json()["id"]
+
+        # 1 follows 2 and 3. 2 follows 1, 4 and 5. 3 follows 2, 4 and 6
+        follows = [(1, 2), (1, 3), (2, 1), (2, 4), (2, 5), (3, 2), (3, 4), (3, 6)]
+        for follower, target in follows:
+            response = await ac.patch(f"/users/{user_id[follower]}/follow/{user_id[target]}")
+            assert response.status_code == 200
+
+        # Themself and already followed users are not suggested, 4 is followed by both 2 and 3
+        response = await ac.get(f"/users/{user_id[1]}/suggestions")
+        assert response.status_code == 200
+        suggestions = response.json()["suggestions"]
+        assert suggestions[0]["id"] == user_id[4]
+        assert suggestions[0]["mutual_count"] == 2
+        assert {suggestion["id"] for suggestion in suggestions[1:]} == {user_id[5], user_id[6]}
+
+        # 6 is next to 1, boosted above the others
+        response = await ac.get(f"/users/{user_id[1]}/suggestions", params={"near": "true"})
+        assert [suggestion["id"] for suggestion in response.json()["suggestions"]] == [user_id[6], user_id[4], user_id[5]]
+
+        response = await ac.get(f"/users/{user_id[1]}/suggestions", params={"limit": 1})
+        assert len(response.json()["suggestions"]) == 1
+
+        # Followed user is not suggested anymore
+        await ac.patch(f"/users/{user_id[1]}/follow/{user_id[4]}")
+        response = await ac.get(f"/users/{user_id[1]}/suggestions")
+        assert user_id[4] not in [suggestion["id"] for suggestion in response.json()["suggestions"]]
+
+        # Check Error Handling of non-exist user
+        response = await ac.get("/users/123123123/suggestions")
+        assert response.status_code == 404
+
+        # Delete Dummy User as the test case already completede
+        for one_user_id in user_id.values():
+            response = await ac.delete(f"/users/{one_user_id}")
+            assert response.status_code == 204
+
+# Test Mutual Follow List and Relationship Between Two Users
+@pytest.mark.asyncio
+async def test_mutuals_and_relationship():
+
+    list_test_user = [
+        {
+            "username": f"test_user_mutual_{i}",
+            "name": f"Test User Mutual {i}",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8198,1.3521]
+            }
+        } for i in range(1, 6)
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+
+        # Create Necessary Dummy User for Test
+        user_id = {}
+        for i, test_user in enumerate(list_test_user, start=1):
+            response = await ac.post("/users/", json=test_user)
+            user_id[i] = response.json()["id"]
+
+        # 1 and 2, 1 and 3 follow each other. 1 follows 4 only, 5 follows 1 only
+        follows = [(1, 2), (2, 1), (1, 3), (3, 1), (1, 4), (5, 1)]
+        for follower, target in follows:
+            response = await ac.patch(f"/users/{user_id[follower]}/follow/{user_id[target]}")
+            assert response.status_code == 200
+
+        response = await ac.get(f"/users/{user_id[1]}/mutuals")
+        assert response.status_code == 200
+        assert response.json()["mutuals"] == sorted([user_id[2], user_id[3]])
+        assert response.json()["total"] == 2
+
+        response = await ac.get(f"/users/{user_id[1]}/mutuals", params={"limit": 1, "offset": 1, "expand": "true"})
+        assert [user["id"] for user in response.json()["mutuals"]] == [max(user_id[2], user_id[3])]
+        assert response.json()["total"] == 2
+
+        response = await ac.get(f"/users/{user_id[1]}/relationship/{user_id[2]}")
+        assert response.status_code == 200
+        assert response.json() == {"follows": True, "followed_by": True, "mutual": True}
+        response = await ac.get(f"/users/{user_id[1]}/relationship/{user_id[4]}")
+        assert response.json() == {"follows": True, "followed_by": False, "mutual": False}
+        response = await ac.get(f"/users/{user_id[1]}/relationship/{user_id[5]}")
+        assert response.json() == {"follows": False, "followed_by": True, "mutual": False}
+
+        # Unfollow removes the mutual (cached page is invalidated)
+        await ac.patch(f"/users/{user_id[3]}/unfollow/{user_id[1]}")
+        response = await ac.get(f"/users/{user_id[1]}/mutuals")
+        assert response.json()["mutuals"] == [user_id[2]]
+        response = await ac.get(f"/users/{user_id[3]}/mutuals")
+        assert response.json()["mutuals"] == []
+
+        # Check Error Handling of non-exist user
+        response = await ac.get(f"/users/{user_id[1]}/relationship/123123123")
+        assert response.status_code == 404
+
+        # Delete Dummy User as the test case already completede
+        for one_user_id in user_id.values():
+            response = await ac.delete(f"/users/{one_user_id}")
+            assert response.status_code == 204
+
+# Test Follower / Following Counters, Stats and Profile Without Follow Arrays
+@pytest.mark.asyncio
+async def test_follow_counts_and_stats():
+
+    list_test_user = [
+        {
+            "username": f"test_user_count_{i}",
+            "name": f"Test User Count {i}",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8198,1.3521]
+            }
+        } for i in range(1, 5)
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+
+        # Create Necessary Dummy User for Test
+        user_id = {}
+        for i, test_user in enumerate(list_test_user, start=1):
+            response = await ac.post("/users/", json=test_user)
+            user_id[i] = response.json()["id"]
+
+        # Following twice or unfollowing not followed user doesn't move the counters
+        await ac.patch(f"/users/{user_id[1]}/follow/{user_id[2]}")
+        await ac.patch(f"/users/{user_id[1]}/follow/{user_id[2]}")
+        await ac.post(f"/users/{user_id[1]}/follow", json={"target_ids": [user_id[2], user_id[3], user_id[4]]})
+        await ac.patch(f"/users/{user_id[4]}/follow/{user_id[2]}")
+        await ac.patch(f"/users/{user_id[3]}/unfollow/{user_id[2]}")
+
+        response = await ac.get(f"/users/{user_id[1]}/stats")
+        assert response.status_code == 200
+        assert response.json() == {"id": user_id[1], "follower_count": 0, "following_count": 3}
+        response = await ac.get(f"/users/{user_id[2]}/stats")
+        assert response.json() == {"id": user_id[2], "follower_count": 2, "following_count": 0}
+
+        await ac.post(f"/users/{user_id[1]}/unfollow", json={"target_ids": [user_id[2], user_id[3]]})
+        await ac.patch(f"/users/{user_id[1]}/unfollow/{user_id[2]}")
+        response = await ac.get(f"/users/{user_id[1]}/stats")
+        assert response.json()["following_count"] == 1
+        response = await ac.get(f"/users/{user_id[2]}/stats")
+        assert response.json()["follower_count"] == 1
+
+        # Profile with counts, with or without the arrays
+        response = await ac.get(f"/users/{user_id[4]}")
+        assert response.json()["followers"] == [user_id[1]]
+        assert response.json()["follower_count"] == 1
+        response = await ac.get(f"/users/{user_id[4]}", params={"follow_lists": "false"})
+        assert response.status_code == 200
+        assert "followers" not in response.json() and "following" not in response.json()
+        assert response.json()["follower_count"] == 1
+        assert response.json()["following_count"] == 1
+        response = await ac.post("/users/batch-get", params={"follow_lists": "false"}, json={"ids": [user_id[4]]})
+        assert "followers" not in response.json()["users"][0]
+        assert response.json()["users"][0]["following_count"] == 1
+
+        # Drifted counters are repaired by reconciliation
+        await follow_store.get_user_collection().update_one({"_id": user_id[4]}, {"$set": {"follower_count": 42}})
+        await follow_store.get_user_collection().update_one({"_id": user_id[3]}, {"$unset": {"follower_count": ""}})
+        result = await follow_store.reconcile_follow_counts(batch_size=2)
+        assert result["users_repaired"] >= 2
+        doc = await follow_store.get_user_collection().find_one({"_id": user_id[4]})
+        assert doc["follower_count"] == 1
+        doc = await follow_store.get_user_collection().find_one({"_id": user_id[3]})
+        assert doc["follower_count"] == 0
+
+        # Check Error Handling of non-exist user
+        response = await ac.get("/users/123123123/stats")
+        assert response.status_code == 404
+
+        # Delete Dummy User as the test case already completede
+        for one_user_id in user_id.values():
+            response = await ac.delete(f"/users/{one_user_id}")
+            assert response.status_code == 204
+
+# Test Follow Writes With FOLLOW_WRITE_TRANSACTION (transaction on replica set, otherwise plain writes and one warning)
+@pytest.mark.asyncio
+async def test_follow_write_transaction(monkeypatch):
+
+    monkeypatch.setattr(follow_store, "follow_write_transaction", True)
+    monkeypatch.setattr(follow_store, "write_transaction_ready", None)
+    warnings = []
+    monkeypatch.setattr(follow_store.logger, "warning", warnings.append)
+
+    list_test_user = [
+        {
+            "username": f"test_user_transaction_{i}",
+            "name": f"Test User Transaction {i}",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8198,1.3521]
+            }
+        } for i in range(1, 4)
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+
+        # Create Necessary Dummy User for Test
+        user_id = {}
+        for i, test_user in enumerate(list_test_user, start=1):
+            response = await ac.post("/users/", json=test_user)
+            user_id[i] = response.json()["id"]
+
+        # Topology is discovered before deciding, even on the first write after startup
+        supported = await follow_store.check_write_transaction()
+        assert follow_store.write_transaction_ready == supported
+
+        response = await ac.patch(f"/users/{user_id[1]}/follow/{user_id[2]}")
+        assert response.status_code == 200
+        response = await ac.post(f"/users/{user_id[1]}/follow", json={"target_ids": [user_id[2], user_id[3]]})
+        assert response.json()["counts"] == {"already_followed": 1, "followed": 1}
+        response = await ac.post(f"/users/{user_id[1]}/unfollow", json={"target_ids": [user_id[2], user_id[3]]})
+        assert response.json()["counts"] == {"unfollowed": 2}
+        response = await ac.patch(f"/users/{user_id[3]}/follow/{user_id[1]}")
+        assert response.status_code == 200
+
+        response = await ac.get(f"/users/{user_id[1]}/stats")
+        assert response.json() == {"id": user_id[1], "follower_count": 1, "following_count": 0}
+        response = await ac.get(f"/users/{user_id[3]}/stats")
+        assert response.json() == {"id": user_id[3], "follower_count": 0, "following_count": 1}
+
+        # Without replica set the fallback is only reported once, not on every write
+        fallback_warnings = [message for message in warnings if "FOLLOW_WRITE_TRANSACTION" in message]
+        assert len(fallback_warnings) == (0 if supported else 1)
+
+        # Delete Dummy User as the test case already completede
+        for one_user_id in user_id.values():
+            response = await ac.delete(f"/users/{one_user_id}")
+            assert response.status_code == 204
+
+# Test Removal of Deleted User from Follow Lists (background cascade and orphan sweep)
+@pytest.mark.asyncio
+async def test_delete_cascade():
+
+    list_test_user = [
+        {
+            "username": f"test_user_cascade_{i}",
+            "name": f"Test User Cascade {i}",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8198,1.3521]
+            }
+        } for i in range(1, 5)
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+
+        # Create Necessary Dummy User for Test
+        user_id = {}
+        for i, test_user in enumerate(list_test_user, start=1):
+            response = await ac.post("/users/", json=test_user)
+            user_id[i] = response.json()["id"]
+
+        # 1 follows 2, 3 and 4. 2 and 3 follow 1
+        await ac.post(f"/users/{user_id[1]}/follow", json={"target_ids": [user_id[2], user_id[3], user_id[4]]})
+        await ac.patch(f"/users/{user_id[2]}/follow/{user_id[1]}")
+        await ac.patch(f"/users/{user_id[3]}/follow/{user_id[1]}")
+        response = await ac.get(f"/users/{user_id[2]}")
+        assert response.json()["followers"] == [user_id[1]]
+        # Nearby friends of 2 (second read is cached) include 1
+        for _ in range(2):
+            response = await ac.get("/users/test_user_cascade_2/nearby-friends?distance=1000")
+            assert [friend["username"] for friend in response.json()["nearby_friends"]] == ["test_user_cascade_1"]
+
+        # Delete returns right away, the cascade runs in the background
+        batch_size = delete_cascade.batch_size
+        delete_cascade.batch_size = 2
+        response = await ac.delete(f"/users/{user_id[1]}")
+        assert response.status_code == 204
+        await delete_cascade.flush()
+        delete_cascade.batch_size = batch_size
+
+        for i in (2, 3, 4):
+            response = await ac.get(f"/users/{user_id[i]}")
+            assert user_id[1] not in response.json()["followers"]
+            assert user_id[1] not in response.json()["following"]
+            assert response.json()["follower_count"] == 0
+        response = await ac.get(f"/users/{user_id[2]}/stats")
+        assert response.json()["following_count"] == 0
+        response = await ac.get("/users/test_user_cascade_2/nearby-friends?distance=1000")
+        assert response.json()["nearby_friends"] == []
+
+        response = await ac.get("/metrics")
+        stats = response.json()["delete_cascade"]
+        assert stats["completed"] >= 1 and stats["pending"] == 0
+        assert stats["references_removed"] >= 5
+
+        # Reference left behind (deleted before the cascade existed) is found and removed by the sweeper
+        ghost_id = "test_user_cascade_ghost"
+        await follow_store.add_follow(user_id[2], ghost_id)
+        assert ghost_id in await follow_store.find_orphan_ids(batch_size=2)
+        assert await delete_cascade.clean(ghost_id) == 1
+        assert ghost_id not in await follow_store.find_orphan_ids()
+        response = await ac.get(f"/users/{user_id[2]}")
+        assert response.json()["following"] == []
+
+        # Delete Dummy User as the test case already completede
+        for i in (2, 3, 4):
+            response = await ac.delete(f"/users/{user_id[i]}")
+            assert response.status_code == 204
+
+# Test Follow Graph Snapshot (reach, degree and mutual follow)
+@pytest.mark.asyncio
+async def test_follow_graph_snapshot():
+
+    list_test_user = [
+        {
+            "username": f"test_user_graph_{i}",
+            "name": f"Test User Graph {i}",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8198,1.3521]
+            }
+        } for i in range(1, 5)
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+
+        # Create Necessary Dummy User for Test
+        user_id = {}
+        for i, test_user in enumerate(list_test_user, start=1):
+            response = await ac.post("/users/", json=test_user)
+            user_id[i] = response.json()["id"]
+
+        # 1 -> 2 -> 3 -> 4, and 2 follows 1 back
+        for follower, target in [(1, 2), (2, 3), (3, 4), (2, 1)]:
+            response = await ac.patch(f"/users/{user_id[follower]}/follow/{user_id[target]}")
+            assert response.status_code == 200
+
+        graph = FollowGraph(enabled=True)
+        await graph.build()
+        assert graph.reach(user_id[1], max_hops=3)["per_hop"] == [1, 1, 1]
+        assert graph.reach(user_id[4], max_hops=3, direction="followers")["reached"] == 3
+        assert graph.is_mutual(user_id[1], user_id[2])
+        assert not graph.is_mutual(user_id[2], user_id[3])
+        assert graph.mutual_follows(user_id[2]) == [user_id[1]]
+
+        # Incremental changes on top of the snapshot
+        graph.add(user_id[3], user_id[2])
+        graph.remove(user_id[2], user_id[1])
+        assert graph.is_mutual(user_id[2], user_id[3])
+        assert not graph.is_mutual(user_id[1], user_id[2])
+        graph.remove_user(user_id[4])
+        assert graph.reach(user_id[1], max_hops=3)["per_hop"] == [1, 1, 0]
+
+        # Compacted snapshot gives the same answers, and the deleted user is forgotten
+        await graph.compact()
+        assert graph.stats()["pending_changes"] == 0
+        assert not graph.deleted and user_id[4] not in graph.index
+        assert graph.reach(user_id[4]) is None
+        assert graph.is_mutual(user_id[2], user_id[3])
+        assert graph.mutual_follows(user_id[2]) == [user_id[3]]
+        # Edges to the deleted user are not counted
+        assert graph.degree_stats("following")["edges"] == 3
+
+        # Changes made while compacting are kept: pending edge removed, removed edge added back
+        graph.add(user_id[1], user_id[3])
+        graph.remove(user_id[2], user_id[3])
+        compaction = asyncio.create_task(graph.compact())
+        await asyncio.sleep(0)
+        graph.remove(user_id[1], user_id[3])
+        graph.add(user_id[2], user_id[3])
+        await compaction
+        assert not graph.has_edge(graph.index[user_id[1]], graph.index[user_id[3]])
+        assert graph.has_edge(graph.index[user_id[2]], graph.index[user_id[3]])
+        assert graph.is_mutual(user_id[2], user_id[3])
+
+        # Delete Dummy User as the test case already completede
+        for one_user_id in user_id.values():
+            response = await ac.delete(f"/users/{one_user_id}")
+            assert response.status_code == 204
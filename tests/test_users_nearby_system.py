@@ -1,10 +1,18 @@
 import os, sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+import asyncio
+from datetime import datetime, timezone
 import pytest
 from httpx import AsyncClient
 from httpx._transports.asgi import ASGITransport
 from app.main import app
+from app.models.location import location_buffer
+from app.models import live as live_model
+from app.models.grid import GeoGrid
+from app.core.cache import user_cache
+from app.models import nearby as nearby_query
+from app.models import user as user_model
 
 # Test Following and Unfollowing User
 @pytest.mark.asyncio
@@ -112,4 +120,568 @@ async def test_nearby_user():
 
         # Delete Dummy User as the test case already completede
         for one_user_id in user_id.keys():
-            response = await ac.delete(f"/users/{user_id[one_user_id]['id']}")
\ No newline at end of file
+            response = await ac.delete(f"/users/{user_id[one_user_id]['id']}")
+
+
+# Test Nearby Friends distance, k nearest and cursor pagination
+@pytest.mark.asyncio
+async def test_nearby_user_distance_and_pagination():
+
+    # Test User 1 at the center, the others further and further to the east
+    list_test_user = [
+        {
+            "username": f"test_user_{i}",
+            "name": f"Test User {i}",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8198 + (i - 1) * 0.001, 1.3521]
+            }
+        } for i in range(1, 6)
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+
+        # Create Necessary Dummy User for Test
+        user_id = {}
+        for test_user in list_test_user:
+            response = await ac.post("/users/", json=test_user)
+            user = response.json()
+            user_id[test_user['name']] = {"id": user["id"], "username": user["username"]}
+
+        for i in range(2, 6):
+            response = await ac.patch(f"/users/{user_id['Test User 1']['id']}/follow/{user_id[f'Test User {i}']['id']}")
+            assert response.status_code == 200
+
+        # k nearest, closest first with distance
+        response = await ac.get(f"/users/test_user_1/nearby-friends?distance=10000&k=2")
+        assert response.status_code == 200
+        first_page = response.json()
+        assert [friend["username"] for friend in first_page["nearby_friends"]] == ["test_user_2", "test_user_3"]
+        distances = [friend["distance_m"] for friend in first_page["nearby_friends"]]
+        assert 100 < distances[0] < distances[1] < 250
+        # Compact form, no follow arrays
+        assert "followers" not in first_page["nearby_friends"][0]
+        assert first_page["next_cursor"] is not None
+
+        # Next page continue from the cursor
+        response = await ac.get(f"/users/test_user_1/nearby-friends", params={"distance": 10000, "limit": 2, "after": first_page["next_cursor"]})
+        assert response.status_code == 200
+        second_page = response.json()
+        assert [friend["username"] for friend in second_page["nearby_friends"]] == ["test_user_4", "test_user_5"]
+        assert second_page["next_cursor"] is None
+
+        # Check Error Handling of invalid cursor
+        response = await ac.get(f"/users/test_user_1/nearby-friends?after=not-a-cursor")
+        assert response.status_code == 400
+
+        # Delete Dummy User as the test case already completede
+        for one_user_id in user_id.keys():
+            response = await ac.delete(f"/users/{user_id[one_user_id]['id']}")
+
+# Test Search Every User inside circle, bounding box and polygon
+@pytest.mark.asyncio
+async def test_search_users_in_area():
+
+    list_test_user = [
+        {
+            "username": "test_user_area_1",
+            "name": "Test User Area 1",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8198,1.3521]
+            }
+        },
+        {
+            "username": "test_user_area_2",
+            "name": "Test User Area 2",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8200,1.3530]
+            }
+        },
+        {
+            "username": "test_user_area_3",
+            "name": "Test User Area 3",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8000,1.4500]
+            }
+        }
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+
+        # Create Necessary Dummy User for Test
+        user_id = {}
+        for test_user in list_test_user:
+            response = await ac.post("/users/", json=test_user)
+            user = response.json()
+            user_id[test_user['username']] = user["id"]
+
+        async def search_all(params):
+            found = []
+            after = None
+            while True:
+                page_params = dict(params, limit=1)
+                if after:
+                    page_params["after"] = after
+                response = await ac.get("/users/nearby", params=page_params)
+                assert response.status_code == 200
+                page = response.json()
+                found += [user["username"] for user in page["users"]]
+                after = page["next_cursor"]
+                if after is None:
+                    return found
+
+        areas = [
+            {"lng": 103.8198, "lat": 1.3521, "radius": 1000},
+            {"bbox": "103.81,1.34,103.83,1.36"},
+            {"polygon": "103.81,1.34;103.83,1.34;103.83,1.36;103.81,1.36"}
+        ]
+        for area in areas:
+            found = await search_all(area)
+            # Within area
+            assert "test_user_area_1" in found
+            assert "test_user_area_2" in found
+            # Out of area (too far)
+            assert "test_user_area_3" not in found
+
+        # Check Error Handling of missing or multiple area
+        response = await ac.get("/users/nearby")
+        assert response.status_code == 400
+        response = await ac.get("/users/nearby", params={"bbox": "103.81,1.34,103.83,1.36", "lng": 103.8, "lat": 1.3, "radius": 10})
+        assert response.status_code == 400
+        # Check Error Handling of invalid cursor
+        response = await ac.get("/users/nearby", params={"bbox": "103.81,1.34,103.83,1.36", "after": "invalid"})
+        assert response.status_code == 400
+
+        # Delete Dummy User as the test case already completede
+        for one_user_id in user_id.keys():
+            response = await ac.delete(f"/users/{user_id[one_user_id]}")
+
+# Test Location Ping (buffered and coalesced)
+@pytest.mark.asyncio
+async def test_location_ping():
+
+    test_user = {
+        "username": "test_user_ping_1",
+        "name": "Test User Ping 1",
+        "dob": "1999-12-31",
+        "address": "123 Testing Lane",
+        "description": "Just a test user",
+        "location": {
+            "type": "Point",
+            "coordinates": [103.8198,1.3521]
+        }
+    }
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+
+        # Create Necessary Dummy User for Test
+        response = await ac.post("/users/", json=test_user)
+        user_id = response.json()["id"]
+
+        coalesced_before = location_buffer.stats()["coalesced"]
+        pings = [
+            {"location": {"type": "Point", "coordinates": [103.8300,1.3600]}, "timestamp": "2024-01-01T08:00:00Z"},
+            {"location": {"type": "Point", "coordinates": [103.8400,1.3700]}, "timestamp": "2024-01-01T08:00:02Z"},
+            # Out of order, older than the previous one
+            {"location": {"type": "Point", "coordinates": [103.8500,1.3800]}, "timestamp": "2024-01-01T08:00:01Z"}
+        ]
+        for ping in pings:
+            response = await ac.put(f"/users/{user_id}/location", json=ping)
+            assert response.status_code == 202
+
+        # Only the latest ping is written
+        await location_buffer.flush()
+        assert location_buffer.stats()["coalesced"] >= coalesced_before + 1
+        response = await ac.get(f"/users/{user_id}")
+        assert response.json()["location"]["coordinates"] == [103.8400,1.3700]
+
+        # Ping older than the stored location (already flushed) doesn't overwrite it, newer one does
+        ping = {"location": {"type": "Point", "coordinates": [103.8600,1.3900]}, "timestamp": "2024-01-01T15:00:01+07:00"}
+        await ac.put(f"/users/{user_id}/location", json=ping)
+        await location_buffer.flush()
+        response = await ac.get(f"/users/{user_id}")
+        assert response.json()["location"]["coordinates"] == [103.8400,1.3700]
+        ping = {"location": {"type": "Point", "coordinates": [103.8600,1.3900]}, "timestamp": "2024-01-01T08:00:03Z"}
+        await ac.put(f"/users/{user_id}/location", json=ping)
+        await location_buffer.flush()
+        response = await ac.get(f"/users/{user_id}")
+        assert response.json()["location"]["coordinates"] == [103.8600,1.3900]
+
+        # Ping dated in the future is taken as received now, so it doesn't block the next ping
+        ping = {"location": {"type": "Point", "coordinates": [103.8610,1.3910]}, "timestamp": "2999-01-01T00:00:00Z"}
+        await ac.put(f"/users/{user_id}/location", json=ping)
+        await location_buffer.flush()
+        await ac.put(f"/users/{user_id}/location", json={"location": {"type": "Point", "coordinates": [103.8620,1.3920]}})
+        await location_buffer.flush()
+        response = await ac.get(f"/users/{user_id}")
+        assert response.json()["location"]["coordinates"] == [103.8620,1.3920]
+
+        # Ping taken before a location update (PATCH) doesn't overwrite it
+        ping = {"location": {"type": "Point", "coordinates": [103.8630,1.3930]}, "timestamp": datetime.now(timezone.utc).isoformat()}
+        await ac.put(f"/users/{user_id}/location", json=ping)
+        await ac.patch(f"/users/{user_id}", json={"location": {"type": "Point", "coordinates": [103.8640,1.3940]}})
+        await location_buffer.flush()
+        response = await ac.get(f"/users/{user_id}")
+        assert response.json()["location"]["coordinates"] == [103.8640,1.3940]
+
+        # Check Error Handling of invalid ping
+        response = await ac.put(f"/users/{user_id}/location", json={"timestamp": "2024-01-01T08:00:00Z"})
+        assert response.status_code == 422
+        for coordinates in ([500, 500], [1], [103.8198, 1.3521, 5]):
+            response = await ac.put(f"/users/{user_id}/location", json={"location": {"type": "Point", "coordinates": coordinates}})
+            assert response.status_code == 400
+
+        # Ping rejected by MongoDB upon write is dropped, the rest of its batch is still written
+        response = await ac.post("/users/", json={**test_user, "username": "test_user_ping_2"})
+        other_id = response.json()["id"]
+        location_buffer.add(other_id, {"type": "Point", "coordinates": [500, 500]})
+        location_buffer.add(user_id, {"type": "Point", "coordinates": [103.8700,1.4000]})
+        await location_buffer.flush()
+        assert location_buffer.stats()["pending"] == 0
+        response = await ac.get(f"/users/{user_id}")
+        assert response.json()["location"]["coordinates"] == [103.8700,1.4000]
+        response = await ac.delete(f"/users/{other_id}")
+        assert response.status_code == 204
+
+        # Delete Dummy User as the test case already completede
+        response = await ac.delete(f"/users/{user_id}")
+        assert response.status_code == 204
+
+# Test Every Nearby Friends Query Strategy Gives the Same Pages and Cursors
+@pytest.mark.asyncio
+async def test_nearby_strategies_equivalence(monkeypatch):
+
+    # Several chunks even with few friends
+    monkeypatch.setattr(nearby_query, "NEARBY_CHUNK_SIZE", 2)
+
+    coordinates = {
+        "origin": [103.8198,1.3521],
+        # Same place twice, ordered by ID
+        "friend_1": [103.8210,1.3521],
+        "friend_2": [103.8210,1.3521],
+        "friend_3": [103.8230,1.3530],
+        "friend_4": [103.8250,1.3540],
+        "friend_5": [103.8300,1.3560],
+        "friend_6": [103.8400,1.3600],
+        "friend_far": [104.5000,1.3521],
+        "stranger": [103.8200,1.3521]
+    }
+    list_test_user = [
+        {
+            "username": f"test_user_strategy_{key}",
+            "name": f"Test User Strategy {key}",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": value
+            }
+        } for key, value in coordinates.items()
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+
+        # Create Necessary Dummy User for Test
+        user_id = {}
+        for test_user, key in zip(list_test_user, coordinates):
+            response = await ac.post("/users/", json=test_user)
+            user_id[key] = response.json()["id"]
+
+        friends = [key for key in coordinates if key.startswith("friend")]
+        response = await ac.post(f"/users/{user_id['origin']}/follow", json={"target_ids": [user_id[key] for key in friends]})
+        assert response.status_code == 200
+
+        # Walk every page with each strategy
+        pages = {}
+        for strategy in nearby_query.nearby_strategies:
+            pages[strategy] = []
+            cursor = None
+            while True:
+                result = await user_model.find_nearby_friends(
+                    "test_user_strategy_origin", max_distance_m=5000, limit=2, after=cursor, strategy=strategy
+                )
+                pages[strategy].append(result)
+                cursor = result["next_cursor"]
+                if cursor is None:
+                    break
+
+        assert pages[nearby_query.strategy_chunked] == pages[nearby_query.strategy_in_near]
+        assert pages[nearby_query.strategy_geo_first] == pages[nearby_query.strategy_in_near]
+
+        found = [friend["id"] for page in pages[nearby_query.strategy_in_near] for friend in page["nearby_friends"]]
+        same_place = sorted([user_id["friend_1"], user_id["friend_2"]])
+        assert found == same_place + [user_id[key] for key in ("friend_3", "friend_4", "friend_5", "friend_6")]
+
+        # Delete Dummy User as the test case already completede
+        for one_user_id in user_id.values():
+            response = await ac.delete(f"/users/{one_user_id}")
+            assert response.status_code == 204
+
+# Test Live Nearby Friends (needs MongoDB replica set, e.g. local single node replica set)
+@pytest.mark.asyncio
+async def test_live_nearby_friends():
+
+    if not await live_model.supports_change_streams():
+        pytest.skip("Change streams need MongoDB replica set")
+
+    list_test_user = [
+        {
+            "username": "test_user_live_1",
+            "name": "Test User Live 1",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8198,1.3521]
+            }
+        },
+        {
+            "username": "test_user_live_2",
+            "name": "Test User Live 2",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8200,1.3530]
+            }
+        },
+        {
+            "username": "test_user_live_3",
+            "name": "Test User Live 3",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8000,1.4500]
+            }
+        }
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+
+        # Create Necessary Dummy User for Test
+        user_id = {}
+        for test_user in list_test_user:
+            response = await ac.post("/users/", json=test_user)
+            user = response.json()
+            user_id[test_user['username']] = user["id"]
+        await ac.patch(f"/users/{user_id['test_user_live_1']}/follow/{user_id['test_user_live_2']}")
+        await ac.patch(f"/users/{user_id['test_user_live_1']}/follow/{user_id['test_user_live_3']}")
+
+        subscription = await live_model.subscribe_nearby_friends("test_user_live_1", max_distance_m=1000)
+        events = live_model.nearby_friend_events(subscription)
+
+        async def next_event():
+            while True:
+                event, data = await asyncio.wait_for(anext(events), timeout=10)
+                if event != "heartbeat":
+                    return event, data
+
+        try:
+            event, data = await next_event()
+            assert event == "snapshot"
+            assert [friend["username"] for friend in data["nearby_friends"]] == ["test_user_live_2"]
+
+            # Far friend comes closer
+            await ac.patch(f"/users/{user_id['test_user_live_3']}", json={"location": {"type": "Point", "coordinates": [103.8199,1.3525]}})
+            event, data = await next_event()
+            assert (event, data["username"]) == ("enter", "test_user_live_3")
+
+            # Near friend goes away
+            await ac.patch(f"/users/{user_id['test_user_live_2']}", json={"location": {"type": "Point", "coordinates": [103.9000,1.4000]}})
+            event, data = await next_event()
+            assert (event, data["username"]) == ("leave", "test_user_live_2")
+        finally:
+            await events.aclose()
+
+        # Check Error Handling of non-exist user
+        response = await ac.get("/users/test_user_live_none/nearby-friends/stream")
+        assert response.status_code == 404
+
+        # Delete Dummy User as the test case already completede
+        for one_user_id in user_id.values():
+            response = await ac.delete(f"/users/{one_user_id}")
+            assert response.status_code == 204
+
+# Test Nearby Grid gives the same result as MongoDB
+@pytest.mark.asyncio
+async def test_nearby_grid():
+
+    list_test_user = [
+        {
+            "username": "test_user_grid_1",
+            "name": "Test User Grid 1",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8198,1.3521]
+            }
+        },
+        {
+            "username": "test_user_grid_2",
+            "name": "Test User Grid 2",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8200,1.3530]
+            }
+        },
+        {
+            "username": "test_user_grid_3",
+            "name": "Test User Grid 3",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8250,1.3480]
+            }
+        },
+        {
+            "username": "test_user_grid_4",
+            "name": "Test User Grid 4",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8000,1.4500]
+            }
+        }
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+
+        # Create Necessary Dummy User for Test
+        user_id = {}
+        for test_user in list_test_user:
+            response = await ac.post("/users/", json=test_user)
+            user = response.json()
+            user_id[test_user['username']] = user["id"]
+        friend_ids = [user_id[f"test_user_grid_{i}"] for i in range(2, 5)]
+        for friend_id in friend_ids:
+            response = await ac.patch(f"/users/{user_id['test_user_grid_1']}/follow/{friend_id}")
+            assert response.status_code == 200
+
+        grid = GeoGrid(enabled=True)
+        await grid.load()
+
+        for distance in (100, 1000, 20000):
+            response = await ac.get("/users/test_user_grid_1/nearby-friends", params={"distance": distance})
+            expected = [(friend["id"], friend["distance_m"]) for friend in response.json()["nearby_friends"]]
+            docs = grid.query([103.8198,1.3521], friend_ids, distance, 100)
+            assert [(doc["_id"], round(doc["distance_m"], 2)) for doc in docs] == expected
+
+        # Moved and deleted user are kept up to date
+        grid.update(user_id["test_user_grid_4"], {"location": {"type": "Point", "coordinates": [103.8199,1.3522]}})
+        grid.remove(user_id["test_user_grid_2"])
+        docs = grid.query([103.8198,1.3521], friend_ids, 1000, 100)
+        assert [doc["username"] for doc in docs] == ["test_user_grid_4", "test_user_grid_3"]
+
+        # Delete Dummy User as the test case already completede
+        for one_user_id in user_id.values():
+            response = await ac.delete(f"/users/{one_user_id}")
+            assert response.status_code == 204
+
+# Test Nearby Friends Cache (distance bucket and movement threshold)
+@pytest.mark.asyncio
+async def test_nearby_friends_cache_movement():
+
+    list_test_user = [
+        {
+            "username": "test_user_move_1",
+            "name": "Test User Move 1",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8198,1.3521]
+            }
+        },
+        {
+            "username": "test_user_move_2",
+            "name": "Test User Move 2",
+            "dob": "1999-12-31",
+            "address": "123 Testing Lane",
+            "description": "Just a test user",
+            "location": {
+                "type": "Point",
+                "coordinates": [103.8198,1.3541]
+            }
+        }
+    ]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+
+        # Create Necessary Dummy User for Test
+        user_id = {}
+        for test_user in list_test_user:
+            response = await ac.post("/users/", json=test_user)
+            user = response.json()
+            user_id[test_user['username']] = user["id"]
+        await ac.patch(f"/users/{user_id['test_user_move_1']}/follow/{user_id['test_user_move_2']}")
+
+        # Friend is about 222 m away. Every distance below uses the same cached result (bucket 250 m)
+        response = await ac.get("/users/test_user_move_1/nearby-friends", params={"distance": 250})
+        assert [friend["username"] for friend in response.json()["nearby_friends"]] == ["test_user_move_2"]
+        response = await ac.get("/users/test_user_move_1/nearby-friends", params={"distance": 200})
+        assert response.json()["nearby_friends"] == []
+        response = await ac.get("/users/test_user_move_1/nearby-friends", params={"distance": 230})
+        assert [friend["username"] for friend in response.json()["nearby_friends"]] == ["test_user_move_2"]
+
+        # Short move (about 11 m) keeps the cached result, once its location is known
+        friend_id = user_id["test_user_move_2"]
+        await ac.patch(f"/users/{friend_id}", json={"location": {"type": "Point", "coordinates": [103.8198,1.3541]}})
+        await ac.get("/users/test_user_move_1/nearby-friends", params={"distance": 250})
+        await ac.patch(f"/users/{friend_id}", json={"location": {"type": "Point", "coordinates": [103.8198,1.3542]}})
+        assert await user_cache.get(f"nearby:{user_id['test_user_move_1']}", "250:100") is not None
+
+        # Long move invalidates it
+        await ac.patch(f"/users/{friend_id}", json={"location": {"type": "Point", "coordinates": [103.8198,1.3600]}})
+        response = await ac.get("/users/test_user_move_1/nearby-friends", params={"distance": 250})
+        assert response.json()["nearby_friends"] == []
+
+        # Removed location (null) invalidates it as well
+        await ac.patch(f"/users/{friend_id}", json={"location": {"type": "Point", "coordinates": [103.8198,1.3541]}})
+        response = await ac.get("/users/test_user_move_1/nearby-friends", params={"distance": 250})
+        assert len(response.json()["nearby_friends"]) == 1
+        response = await ac.patch(f"/users/{friend_id}", json={"location": None})
+        assert response.status_code == 200
+        response = await ac.get("/users/test_user_move_1/nearby-friends", params={"distance": 250})
+        assert response.json()["nearby_friends"] == []
+
+        # Delete Dummy User as the test case already completede
+        for one_user_id in user_id.values():
+            response = await ac.delete(f"/users/{one_user_id}")
+            assert response.status_code == 204